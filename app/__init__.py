@@ -3,8 +3,95 @@ from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.exc import SQLAlchemyError
 import os
 from client_integrations.providers import SmsProvider, EmailProvider
+from client_integrations.retry import RetryPolicy
+from client_integrations.rate_limit import RatePolicy, RateLimiter
+from client_integrations.circuit_breaker import CircuitBreaker
+from client_integrations.pool import ProviderPool
+from app.cache import ConversationCache, RecentIdFilter
+from app.replicas import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    return os.environ.get(name, str(default)).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _rate_limiter(name: str, prefix: str, engine=None):
+    """
+    Builds a provider's limiter from <PREFIX>_RATE_LIMIT (msgs/sec), <PREFIX>_RATE_BURST
+    and the optional <PREFIX>_SENDER_RATE_LIMIT / <PREFIX>_SENDER_RATE_BURST.
+    """
+    rate = os.environ.get(f'{prefix}_RATE_LIMIT')
+    if not rate:
+        return None
+    sender_rate = os.environ.get(f'{prefix}_SENDER_RATE_LIMIT')
+    policy = RatePolicy(
+        rate=float(rate),
+        burst=float(os.environ.get(f'{prefix}_RATE_BURST', 0)) or None,
+        per_sender_rate=float(sender_rate) if sender_rate else None,
+        per_sender_burst=float(os.environ.get(f'{prefix}_SENDER_RATE_BURST', 0)) or None
+    )
+    return RateLimiter(name, policy, engine=engine)
+
+
+def _engine_options(prefix: str) -> dict:
+    """
+    Pool and session settings for one engine from <PREFIX>_POOL_SIZE, <PREFIX>_MAX_OVERFLOW,
+    <PREFIX>_POOL_TIMEOUT, <PREFIX>_POOL_RECYCLE, <PREFIX>_POOL_PRE_PING and <PREFIX>_STATEMENT_TIMEOUT_MS.
+    """
+    options = {
+        "pool_size": int(os.environ.get(f'{prefix}_POOL_SIZE', 5)),
+        "max_overflow": int(os.environ.get(f'{prefix}_MAX_OVERFLOW', 10)),
+        "pool_timeout": float(os.environ.get(f'{prefix}_POOL_TIMEOUT', 30.0)),
+        "pool_recycle": int(os.environ.get(f'{prefix}_POOL_RECYCLE', -1)),
+        "pool_pre_ping": _env_bool(f'{prefix}_POOL_PRE_PING'),
+    }
+    statement_timeout = int(os.environ.get(f'{prefix}_STATEMENT_TIMEOUT_MS', 0))
+    if statement_timeout:
+        options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout}"}
+    return options
+
+
+def _circuit_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        failure_rate_threshold=float(os.environ.get('CIRCUIT_FAILURE_RATE', 0.5)),
+        window_seconds=float(os.environ.get('CIRCUIT_WINDOW_SECONDS', 30.0)),
+        minimum_calls=int(os.environ.get('CIRCUIT_MIN_CALLS', 10)),
+        open_seconds=float(os.environ.get('CIRCUIT_OPEN_SECONDS', 30.0)),
+        half_open_probes=int(os.environ.get('CIRCUIT_HALF_OPEN_PROBES', 3))
+    )
+
+
+def _build_provider(provider_class, endpoint_env: str, options: dict, rate_limiter=None):
+    """
+    One provider for <endpoint_env>, or a ProviderPool when <endpoint_env>S lists
+    several endpoints as 'url|weight,url|weight' (weight defaults to 1).
+    """
+    endpoints = [item.strip() for item in os.environ.get(f'{endpoint_env}S', '').split(',') if item.strip()]
+    if len(endpoints) < 2:
+        return provider_class(
+            endpoint=endpoints[0] if endpoints else os.environ[endpoint_env],
+            rate_limiter=rate_limiter,
+            circuit_breaker=_circuit_breaker(),
+            **options
+        )
+
+    members, weights = [], []
+    for item in endpoints:
+        url, _, weight = item.partition('|')
+        members.append(provider_class(endpoint=url, circuit_breaker=_circuit_breaker(), **options))
+        weights.append(float(weight or 1))
+    return ProviderPool(
+        members,
+        weights=weights,
+        hedge=_env_bool('PROVIDER_HEDGE'),
+        hedge_quantile=float(os.environ.get('PROVIDER_HEDGE_QUANTILE', 0.95)),
+        hedge_min_delay=float(os.environ.get('PROVIDER_HEDGE_MIN_DELAY', 0.05)),
+        rate_limiter=rate_limiter,
+        **options
+    )
 
-db = SQLAlchemy()
 
 def create_app():
     app = Flask(__name__)
@@ -15,22 +102,156 @@ def create_app():
         f"{os.environ['DB_HOST']}:5432/{os.environ['DB_NAME']}"
     )
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = _engine_options('DB')
+
+    # optional read replicas, as full URIs: GET requests read from one unless it lags
+    # more than REPLICA_MAX_LAG_SECONDS or the client wrote in the last READ_YOUR_WRITES_SECONDS
+    replica_urls = [url.strip() for url in os.environ.get('DB_REPLICA_URLS', '').split(',') if url.strip()]
+    app.config['SQLALCHEMY_BINDS'] = {
+        f'replica_{i}': {"url": url, **_engine_options('REPLICA')} for i, url in enumerate(replica_urls)
+    }
+    app.config['REPLICA_MAX_LAG_SECONDS'] = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5.0))
+    app.config['REPLICA_LAG_CHECK_INTERVAL'] = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', 1.0))
+    app.config['READ_YOUR_WRITES_SECONDS'] = float(os.environ.get('READ_YOUR_WRITES_SECONDS', 5.0))
     db.init_app(app)
 
+    # outbox mode: outbound sends are queued and dispatched by background workers
+    app.config['OUTBOX_ENABLED'] = _env_bool('OUTBOX_ENABLED')
+    app.config['OUTBOX_INPROCESS'] = _env_bool('OUTBOX_INPROCESS')
+    app.config['OUTBOX_WORKERS'] = int(os.environ.get('OUTBOX_WORKERS', 4))
+    app.config['OUTBOX_BATCH_SIZE'] = int(os.environ.get('OUTBOX_BATCH_SIZE', 50))
+    app.config['OUTBOX_POLL_INTERVAL'] = float(os.environ.get('OUTBOX_POLL_INTERVAL', 1.0))
+    app.config['OUTBOX_LEASE_SECONDS'] = float(os.environ.get('OUTBOX_LEASE_SECONDS', 60.0))
+    # queue sends for the dispatcher while a provider's circuit is open
+    app.config['OUTBOX_DEFER_WHEN_OPEN'] = _env_bool('OUTBOX_DEFER_WHEN_OPEN')
+
+    app.config['WEBHOOK_BATCH_MAX'] = int(os.environ.get('WEBHOOK_BATCH_MAX', 5000))
+
+    # broadcasts are sent through the outbox; unless `flask dispatch` workers run
+    # elsewhere, the first broadcast starts the in-process dispatcher
+    app.config['BROADCAST_MAX_RECIPIENTS'] = int(os.environ.get('BROADCAST_MAX_RECIPIENTS', 50000))
+    app.config['BROADCAST_INPROCESS_DISPATCH'] = _env_bool('BROADCAST_INPROCESS_DISPATCH', True)
+
+    # live message streams: SSE keep-alive interval and the longest a long-poll may wait
+    app.config['STREAM_HEARTBEAT_SECONDS'] = float(os.environ.get('STREAM_HEARTBEAT_SECONDS', 15.0))
+    app.config['LONG_POLL_MAX_SECONDS'] = float(os.environ.get('LONG_POLL_MAX_SECONDS', 30.0))
+
+    # request/query/provider metrics on /metrics; requests slower than SLOW_REQUEST_MS
+    # (0 disables) are logged with a per-phase breakdown, SLOW_REQUEST_SAMPLE_RATE of them
+    app.config['METRICS_ENABLED'] = _env_bool('METRICS_ENABLED', True)
+    app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 0))
+    app.config['SLOW_REQUEST_SAMPLE_RATE'] = float(os.environ.get('SLOW_REQUEST_SAMPLE_RATE', 1.0))
+
+    # group commit: single webhooks are buffered and committed together by a flusher thread
+    app.config['GROUP_COMMIT_ENABLED'] = _env_bool('GROUP_COMMIT_ENABLED')
+    app.config['GROUP_COMMIT_MAX_BATCH'] = int(os.environ.get('GROUP_COMMIT_MAX_BATCH', 500))
+    app.config['GROUP_COMMIT_MAX_DELAY_MS'] = float(os.environ.get('GROUP_COMMIT_MAX_DELAY_MS', 5.0))
+    app.config['GROUP_COMMIT_MAX_QUEUE'] = int(os.environ.get('GROUP_COMMIT_MAX_QUEUE', 10000))
+    app.config['GROUP_COMMIT_TIMEOUT'] = float(os.environ.get('GROUP_COMMIT_TIMEOUT', 10.0))
+
+    # messages is partitioned by month: partitions are created MONTHS_AHEAD in advance and,
+    # with a retention period (0 keeps everything), older months are archived to ARCHIVE_DIR.
+    # Without one, past months get partitions MONTHS_BACK at most
+    app.config['MESSAGE_PARTITION_MONTHS_AHEAD'] = int(os.environ.get('MESSAGE_PARTITION_MONTHS_AHEAD', 3))
+    app.config['MESSAGE_PARTITION_MONTHS_BACK'] = int(os.environ.get('MESSAGE_PARTITION_MONTHS_BACK', 24))
+    app.config['MESSAGE_RETENTION_MONTHS'] = int(os.environ.get('MESSAGE_RETENTION_MONTHS', 0))
+    app.config['MESSAGE_ARCHIVE_DIR'] = os.environ.get('MESSAGE_ARCHIVE_DIR', 'archive')
+    app.config['PARTITION_MAINTENANCE_INTERVAL'] = float(os.environ.get('PARTITION_MAINTENANCE_INTERVAL', 3600.0))
+
+    # participant pair -> conversation id, skips the conversation upsert for active pairs
+    cache_size = int(os.environ.get('CONVERSATION_CACHE_SIZE', 10000))
+    app.config['conversation_cache'] = ConversationCache(
+        max_size=cache_size,
+        ttl_seconds=float(os.environ.get('CONVERSATION_CACHE_TTL', 300.0))
+    ) if cache_size > 0 else None
+    # recently stored inbound provider ids, answers webhook redeliveries without a query
+    filter_size = int(os.environ.get('RECENT_MESSAGE_ID_FILTER_SIZE', 100000))
+    app.config['recent_message_ids'] = RecentIdFilter(filter_size) if filter_size > 0 else None
+
     print('CREATING TABLES')
     with app.app_context():
         from . import models
+        from .migrations import run_migrations
         try:
-            db.create_all()
+            # replicas get their schema from the primary
+            db.create_all(bind_key=None)
             print('TABLES CREATED!')
         except SQLAlchemyError as e:
             print(f"Database creation error: {e}")
+        try:
+            run_migrations()
+        except SQLAlchemyError as e:
+            print(f"Database migration error: {e}")
+
+        from app.partitions import maintainer_from_config
+        app.extensions['partition_maintainer'] = maintainer_from_config(app)
+        try:
+            # partitions for this month on must exist before the first insert;
+            # archiving waits for the background pass
+            app.extensions['partition_maintainer'].run(archive=False)
+        except SQLAlchemyError as e:
+            print(f"Partition maintenance error: {e}")
+
+        provider_options = {
+            "connect_timeout": float(os.environ.get('PROVIDER_CONNECT_TIMEOUT', 3.05)),
+            "read_timeout": float(os.environ.get('PROVIDER_READ_TIMEOUT', 10.0)),
+            "pool_maxsize": int(os.environ.get('PROVIDER_POOL_SIZE', 10)),
+            "retry_policy": RetryPolicy(
+                max_retries=int(os.environ.get('PROVIDER_MAX_RETRIES', 3)),
+                base_delay=float(os.environ.get('PROVIDER_RETRY_BASE_DELAY', 2.0)),
+                max_delay=float(os.environ.get('PROVIDER_RETRY_MAX_DELAY', 30.0)),
+                max_elapsed=float(os.environ.get('PROVIDER_RETRY_BUDGET', 60.0))
+            ),
+        }
+        # 'postgres' shares each provider's budget across all workers and hosts
+        limiter_engine = db.engine if os.environ.get('RATE_LIMIT_BACKEND') == 'postgres' else None
+        app.config['sms_provider'] = _build_provider(
+            SmsProvider, 'VERIZON_POST_ENDPOINT', provider_options,
+            rate_limiter=_rate_limiter('sms', 'SMS', limiter_engine)
+        )
+        app.config['email_provider'] = _build_provider(
+            EmailProvider, 'GMAIL_POST_ENDPOINT', provider_options,
+            rate_limiter=_rate_limiter('email', 'EMAIL', limiter_engine)
+        )
 
-        app.config['sms_provider'] = SmsProvider(endpoint=os.environ['VERIZON_POST_ENDPOINT'])
-        app.config['email_provider'] = EmailProvider(endpoint=os.environ['GMAIL_POST_ENDPOINT'])
+        # no real carrier accounts in dev/test, answer sends locally
+        if _env_bool('PROVIDER_SIMULATION'):
+            print('PROVIDER SIMULATION ENABLED')
+            app.config['sms_provider'].simulate('sms')
+            app.config['email_provider'].simulate('email')
 
         from . import routes
         from app.routes import api
         app.register_blueprint(api)
 
+        if app.config['SQLALCHEMY_BINDS']:
+            from app.replicas import router_from_config
+            print(f"ROUTING READS TO {len(app.config['SQLALCHEMY_BINDS'])} REPLICA(S)")
+            app.extensions['replica_router'] = router_from_config(
+                app, {name: db.engines[name] for name in app.config['SQLALCHEMY_BINDS']}
+            )
+
+        if app.config['METRICS_ENABLED']:
+            from app.metrics import metrics_from_config
+            app.extensions['metrics'] = metrics_from_config(app)
+
+    if app.config['GROUP_COMMIT_ENABLED']:
+        from app.group_commit import group_commit_from_config
+        print('GROUP COMMIT ENABLED FOR WEBHOOKS')
+        app.extensions['group_commit'] = group_commit_from_config(app)
+
+    # LISTENs for new messages once the first stream subscribes
+    from app.notifications import notifier_from_config
+    app.extensions['message_notifier'] = notifier_from_config(app)
+
+    from app import partitions
+    partitions.register_cli(app)
+    app.extensions['partition_maintainer'].start()
+
+    from app.dispatcher import register_cli, ensure_inprocess_dispatcher
+    register_cli(app)
+    if app.config['OUTBOX_ENABLED'] and app.config['OUTBOX_INPROCESS']:
+        print('STARTING IN-PROCESS OUTBOX DISPATCHERS')
+        ensure_inprocess_dispatcher(app)
+
     return app
@@ -0,0 +1,60 @@
+from email.utils import parseaddr
+from functools import lru_cache
+
+import phonenumbers
+
+# distinct phone numbers whose parse results are kept
+PHONE_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=PHONE_CACHE_SIZE)
+def normalize_phone(number: str) -> str | None:
+    """
+    The number in E.164 form ("+1 201-666-1234" -> "+12016661234"),
+    or None if it isn't a valid international number.
+    """
+    try:
+        parsed = phonenumbers.parse(number, None)
+    except phonenumbers.NumberParseException:
+        return None
+    if not (phonenumbers.is_possible_number(parsed) and phonenumbers.is_valid_number(parsed)):
+        return None
+    return phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
+
+
+def normalize_email(address: str) -> str | None:
+    """
+    Bare, lowercased address ("Jane <Jane@Example.com>" -> "jane@example.com"),
+    or None if it doesn't look like local@domain.
+    """
+    _, address = parseaddr(address)
+    local, at, domain = address.strip().lower().rpartition('@')
+    if not at or not local or not domain or ' ' in local or ' ' in domain:
+        return None
+    return f"{local}@{domain}"
+
+
+def normalize_address(address, is_email: bool) -> str | None:
+    if not isinstance(address, str):
+        return None
+    return normalize_email(address) if is_email else normalize_phone(address.strip())
+
+
+def canonical_address(address: str, msg_type: str) -> str:
+    """
+    The form addresses are stored and grouped by. Payloads are validated
+    before they get here, anything that still doesn't normalize is kept as sent.
+    """
+    return normalize_address(address, msg_type == 'email') or address.strip()
+
+
+def get_stats() -> dict:
+    info = normalize_phone.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "size": info.currsize,
+        "max_size": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": round(info.hits / lookups, 3) if lookups else 0.0
+    }
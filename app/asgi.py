@@ -0,0 +1,90 @@
+import os
+
+from a2wsgi import WSGIMiddleware
+from quart import Quart
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import HTTPException
+
+from app import create_app, _engine_options, _env_bool
+from client_integrations.async_providers import AsyncProvider, AsyncSmsProvider, AsyncEmailProvider, async_provider
+
+
+class RouteSplitter:
+    """
+    ASGI app that serves the routes async_app defines itself and hands every
+    other request to the sync Flask app on a thread pool.
+    """
+
+    def __init__(self, async_app, sync_app, threads: int):
+        self.async_app = async_app
+        self.sync_app = WSGIMiddleware(sync_app, workers=threads)
+        self._urls = async_app.url_map.bind('')
+
+    def is_async(self, scope) -> bool:
+        try:
+            self._urls.match(scope['path'], method=scope['method'])
+            return True
+        except HTTPException:
+            # not found, wrong method or a redirect: the sync app answers those
+            return False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not self.is_async(scope):
+            return await self.sync_app(scope, receive, send)
+        return await self.async_app(scope, receive, send)
+
+
+def _async_engine_options() -> dict:
+    """
+    _engine_options('DB') for asyncpg, which takes server settings rather
+    than a libpq options string.
+    """
+    options = _engine_options('DB')
+    options.pop('connect_args', None)
+    statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    if statement_timeout:
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(statement_timeout)}}
+    return options
+
+
+def create_async_app():
+    """
+    create_app() behind an ASGI server: sends, webhooks and listings run as
+    coroutines on asyncpg and httpx, everything else on the sync app.
+    Serve with an ASGI server, e.g. hypercorn 'app.asgi:create_async_app()'.
+    """
+    sync_app = create_app()
+    app = Quart(__name__, static_folder=None)
+    # the same settings, conversation cache and recent id filter as the sync app
+    app.config.update(sync_app.config)
+    app.config['ASYNC_PROVIDER_POOL_SIZE'] = int(os.environ.get('ASYNC_PROVIDER_POOL_SIZE', 100))
+    app.config['ASYNC_SYNC_THREADS'] = int(os.environ.get('ASYNC_SYNC_THREADS', 32))
+
+    print('CONNECTING TO DB (asyncpg)')
+    app.extensions['async_engine'] = create_async_engine(
+        sync_app.config['SQLALCHEMY_DATABASE_URI'].replace('postgresql://', 'postgresql+asyncpg://', 1),
+        **_async_engine_options()
+    )
+    if 'group_commit' in sync_app.extensions:
+        app.extensions['group_commit'] = sync_app.extensions['group_commit']
+
+    # same endpoints, stats, limits and circuits as the sync providers
+    pool_size = app.config['ASYNC_PROVIDER_POOL_SIZE']
+    app.config['sms_provider'] = async_provider(sync_app.config['sms_provider'], AsyncSmsProvider, pool_size)
+    app.config['email_provider'] = async_provider(sync_app.config['email_provider'], AsyncEmailProvider, pool_size)
+    if _env_bool('PROVIDER_SIMULATION'):
+        for name in ('sms', 'email'):
+            provider = app.config[f'{name}_provider']
+            if isinstance(provider, AsyncProvider):
+                provider.simulate(name)
+
+    from app.async_routes import api
+    app.register_blueprint(api)
+
+    @app.after_serving
+    async def shutdown():
+        await app.config['sms_provider'].aclose()
+        await app.config['email_provider'].aclose()
+        await app.extensions['async_engine'].dispose()
+
+    return RouteSplitter(app, sync_app, app.config['ASYNC_SYNC_THREADS'])
@@ -0,0 +1,172 @@
+import asyncio
+
+from quart import Blueprint, Response, request, jsonify, current_app
+
+from app.addresses import normalize_address
+from app.async_service import (
+    send_message, save_inbound_message, get_conversations_all, get_conversations_for_participant,
+    get_messages_by_conversations
+)
+from app.group_commit import BufferFull
+from app.routes import payload_error, page_args_error, inbound_message
+from app.serialization import dumps, records
+
+# The hot endpoints of routes.py as coroutines, served by create_async_app.
+# Validation and response bodies are shared with the sync routes, so both
+# modes answer the same requests the same way.
+
+api = Blueprint('async_api', __name__)
+
+
+def json_response(payload, status: int = 200) -> Response:
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+
+async def message_payload(inbound=False, is_email=False) -> tuple:
+    """
+    (payload, None) or (None, error response).
+    """
+    data = await request.get_json()
+    error = payload_error(data, inbound=inbound, is_email=is_email)
+    if error:
+        return None, (jsonify({"error": error}), 400)
+    return data, None
+
+
+def page_args() -> tuple:
+    args, error = page_args_error(request.args)
+    if error:
+        return None, (jsonify({"error": error}), 400)
+    return args, None
+
+
+# --- Outbound Message Endpoints ---
+
+@api.route('/api/messages/sms', methods=['POST'])
+async def send_sms():
+    data, error = await message_payload()
+    if error:
+        return error
+    return await send(data, data['type'])
+
+
+@api.route('/api/messages/email', methods=['POST'])
+async def send_email():
+    data, error = await message_payload(is_email=True)
+    if error:
+        return error
+    return await send(data, 'email')
+
+
+async def send(data: dict, msg_type: str):
+    try:
+        result = await send_message(
+            from_address=data['from'],
+            to_address=data['to'],
+            msg_type=msg_type,
+            body=data['body'],
+            attachments=data.get('attachments', []),
+            timestamp=data['timestamp']
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if result.queued:
+        return jsonify({"message_id": str(result.message_id), "status": "queued"}), 202
+    return jsonify({"message_id": str(result.message_id)}), 201
+
+
+# --- Inbound Webhook Endpoints ---
+
+@api.route('/api/webhooks/sms', methods=['POST'])
+async def receive_sms_webhook():
+    data, error = await message_payload(inbound=True)
+    if error:
+        return error
+    return await ingest_webhook(data)
+
+
+@api.route('/api/webhooks/email', methods=['POST'])
+async def receive_email_webhook():
+    data, error = await message_payload(inbound=True, is_email=True)
+    if error:
+        return error
+    return await ingest_webhook(data, is_email=True)
+
+
+async def ingest_webhook(data: dict, is_email: bool = False):
+    """
+    routes.ingest_webhook; with group commit the request awaits the sync
+    app's flusher instead of holding a thread on it.
+    """
+    buffer = current_app.extensions.get('group_commit')
+    try:
+        message = inbound_message(data, is_email)
+        if buffer is None:
+            saved = await save_inbound_message(**message)
+        else:
+            saved = await asyncio.wait_for(
+                asyncio.wrap_future(buffer.submit('inbound', message)),
+                current_app.config['GROUP_COMMIT_TIMEOUT']
+            )
+    except BufferFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+    except asyncio.TimeoutError:
+        return jsonify({"error": "Timed out waiting for the message to be saved"}), 503, {"Retry-After": "1"}
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    if saved.duplicate:
+        return jsonify({"message_id": str(saved.message_id), "duplicate": True}), 200
+    return jsonify({"message_id": str(saved.message_id)}), 201
+
+
+# --- Conversation Endpoints ---
+
+@api.route('/api/conversations', methods=['GET'])
+async def get_conversations():
+    args, error = page_args()
+    if error:
+        return error
+    try:
+        page = await get_conversations_all(**args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return conversations_response(page)
+
+
+@api.route('/api/participants/<address>/conversations', methods=['GET'])
+async def get_participant_conversations(address):
+    canonical = normalize_address(address, is_email='@' in address)
+    if canonical is None:
+        return jsonify({"error": "Address must be a valid phone number or email address"}), 400
+    args, error = page_args()
+    if error:
+        return error
+    try:
+        page = await get_conversations_for_participant(canonical, **args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return conversations_response(page)
+
+
+def conversations_response(page):
+    return json_response({
+        "conversations": records(page.items),
+        "next_cursor": page.next_cursor,
+        "prev_cursor": page.prev_cursor
+    })
+
+
+@api.route('/api/conversations/<uuid:conversation_id>/messages', methods=['GET'])
+async def get_conversation_messages(conversation_id):
+    args, error = page_args()
+    if error:
+        return error
+    try:
+        page = await get_messages_by_conversations(conversation_id, **args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return json_response({
+        "messages": records(page.items),
+        "next_cursor": page.next_cursor,
+        "prev_cursor": page.prev_cursor
+    })
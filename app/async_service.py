@@ -0,0 +1,240 @@
+from datetime import datetime, timezone
+import logging
+from typing import NamedTuple
+import uuid
+
+from quart import current_app
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.addresses import canonical_address
+from app.models import Message, Conversation, OutboxEntry, InboundMessageId
+from app.service import (
+    CONVERSATION_LISTING_COLUMNS, MESSAGE_LISTING_COLUMNS, DEFAULT_PAGE_SIZE, Page, SavedMessage,
+    participant_key, conversation_upsert, inbound_insert, is_foreign_key_violation,
+    keyset_query, keyset_result, participant_branches, parse_timestamp, inbound_key
+)
+
+# The asyncio counterparts of service.py's hot paths, on an AsyncEngine (asyncpg).
+# Statements come from the same builders as the sync versions, and the
+# conversation cache and recent id filter are the ones the sync app uses.
+
+
+class AsyncSendResult(NamedTuple):
+    message_id: uuid.UUID
+    queued: bool  # True when left to the outbox dispatcher rather than sent inline
+
+
+def get_engine():
+    return current_app.extensions['async_engine']
+
+
+def get_conversation_cache():
+    return current_app.config.get('conversation_cache')
+
+
+def get_recent_id_filter():
+    return current_app.config.get('recent_message_ids')
+
+
+def utcnow() -> datetime:
+    # asyncpg won't bind aware datetimes to the (naive UTC) timestamp columns
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+async def get_or_create_conversation_id(conn, from_address: str, to_address: str) -> uuid.UUID:
+    key = participant_key(from_address, to_address)
+    cache = get_conversation_cache()
+    if cache is not None:
+        conversation_id = cache.get(key)
+        if conversation_id is not None:
+            return conversation_id
+
+    result = await conn.execute(conversation_upsert(from_address, to_address, key, utcnow()))
+    conversation_id = result.scalar_one()
+    if cache is not None:
+        cache.put(key, conversation_id)
+    return conversation_id
+
+
+async def save_message(direction: str, from_address: str, to_address: str, msg_type: str, body: str,
+                       attachments: list, timestamp: str, provider_message_id=None,
+                       queue: bool = False) -> uuid.UUID:
+    """
+    Finds or creates a conversation and saves a message tied to it, in one
+    transaction. With queue=True an outbox entry for the message goes in the
+    same transaction. Returns the message id.
+    """
+    from_address = canonical_address(from_address, msg_type)
+    to_address = canonical_address(to_address, msg_type)
+    timestamp = parse_timestamp(timestamp)
+
+    for attempt in range(2):
+        message_id = uuid.uuid4()
+        try:
+            async with get_engine().begin() as conn:
+                conversation_id = await get_or_create_conversation_id(conn, from_address, to_address)
+                now = utcnow()
+                await conn.execute(insert(Message.__table__).values(
+                    id=message_id,
+                    conversation_id=conversation_id,
+                    direction=direction,
+                    from_address=from_address,
+                    to_address=to_address,
+                    type=msg_type,
+                    body=body,
+                    attachments=attachments or [],
+                    provider_message_id=provider_message_id,
+                    timestamp=timestamp,
+                    created_at=now
+                ))
+                if queue:
+                    await conn.execute(insert(OutboxEntry.__table__).values(
+                        id=uuid.uuid4(), message_id=message_id, message_timestamp=timestamp,
+                        status='pending', attempts=0, next_attempt_at=now, created_at=now
+                    ))
+            return message_id
+        except SQLAlchemyError as e:
+            cache = get_conversation_cache()
+            if attempt == 0 and cache is not None and is_foreign_key_violation(e):
+                # the cached conversation is gone; look it up again
+                cache.invalidate(participant_key(from_address, to_address))
+                continue
+            raise RuntimeError(f"Failed to save message: {e}")
+
+
+async def save_inbound_message(from_address: str, to_address: str, msg_type: str, body: str,
+                               attachments: list, timestamp: str, provider_message_id=None) -> SavedMessage:
+    """
+    service.save_inbound_message: once per inbound_key, with
+    redeliveries answered from the recent id filter when possible.
+    """
+    from_address = canonical_address(from_address, msg_type)
+    to_address = canonical_address(to_address, msg_type)
+    if not provider_message_id:
+        message_id = await save_message('inbound', from_address, to_address, msg_type, body, attachments, timestamp)
+        return SavedMessage(message_id, False)
+
+    key = inbound_key(msg_type, provider_message_id)
+    recent = get_recent_id_filter()
+    if recent is not None:
+        message_id = recent.get(key)
+        if message_id is not None:
+            return SavedMessage(message_id, True)
+
+    timestamp = parse_timestamp(timestamp)
+    for attempt in range(2):
+        try:
+            async with get_engine().begin() as conn:
+                conversation_id = await get_or_create_conversation_id(conn, from_address, to_address)
+                stmt = inbound_insert(conversation_id, from_address, to_address, msg_type, body, attachments,
+                                      timestamp, provider_message_id, utcnow())
+                row = (await conn.execute(stmt)).first()
+                if row is None:
+                    # lost a race with a copy committed after this statement's snapshot
+                    existing = await conn.execute(select(InboundMessageId.message_id).where(
+                        InboundMessageId.type == msg_type, InboundMessageId.provider_message_id == provider_message_id
+                    ))
+                    row = (existing.scalar_one(), True)
+        except SQLAlchemyError as e:
+            cache = get_conversation_cache()
+            if attempt == 0 and cache is not None and is_foreign_key_violation(e):
+                cache.invalidate(participant_key(from_address, to_address))
+                continue
+            raise RuntimeError(f"Failed to save message: {e}")
+
+        if recent is not None:
+            recent.add(key, row[0])
+        return SavedMessage(row[0], row[1])
+
+
+def get_provider(msg_type: str):
+    if msg_type == "sms" or msg_type == "mms":
+        return current_app.config['sms_provider']
+    elif msg_type == "email":
+        return current_app.config['email_provider']
+    raise ValueError(f"Unsupported message type: {msg_type}")
+
+
+async def send_message(from_address: str, to_address: str, msg_type: str, body: str,
+                       attachments: list, timestamp: str) -> AsyncSendResult:
+    """
+    service.send_message: saves the message, then sends it with the async
+    provider, or queues it for the outbox dispatcher in outbox mode.
+    """
+    provider = get_provider(msg_type)
+    from_address = canonical_address(from_address, msg_type)
+    to_address = canonical_address(to_address, msg_type)
+
+    queue = current_app.config.get('OUTBOX_ENABLED') or (
+        current_app.config.get('OUTBOX_DEFER_WHEN_OPEN') and provider.circuit_open()
+    )
+    message_id = await save_message('outbound', from_address, to_address, msg_type, body, attachments,
+                                    timestamp, queue=queue)
+    if queue:
+        return AsyncSendResult(message_id, True)
+
+    engine = get_engine()
+    try:
+        external_id = await provider.send_with_retry({
+            "from": from_address,
+            "to": to_address,
+            "body": body,
+            "attachments": attachments,
+            "timestamp": timestamp
+        }, on_complete=lambda provider_id: record_provider_message_id(engine, message_id, timestamp, provider_id))
+        if external_id:
+            await record_provider_message_id(engine, message_id, timestamp, external_id)
+    except Exception as e:
+        # outbound messages without a provider_message_id can be assumed to have failed
+        logging.info(f"Message sending failed: {e}")
+
+    return AsyncSendResult(message_id, False)
+
+
+async def record_provider_message_id(engine, message_id, timestamp: str, provider_message_id):
+    if not provider_message_id:
+        logging.info(f"Message sending failed after retries: {message_id}")
+        return
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(
+                update(Message.__table__)
+                .where(Message.id == message_id, Message.timestamp == parse_timestamp(timestamp))
+                .values(provider_message_id=provider_message_id)
+            )
+    except SQLAlchemyError as e:
+        logging.info(f"Failed to record provider id for {message_id}: {e}")
+
+
+async def keyset_page(query, sort_column, id_column, limit: int, after: str = None,
+                      before: str = None, descending: bool = False) -> Page:
+    stmt = keyset_query(query, sort_column, id_column, limit, after, before, descending)
+    async with get_engine().connect() as conn:
+        rows = (await conn.execute(stmt)).all()
+    return keyset_result(rows, sort_column, limit, after, before)
+
+
+async def get_conversations_all(limit: int = DEFAULT_PAGE_SIZE, after: str = None, before: str = None) -> Page:
+    return await keyset_page(
+        select(*CONVERSATION_LISTING_COLUMNS), Conversation.last_message_at, Conversation.id,
+        limit, after=after, before=before, descending=True
+    )
+
+
+async def get_conversations_for_participant(address: str, limit: int = DEFAULT_PAGE_SIZE,
+                                            after: str = None, before: str = None) -> Page:
+    return await keyset_page(
+        participant_branches(select(*CONVERSATION_LISTING_COLUMNS), address),
+        Conversation.last_message_at, Conversation.id,
+        limit, after=after, before=before, descending=True
+    )
+
+
+async def get_messages_by_conversations(conversation_id, limit: int = DEFAULT_PAGE_SIZE,
+                                        after: str = None, before: str = None) -> Page:
+    return await keyset_page(
+        select(*MESSAGE_LISTING_COLUMNS).where(Message.conversation_id == conversation_id),
+        Message.timestamp, Message.id,
+        limit, after=after, before=before
+    )
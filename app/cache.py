@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ConversationCache:
+    """
+    Bounded LRU of participant_key -> conversation id, so writes for active
+    pairs skip the conversation upsert. Entries expire after ttl_seconds,
+    which bounds how long another process's delete or merge can go unnoticed
+    here; a stale id is also caught by the messages FK and evicted.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 300.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (conversation_id, expires_at)
+        self._keys_by_id = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: str):
+        """
+        The cached conversation id, or None.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[1] <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, conversation_id):
+        """
+        Caches a conversation id that was just read or written.
+        """
+        if self.max_size <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (conversation_id, now + self.ttl_seconds)
+            self._keys_by_id[conversation_id] = key
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_id(self, conversation_id):
+        """
+        For deleted or merged-away conversations.
+        """
+        with self._lock:
+            key = self._keys_by_id.get(conversation_id)
+            if key is not None:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._keys_by_id.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+    def _remove(self, key: str):
+        conversation_id = self._entries.pop(key)[0]
+        if self._keys_by_id.get(conversation_id) == key:
+            del self._keys_by_id[conversation_id]
+
+
+class RecentIdFilter:
+    """
+    Bounded LRU of recently stored inbound (type, provider_message_id) ->
+    message id. A webhook redelivered while its id is still here is answered
+    without touching the database; older redeliveries fall through to the
+    inbound_message_ids table.
+    """
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._ids = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple):
+        with self._lock:
+            message_id = self._ids.get(key)
+            if message_id is None:
+                self.misses += 1
+                return None
+            self._ids.move_to_end(key)
+            self.hits += 1
+            return message_id
+
+    def add(self, key: tuple, message_id):
+        """
+        Only call once the message is committed.
+        """
+        with self._lock:
+            self._ids[key] = message_id
+            self._ids.move_to_end(key)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+                self.evictions += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._ids),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
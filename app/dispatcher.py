@@ -0,0 +1,101 @@
+import logging
+import threading
+
+import click
+
+from app import db
+from app.service import dispatch_outbox_batch
+
+
+class OutboxDispatcher:
+    """
+    Pool of worker threads that drain the outbox.
+    Workers claim batches with SKIP LOCKED, so any number of dispatchers
+    (threads, processes or hosts) can run against the same table.
+    """
+
+    def __init__(self, app, workers: int = 4, batch_size: int = 50,
+                 poll_interval: float = 1.0, lease_seconds: float = 60.0):
+        self.app = app
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"outbox-dispatcher-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def join(self):
+        for thread in self._threads:
+            # short timeouts keep the main thread responsive to ctrl-C
+            while thread.is_alive():
+                thread.join(1.0)
+
+    def _run(self):
+        with self.app.app_context():
+            # each entry is committed on its own; without this every commit would
+            # expire the rest of the batch and have it read back one row at a time
+            db.session().expire_on_commit = False
+            while not self._stop.is_set():
+                try:
+                    claimed = dispatch_outbox_batch(self.batch_size, self.lease_seconds)
+                except Exception as e:
+                    logging.info(f"Outbox dispatch error: {e}")
+                    claimed = 0
+                # a full batch means there is probably more waiting
+                if claimed < self.batch_size:
+                    self._stop.wait(self.poll_interval)
+
+
+def dispatcher_from_config(app) -> OutboxDispatcher:
+    return OutboxDispatcher(
+        app,
+        workers=app.config['OUTBOX_WORKERS'],
+        batch_size=app.config['OUTBOX_BATCH_SIZE'],
+        poll_interval=app.config['OUTBOX_POLL_INTERVAL'],
+        lease_seconds=app.config['OUTBOX_LEASE_SECONDS']
+    )
+
+
+_start_lock = threading.Lock()
+
+
+def ensure_inprocess_dispatcher(app) -> OutboxDispatcher:
+    """
+    Starts this process's outbox dispatcher unless it's already running.
+    """
+    with _start_lock:
+        dispatcher = app.extensions.get('outbox_dispatcher')
+        if dispatcher is None:
+            dispatcher = app.extensions['outbox_dispatcher'] = dispatcher_from_config(app)
+            dispatcher.start()
+    return dispatcher
+
+
+def register_cli(app):
+    @app.cli.command('dispatch')
+    @click.option('--workers', type=int, default=None, help='Number of dispatch threads.')
+    def dispatch_command(workers):
+        """Run outbox dispatch workers until interrupted."""
+        dispatcher = dispatcher_from_config(app)
+        if workers:
+            dispatcher.workers = workers
+        print(f'STARTING {dispatcher.workers} OUTBOX DISPATCHERS')
+        dispatcher.start()
+        try:
+            dispatcher.join()
+        except KeyboardInterrupt:
+            print('STOPPING OUTBOX DISPATCHERS')
+            dispatcher.stop()
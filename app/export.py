@@ -0,0 +1,90 @@
+import csv
+import io
+
+from sqlalchemy import select, or_
+
+from app.models import Message, Conversation
+from app.serialization import dumps
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+EXPORT_COLUMNS = (
+    Message.id, Message.conversation_id, Message.direction, Message.from_address.label('from'),
+    Message.to_address.label('to'), Message.type, Message.body, Message.attachments,
+    Message.provider_message_id, Message.timestamp, Message.created_at
+)
+
+# rows fetched from the server-side cursor per round trip, and per response chunk
+EXPORT_BATCH_SIZE = 2000
+
+
+def conversation_export_query(conversation_id):
+    return (select(*EXPORT_COLUMNS)
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.timestamp, Message.id))
+
+
+def participant_export_query(address: str, since=None, until=None):
+    """
+    Every message in conversations the address takes part in, a conversation at
+    a time. Walks the participant indexes and then (conversation_id, timestamp, id).
+    """
+    conversation_ids = select(Conversation.id).where(
+        or_(Conversation.participant_1 == address, Conversation.participant_2 == address)
+    )
+    query = select(*EXPORT_COLUMNS).where(Message.conversation_id.in_(conversation_ids))
+    return _time_range(query, since, until).order_by(Message.conversation_id, Message.timestamp, Message.id)
+
+
+def range_export_query(since=None, until=None):
+    """
+    All messages in a time range. Unordered so rows stream as the scan finds
+    them instead of after a sort of the whole range.
+    """
+    return _time_range(select(*EXPORT_COLUMNS), since, until)
+
+
+def _time_range(query, since, until):
+    if since is not None:
+        query = query.where(Message.timestamp >= since)
+    if until is not None:
+        query = query.where(Message.timestamp < until)
+    return query
+
+
+def stream_export(engine, query, fmt: str, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Yields the query's rows as NDJSON or CSV, one chunk per batch_size rows.
+    Rows come from a server-side cursor on a connection of its own, so memory
+    stays flat however many rows there are, and the connection is released
+    when the export finishes or the client goes away.
+    """
+    with engine.connect() as conn:
+        result = conn.execution_options(yield_per=batch_size).execute(query)
+        fields = list(result.keys())
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(fields)
+            for rows in result.partitions():
+                for row in rows:
+                    writer.writerow(_csv_value(value) for value in row)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            for rows in result.partitions():
+                yield b'\n'.join(dumps(dict(zip(fields, row))) for row in rows) + b'\n'
+
+
+def _csv_value(value):
+    if isinstance(value, list):
+        return dumps(value).decode()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
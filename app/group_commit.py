@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from app.service import save_messages_bulk
+
+
+class BufferFull(Exception):
+    pass
+
+
+class GroupCommitBuffer:
+    """
+    Write-behind buffer for inbound messages. Callers submit a message and
+    wait on the returned future; one flusher thread saves whatever has queued
+    up (at most max_batch, after waiting up to max_delay_ms for more) in a
+    single transaction and then resolves the futures, so a caller only hears
+    back once its message is committed.
+    """
+
+    def __init__(self, app, max_batch: int = 500, max_delay_ms: float = 5.0, max_queue: int = 10000):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.max_queue = max_queue
+        self._queue = deque()  # (direction, message kwargs, future)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self.flushes = 0
+        self.flushed = 0
+        self.max_flush_size = 0
+        self.total_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.max_queue_depth = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def submit(self, direction: str, message: dict) -> Future:
+        """
+        Queues one message (save_message keyword arguments). The future's
+        result is a service.SavedMessage. Raises BufferFull when the queue is at max_queue.
+        """
+        future = Future()
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.rejected += 1
+                raise BufferFull(f"Group commit queue is full ({self.max_queue} messages)")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='group-commit-flusher', daemon=True)
+                self._thread.start()
+            self._queue.append((direction, message, future))
+            self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+            self._cond.notify()
+        return future
+
+    def stop(self, timeout: float = None):
+        """
+        Flushes what's queued and stops the flusher.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self._flush(batch)
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                if self._stopped:
+                    return None
+                self._cond.wait()
+            # the first message waits at most max_delay for company
+            deadline = time.monotonic() + self.max_delay
+            while len(self._queue) < self.max_batch and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+
+    def _flush(self, batch: list):
+        started = time.monotonic()
+        by_direction = {}
+        for entry in batch:
+            by_direction.setdefault(entry[0], []).append(entry)
+
+        for direction, entries in by_direction.items():
+            try:
+                saved = save_messages_bulk(direction, [message for _, message, _ in entries])
+            except Exception as e:
+                logging.info(f"Group commit of {len(entries)} messages failed, saving one at a time: {e}")
+                self._flush_singly(direction, entries)
+                continue
+            for (_, _, future), result in zip(entries, saved):
+                future.set_result(result)
+
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self.flushes += 1
+            self.flushed += len(batch)
+            self.max_flush_size = max(self.max_flush_size, len(batch))
+            self.total_flush_seconds += elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    def _flush_singly(self, direction: str, entries: list):
+        # one bad message shouldn't fail everyone else in its batch
+        for _, message, future in entries:
+            try:
+                future.set_result(save_messages_bulk(direction, [message])[0])
+            except Exception as e:
+                with self._cond:
+                    self.failed += 1
+                future.set_exception(e)
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            return {
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self.max_queue_depth,
+                "max_queue": self.max_queue,
+                "flushes": self.flushes,
+                "flushed": self.flushed,
+                "avg_flush_size": round(self.flushed / self.flushes, 1) if self.flushes else None,
+                "max_flush_size": self.max_flush_size,
+                "avg_flush_ms": round(self.total_flush_seconds / self.flushes * 1000, 2) if self.flushes else None,
+                "max_flush_ms": round(self.max_flush_seconds * 1000, 2),
+                "rejected": self.rejected,
+                "failed": self.failed
+            }
+
+
+def group_commit_from_config(app) -> GroupCommitBuffer:
+    return GroupCommitBuffer(
+        app,
+        max_batch=app.config['GROUP_COMMIT_MAX_BATCH'],
+        max_delay_ms=app.config['GROUP_COMMIT_MAX_DELAY_MS'],
+        max_queue=app.config['GROUP_COMMIT_MAX_QUEUE']
+    )
@@ -0,0 +1,386 @@
+import bisect
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from app import db
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# request and query latency bucket upper bounds, seconds (+Inf is implied)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# first keyword of a statement; anything else is counted as 'other'
+_STATEMENT_VERB = re.compile(r'\s*([A-Za-z]+)')
+_OPERATIONS = {'select', 'insert', 'update', 'delete', 'with'}
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Family:
+    """
+    One metric as it is exposed: name, type, help and (suffix, labels, value) samples.
+    """
+
+    def __init__(self, name: str, kind: str, help_text: str, samples: list = None):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.samples = samples if samples is not None else []
+
+    def add(self, value, suffix: str = '', **labels):
+        self.samples.append((suffix, labels, value))
+        return self
+
+    def add_histogram(self, bounds, counts: list, total: float, count: int, **labels):
+        """
+        counts are per bucket, the last one for values above every bound.
+        """
+        cumulative = 0
+        for bound, bucket_count in zip(bounds, counts):
+            cumulative += bucket_count
+            self.add(cumulative, '_bucket', **labels, le=_format_value(float(bound)))
+        self.add(count, '_bucket', **labels, le='+Inf')
+        self.add(total, '_sum', **labels)
+        self.add(count, '_count', **labels)
+        return self
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, value in self.samples:
+            lines.append(f'{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self) -> Family:
+        with self._lock:
+            values = list(self._values.items())
+        family = Family(self.name, 'counter', self.help)
+        for label_values, value in sorted(values):
+            family.add(value, '_total', **dict(zip(self.labels, label_values)))
+        return family
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [per-bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self) -> Family:
+        with self._lock:
+            series = [(label_values, list(counts), total, count)
+                      for label_values, (counts, total, count) in self._series.items()]
+        family = Family(self.name, 'histogram', self.help)
+        for label_values, counts, total, count in sorted(series, key=lambda item: item[0]):
+            family.add_histogram(self.buckets, counts, total, count, **dict(zip(self.labels, label_values)))
+        return family
+
+
+class RequestTimings:
+    """
+    Where one request's time went: its queries and named phases.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.phases = {}
+
+    def add_phase(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+
+def current_timings() -> RequestTimings | None:
+    if not has_request_context():
+        return None
+    return g.get('request_timings')
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Times a block as a named phase of the current request, if there is one.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = current_timings()
+        if timings is not None:
+            timings.add_phase(name, time.perf_counter() - started)
+
+
+class Metrics:
+    """
+    Request latency per route, query timing and counts per request, and
+    whatever the registered collectors report, rendered for Prometheus.
+    Requests slower than slow_request_ms are logged with a breakdown of
+    where the time went, sample_rate of them at most.
+    """
+
+    def __init__(self, slow_request_ms: float = 0.0, sample_rate: float = 1.0):
+        self.slow_request_ms = slow_request_ms
+        self.sample_rate = sample_rate
+        self.requests = Histogram(
+            'http_request_duration_seconds', 'Time to build the response, by route.',
+            ('method', 'route', 'status')
+        )
+        self.request_queries = Histogram(
+            'http_request_db_queries', 'Queries run per request, by route.',
+            ('route',), QUERY_COUNT_BUCKETS
+        )
+        self.request_db_time = Histogram(
+            'http_request_db_seconds', 'Time spent in queries per request, by route.', ('route',)
+        )
+        self.queries = Histogram('db_query_duration_seconds', 'Query execution time.', ('engine', 'operation'))
+        self.slow_requests = Counter('http_slow_requests', 'Requests over the slow request threshold.', ('route',))
+        self._collectors = []
+        self._engine_names = {}
+
+    def register(self, collector):
+        """
+        collector() returns a list of Families, read on every scrape.
+        """
+        self._collectors.append(collector)
+
+    def install(self, app, engines: dict):
+        """
+        Times the app's requests and the queries run on engines ({name: engine}).
+        """
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        for name, engine in engines.items():
+            self._engine_names[engine] = name
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+            event.listen(engine, 'handle_error', self._handle_error)
+
+    def _before_request(self):
+        g.request_timings = RequestTimings()
+
+    def _after_request(self, response):
+        timings = g.pop('request_timings', None)
+        if timings is None:
+            return response
+        elapsed = time.perf_counter() - timings.started
+        route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        self.requests.observe(elapsed, request.method, route, str(response.status_code))
+        self.request_queries.observe(timings.db_queries, route)
+        self.request_db_time.observe(timings.db_seconds, route)
+        if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+            self.slow_requests.inc(route)
+            if random.random() < self.sample_rate:
+                self._log_slow_request(route, response.status_code, elapsed, timings)
+        return response
+
+    @staticmethod
+    def _log_slow_request(route: str, status: int, elapsed: float, timings: RequestTimings):
+        phases = [f"db {timings.db_seconds * 1000:.1f}ms ({timings.db_queries} queries)"]
+        phases += [f"{name} {seconds * 1000:.1f}ms" for name, seconds in timings.phases.items()]
+        # phases can overlap (a provider call may query the rate limiter), so this can go negative
+        other = elapsed - timings.db_seconds - sum(timings.phases.values())
+        phases.append(f"other {other * 1000:.1f}ms")
+        logging.info(f"Slow request {request.method} {route} -> {status} in {elapsed * 1000:.1f}ms: "
+                     + ", ".join(phases))
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # on the statement's own context: a statement that raises never reaches
+        # after_cursor_execute, and anything kept on the connection would linger
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._observe_query(conn, statement, context)
+
+    def _handle_error(self, exception_context):
+        # failed statements (unique violations, statement timeouts) took their time too
+        if exception_context.connection is not None and exception_context.statement is not None:
+            self._observe_query(exception_context.connection, exception_context.statement,
+                                exception_context.execution_context)
+
+    def _observe_query(self, conn, statement: str, context):
+        started = getattr(context, '_query_started', None)
+        if started is None:
+            return
+        # once: an error fetching the results comes after after_cursor_execute
+        context._query_started = None
+        elapsed = time.perf_counter() - started
+        verb = _STATEMENT_VERB.match(statement)
+        operation = verb.group(1).lower() if verb else 'other'
+        self.queries.observe(elapsed, self._engine_names.get(conn.engine, 'other'),
+                             operation if operation in _OPERATIONS else 'other')
+        timings = current_timings()
+        if timings is not None:
+            timings.db_queries += 1
+            timings.db_seconds += elapsed
+
+    def render(self) -> str:
+        families = [metric.collect() for metric in
+                    (self.requests, self.request_queries, self.request_db_time, self.queries, self.slow_requests)]
+        for collector in self._collectors:
+            try:
+                families += collector()
+            except Exception as e:
+                # one broken collector shouldn't take the whole scrape down
+                logging.info(f"Metrics collector {collector!r} failed: {e}")
+        return '\n'.join(family.render() for family in families if family.samples) + '\n'
+
+
+def db_pool_collector(engines: dict):
+    def collect() -> list:
+        size = Family('db_pool_size', 'gauge', 'Connections the pool keeps open.')
+        checked_out = Family('db_pool_checked_out', 'gauge', 'Connections in use.')
+        checked_in = Family('db_pool_checked_in', 'gauge', 'Idle connections in the pool.')
+        overflow = Family('db_pool_overflow', 'gauge', 'Connections open beyond the pool size.')
+        for name, engine in engines.items():
+            pool = engine.pool
+            if not hasattr(pool, 'checkedout'):
+                continue
+            size.add(pool.size(), engine=name)
+            checked_out.add(pool.checkedout(), engine=name)
+            checked_in.add(pool.checkedin(), engine=name)
+            overflow.add(max(pool.overflow(), 0), engine=name)
+        return [size, checked_out, checked_in, overflow]
+    return collect
+
+
+def provider_collector(providers: dict):
+    """
+    Send latency, outcomes, retries, circuit state and connection reuse for
+    each channel's provider ({'sms': provider, ...}), per endpoint for pools.
+    """
+    def collect() -> list:
+        latency = Family('provider_request_duration_seconds', 'histogram', 'Provider HTTP call latency.')
+        outcomes = Family('provider_sends', 'counter', 'Provider sends by outcome.')
+        retries = Family('provider_retries', 'counter', 'Sends retried after a 429 or rate limit.')
+        circuit = Family('provider_circuit_open', 'gauge', '1 while the endpoint\'s circuit breaker is open.')
+        connections = Family('provider_connections_created', 'counter', 'Connections opened to the provider.')
+        reused = Family('provider_connections_reused', 'counter', 'Requests sent on a kept-alive connection.')
+        for channel, provider in providers.items():
+            retries.add(provider.stats.retries, '_total', channel=channel)
+            for endpoint in getattr(provider, 'providers', [provider]):
+                labels = {"channel": channel, "endpoint": endpoint.endpoint}
+                counts, total, count = endpoint.stats.histogram()
+                latency.add_histogram(endpoint.stats.BUCKETS[:-1], counts, total, count, **labels)
+                for outcome, value in sorted(endpoint.stats.snapshot()['outcomes'].items()):
+                    outcomes.add(value, '_total', **labels, outcome=outcome)
+                circuit.add(int(endpoint.circuit_open()), **labels)
+                stats = endpoint.connection_stats()
+                connections.add(stats['new_connections'], '_total', **labels)
+                reused.add(stats['reused_connections'], '_total', **labels)
+        return [latency, outcomes, retries, circuit, connections, reused]
+    return collect
+
+
+def app_collector(app):
+    """
+    Queue depths, cache hit counts, replica lag and stream subscribers from the app's components.
+    """
+    def collect() -> list:
+        families = []
+        buffer = app.extensions.get('group_commit')
+        if buffer is not None:
+            stats = buffer.get_stats()
+            families += [
+                Family('group_commit_queue_depth', 'gauge', 'Webhooks waiting to be committed.')
+                .add(stats['queue_depth']),
+                Family('group_commit_flushes', 'counter', 'Group commit flushes.').add(stats['flushes'], '_total'),
+            ]
+        lookups = Family('cache_lookups', 'counter', 'In-process cache lookups by result.')
+        for name in ('conversation_cache', 'recent_message_ids'):
+            cache = app.config.get(name)
+            if cache is not None:
+                stats = cache.get_stats()
+                lookups.add(stats['hits'], '_total', cache=name, result='hit')
+                lookups.add(stats['misses'], '_total', cache=name, result='miss')
+        families.append(lookups)
+        router = app.extensions.get('replica_router')
+        if router is not None:
+            stats = router.get_stats()
+            lag = Family('db_replica_lag_seconds', 'gauge', 'Last measured replica lag, absent while unreachable.')
+            reads = Family('db_replica_reads', 'counter', 'Requests routed to each replica, or the primary.')
+            for replica in stats['replicas']:
+                if replica['lag_seconds'] is not None:
+                    lag.add(replica['lag_seconds'], replica=replica['name'])
+                reads.add(replica['reads'], '_total', replica=replica['name'])
+            reads.add(stats['primary_reads'], '_total', replica='primary')
+            families += [lag, reads]
+        notifier = app.extensions.get('message_notifier')
+        if notifier is not None:
+            stats = notifier.get_stats()
+            families += [
+                Family('stream_subscribers', 'gauge', 'Open SSE and long-poll subscriptions.')
+                .add(stats['subscribers']),
+                Family('stream_listener_connected', 'gauge', '1 while the LISTEN connection is up.')
+                .add(int(stats['connected'])),
+            ]
+        return families
+    return collect
+
+
+def metrics_from_config(app) -> Metrics:
+    metrics = Metrics(
+        slow_request_ms=app.config['SLOW_REQUEST_MS'],
+        sample_rate=app.config['SLOW_REQUEST_SAMPLE_RATE']
+    )
+    engines = {name or 'primary': engine for name, engine in db.engines.items()}
+    metrics.install(app, engines)
+    metrics.register(db_pool_collector(engines))
+    metrics.register(provider_collector({
+        "sms": app.config['sms_provider'],
+        "email": app.config['email_provider']
+    }))
+    metrics.register(app_collector(app))
+    return metrics
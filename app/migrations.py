@@ -0,0 +1,364 @@
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import text
+
+from app import db
+from app.addresses import normalize_address
+from app.models import Message, MESSAGE_SEARCH_VECTOR_SQL, MESSAGE_PREVIEW_SQL
+from app.partitions import (
+    is_partitioned, create_default_partition, create_partition, stored_columns, partition_window, months_with_rows
+)
+
+# Schema changes that db.create_all() can't apply to an existing database.
+# Each step runs once, in its own savepoint, and is recorded in schema_migrations.
+# Steps should still be written to be harmless on a fresh database, where create_all
+# has already built the tables from the current models.
+
+MIGRATION_LOCK_ID = 72180301
+
+# lower/trim both addresses, sort them (byte order, same as Python's sorted) and join
+_PAIR_KEY_SQL = """
+    LEAST(lower(btrim(participant_1)) COLLATE "C", lower(btrim(participant_2)) COLLATE "C")
+    || '|' ||
+    GREATEST(lower(btrim(participant_1)) COLLATE "C", lower(btrim(participant_2)) COLLATE "C")
+"""
+
+# Statement-level, so a multi-row insert updates each conversation once. The latest
+# message by timestamp wins, a conversation's first message always does.
+_SUMMARY_TRIGGER_SQL = f"""
+    CREATE OR REPLACE FUNCTION conversations_apply_new_messages() RETURNS trigger AS $$
+    BEGIN
+        UPDATE conversations c SET
+            message_count = c.message_count + n.message_count,
+            updated_at = timezone('utc', now()),
+            last_message_at = CASE WHEN c.message_count = 0 OR n.timestamp >= c.last_message_at
+                THEN n.timestamp ELSE c.last_message_at END,
+            last_message_preview = CASE WHEN c.message_count = 0 OR n.timestamp >= c.last_message_at
+                THEN n.preview ELSE c.last_message_preview END,
+            last_message_direction = CASE WHEN c.message_count = 0 OR n.timestamp >= c.last_message_at
+                THEN n.direction ELSE c.last_message_direction END,
+            last_message_type = CASE WHEN c.message_count = 0 OR n.timestamp >= c.last_message_at
+                THEN n.type ELSE c.last_message_type END
+        FROM (
+            SELECT DISTINCT ON (conversation_id)
+                conversation_id, timestamp, direction, type, {MESSAGE_PREVIEW_SQL} AS preview,
+                count(*) OVER (PARTITION BY conversation_id) AS message_count
+            FROM new_messages
+            ORDER BY conversation_id, timestamp DESC, id DESC
+        ) n
+        WHERE c.id = n.conversation_id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+_CREATE_SUMMARY_TRIGGER_SQL = """
+    CREATE TRIGGER messages_conversation_summary
+    AFTER INSERT ON messages REFERENCING NEW TABLE AS new_messages
+    FOR EACH STATEMENT EXECUTE FUNCTION conversations_apply_new_messages()
+"""
+
+
+# One notification per conversation per insert statement, delivered when the
+# transaction commits. Identical payloads in one transaction are sent once.
+_NOTIFY_TRIGGER_SQL = """
+    CREATE OR REPLACE FUNCTION messages_notify_new() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('new_messages', json_build_object(
+            'conversation_id', c.id,
+            'participants', json_build_array(c.participant_1, c.participant_2)
+        )::text)
+        FROM conversations c
+        WHERE c.id IN (SELECT conversation_id FROM new_messages);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+_CREATE_NOTIFY_TRIGGER_SQL = """
+    CREATE TRIGGER messages_notify_new
+    AFTER INSERT ON messages REFERENCING NEW TABLE AS new_messages
+    FOR EACH STATEMENT EXECUTE FUNCTION messages_notify_new()
+"""
+
+
+def _merge_conversations_sql(pair_key: str) -> list:
+    """
+    Merges conversations with the same pair_key (a column or expression)
+    into the oldest one, moving their messages over.
+    """
+    return [
+        f"""
+        CREATE TEMP TABLE conversation_merges AS
+        SELECT id, keep_id FROM (
+            SELECT id, first_value(id) OVER (
+                PARTITION BY {pair_key} ORDER BY created_at, id
+            ) AS keep_id
+            FROM conversations
+        ) ranked
+        WHERE id <> keep_id
+        """,
+        """
+        UPDATE messages m SET conversation_id = cm.keep_id
+        FROM conversation_merges cm WHERE m.conversation_id = cm.id
+        """,
+        """
+        UPDATE conversations c SET updated_at = merged.updated_at
+        FROM (
+            SELECT cm.keep_id, max(dup.updated_at) AS updated_at
+            FROM conversation_merges cm JOIN conversations dup ON dup.id = cm.id
+            GROUP BY cm.keep_id
+        ) merged
+        WHERE c.id = merged.keep_id AND merged.updated_at > c.updated_at
+        """,
+        "DELETE FROM conversations c USING conversation_merges cm WHERE c.id = cm.id",
+        "DROP TABLE conversation_merges",
+    ]
+
+
+def _build_address_map(conn):
+    """
+    Fills a temp table with every stored address whose canonical form differs.
+    The canonical form comes from phonenumbers, which Postgres can't do.
+    """
+    conn.execute(text("CREATE TEMP TABLE address_map (original TEXT PRIMARY KEY, canonical TEXT NOT NULL)"))
+    addresses = conn.execute(text("""
+        SELECT from_address FROM messages UNION SELECT to_address FROM messages
+        UNION SELECT participant_1 FROM conversations UNION SELECT participant_2 FROM conversations
+    """)).scalars()
+    changed = []
+    for address in addresses:
+        canonical = normalize_address(address, is_email='@' in address)
+        if canonical and canonical != address:
+            changed.append({"original": address, "canonical": canonical})
+    if changed:
+        conn.execute(text("INSERT INTO address_map (original, canonical) VALUES (:original, :canonical)"), changed)
+
+
+def _unless_partitioned(statement: str):
+    """
+    A step for the messages table as it was before 0011, skipped on a fresh
+    database whose messages table create_all made partitioned already.
+    Postgres checks a partitioned table's unique indexes for the partition key
+    before IF NOT EXISTS, and won't take storage parameters on it at all
+    (partitions.py sets them on each partition), so those steps would fail there.
+    """
+    def step(conn):
+        if not is_partitioned(conn):
+            conn.execute(text(statement))
+    return step
+
+
+def _partition_messages(conn):
+    """
+    Rebuilds messages as a table partitioned by month of timestamp, with a
+    partition for each month in the maintenance window that has messages and
+    the default partition, and copies the rows over. Rewrites the table once, under an exclusive lock.
+    On a fresh database create_all has already made it partitioned.
+    """
+    if is_partitioned(conn):
+        return
+    conn.execute(text("ALTER TABLE messages RENAME TO messages_unpartitioned"))
+    # 0004's dedupe index, on (type, provider_message_id); the partitioned table's
+    # has timestamp too, which every unique index there needs
+    conn.execute(text("DROP INDEX IF EXISTS ux_messages_inbound_provider_message_id"))
+    # index names are per schema, the new table's are the same
+    indexes = conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = 'messages_unpartitioned'"
+    )).scalars().all()
+    for index in indexes:
+        conn.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index}_unpartitioned"'))
+    # as are foreign key names, and the old table's aren't needed for the copy
+    foreign_keys = conn.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = 'messages_unpartitioned'::regclass AND contype = 'f'"
+    )).scalars().all()
+    for foreign_key in foreign_keys:
+        conn.execute(text(f'ALTER TABLE messages_unpartitioned DROP CONSTRAINT "{foreign_key}"'))
+
+    Message.__table__.create(conn)
+    create_default_partition(conn)
+    config = current_app.config
+    window = partition_window(
+        datetime.now(timezone.utc), config['MESSAGE_PARTITION_MONTHS_AHEAD'],
+        config['MESSAGE_RETENTION_MONTHS'] or config['MESSAGE_PARTITION_MONTHS_BACK']
+    )
+    for month in months_with_rows(conn, 'messages_unpartitioned', *window):
+        create_partition(conn, month)
+    # before the triggers exist, so conversation summaries aren't counted twice
+    columns = stored_columns()
+    conn.execute(text(f"INSERT INTO messages ({columns}) SELECT {columns} FROM messages_unpartitioned"))
+    # the old outbox foreign key goes with it
+    conn.execute(text("DROP TABLE messages_unpartitioned CASCADE"))
+    conn.execute(text(
+        "ALTER TABLE outbox ADD FOREIGN KEY (message_id, message_timestamp) REFERENCES messages (id, timestamp)"
+    ))
+    conn.execute(text(_CREATE_SUMMARY_TRIGGER_SQL))
+    conn.execute(text(_CREATE_NOTIFY_TRIGGER_SQL))
+
+
+MIGRATIONS = [
+    ('0001_conversation_participant_key', [
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS participant_key TEXT",
+        f"UPDATE conversations SET participant_key = {_PAIR_KEY_SQL} WHERE participant_key IS NULL",
+        *_merge_conversations_sql('participant_key'),
+        "ALTER TABLE conversations ALTER COLUMN participant_key SET NOT NULL",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_conversations_participant_key ON conversations (participant_key)",
+    ]),
+    ('0002_keyset_pagination_indexes', [
+        "CREATE INDEX IF NOT EXISTS ix_conversations_updated_at_id ON conversations (updated_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_messages_conversation_id_timestamp_id"
+        " ON messages (conversation_id, timestamp, id)",
+    ]),
+    # shared token buckets for client_integrations.rate_limit.PostgresTokenBuckets
+    ('0003_provider_rate_limits', [
+        """
+        CREATE TABLE IF NOT EXISTS provider_rate_limits (
+            key TEXT PRIMARY KEY,
+            tokens DOUBLE PRECISION NOT NULL,
+            acquired BOOLEAN NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL
+        )
+        """,
+    ]),
+    ('0004_inbound_provider_message_id_unique', [
+        # keep the first copy of each redelivered webhook
+        """
+        DELETE FROM messages m USING (
+            SELECT id, row_number() OVER (
+                PARTITION BY type, provider_message_id ORDER BY created_at, id
+            ) AS copy
+            FROM messages
+            WHERE direction = 'inbound' AND provider_message_id IS NOT NULL
+        ) dup
+        WHERE m.id = dup.id AND dup.copy > 1
+        """,
+        _unless_partitioned(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_messages_inbound_provider_message_id"
+            " ON messages (type, provider_message_id)"
+            " WHERE direction = 'inbound' AND provider_message_id IS NOT NULL"
+        ),
+    ]),
+    # store E.164 numbers and bare lowercased emails, and regroup conversations by them
+    ('0005_canonical_addresses', [
+        _build_address_map,
+        "UPDATE messages m SET from_address = a.canonical FROM address_map a WHERE m.from_address = a.original",
+        "UPDATE messages m SET to_address = a.canonical FROM address_map a WHERE m.to_address = a.original",
+        "UPDATE conversations c SET participant_1 = a.canonical FROM address_map a WHERE c.participant_1 = a.original",
+        "UPDATE conversations c SET participant_2 = a.canonical FROM address_map a WHERE c.participant_2 = a.original",
+        *_merge_conversations_sql(_PAIR_KEY_SQL),
+        f"UPDATE conversations SET participant_key = {_PAIR_KEY_SQL} WHERE participant_key <> {_PAIR_KEY_SQL}",
+        "DROP TABLE address_map",
+    ]),
+    ('0006_conversation_summaries', [
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP",
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_preview TEXT",
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_direction VARCHAR(10)",
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_type VARCHAR(10)",
+        "ALTER TABLE conversations ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0",
+        f"""
+        UPDATE conversations c SET
+            last_message_at = latest.timestamp,
+            last_message_preview = latest.preview,
+            last_message_direction = latest.direction,
+            last_message_type = latest.type,
+            message_count = latest.message_count
+        FROM (
+            SELECT DISTINCT ON (conversation_id)
+                conversation_id, timestamp, direction, type, {MESSAGE_PREVIEW_SQL} AS preview,
+                count(*) OVER (PARTITION BY conversation_id) AS message_count
+            FROM messages
+            ORDER BY conversation_id, timestamp DESC, id DESC
+        ) latest
+        WHERE c.id = latest.conversation_id
+        """,
+        "UPDATE conversations SET last_message_at = created_at WHERE last_message_at IS NULL",
+        "ALTER TABLE conversations ALTER COLUMN last_message_at SET NOT NULL",
+        _SUMMARY_TRIGGER_SQL,
+        "DROP TRIGGER IF EXISTS messages_conversation_summary ON messages",
+        _CREATE_SUMMARY_TRIGGER_SQL,
+        "CREATE INDEX IF NOT EXISTS ix_conversations_last_message_at_id ON conversations (last_message_at, id)"
+        " INCLUDE (participant_1, participant_2, created_at, updated_at, last_message_preview,"
+        " last_message_direction, last_message_type, message_count)",
+        # the listing no longer sorts by updated_at, and every message insert now updates the row
+        "DROP INDEX IF EXISTS ix_conversations_updated_at_id",
+    ]),
+    ('0007_participant_inbox_indexes', [
+        "CREATE INDEX IF NOT EXISTS ix_conversations_participant_1_last_message_at_id"
+        " ON conversations (participant_1, last_message_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_conversations_participant_2_last_message_at_id"
+        " ON conversations (participant_2, last_message_at, id)",
+    ]),
+    ('0008_message_body_search', [
+        # rewrites the messages table once to compute the vector for existing rows
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS body_tsv tsvector"
+        f" GENERATED ALWAYS AS ({MESSAGE_SEARCH_VECTOR_SQL}) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_messages_body_tsv ON messages USING gin (body_tsv) WITH (fastupdate = on)",
+        # let autovacuum merge the GIN pending list every ~10k inserts, before it
+        # fills up and an insert has to merge it in the foreground
+        _unless_partitioned(
+            "ALTER TABLE messages SET (autovacuum_vacuum_insert_threshold = 10000,"
+            " autovacuum_vacuum_insert_scale_factor = 0)"
+        ),
+    ]),
+    ('0009_new_message_notifications', [
+        _NOTIFY_TRIGGER_SQL,
+        "DROP TRIGGER IF EXISTS messages_notify_new ON messages",
+        _CREATE_NOTIFY_TRIGGER_SQL,
+        "CREATE INDEX IF NOT EXISTS ix_messages_created_at_id ON messages (created_at, id)",
+    ]),
+    ('0010_broadcasts', [
+        # the broadcasts table itself comes from create_all
+        "ALTER TABLE outbox ADD COLUMN IF NOT EXISTS broadcast_id UUID REFERENCES broadcasts (id)",
+        "CREATE INDEX IF NOT EXISTS ix_outbox_broadcast_id_status ON outbox (broadcast_id, status)"
+        " WHERE broadcast_id IS NOT NULL",
+    ]),
+    # monthly partitions of messages by timestamp; see partitions.py
+    ('0011_partition_messages', [
+        "ALTER TABLE outbox ADD COLUMN IF NOT EXISTS message_timestamp TIMESTAMP",
+        """
+        UPDATE outbox o SET message_timestamp = m.timestamp
+        FROM messages m WHERE m.id = o.message_id AND o.message_timestamp IS NULL
+        """,
+        "ALTER TABLE outbox ALTER COLUMN message_timestamp SET NOT NULL",
+        _partition_messages,
+    ]),
+    # webhook dedupe on (type, provider_message_id) again, which the partitioned
+    # messages table can't hold a unique index on; the table comes from create_all
+    ('0012_inbound_message_ids', [
+        """
+        INSERT INTO inbound_message_ids (type, provider_message_id, message_id, message_timestamp)
+        SELECT DISTINCT ON (type, provider_message_id) type, provider_message_id, id, timestamp
+        FROM messages
+        WHERE direction = 'inbound' AND provider_message_id IS NOT NULL
+        ORDER BY type, provider_message_id, created_at, id
+        ON CONFLICT DO NOTHING
+        """,
+    ]),
+]
+
+
+def run_migrations():
+    """
+    Applies any pending migrations. Safe to call from every process on startup,
+    the advisory lock makes concurrent callers wait for each other.
+    """
+    with db.engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "name TEXT PRIMARY KEY, applied_at TIMESTAMP NOT NULL DEFAULT now())"
+        ))
+        applied = set(conn.execute(text("SELECT name FROM schema_migrations")).scalars())
+
+        for name, statements in MIGRATIONS:
+            if name in applied:
+                continue
+            print(f'APPLYING MIGRATION {name}')
+            with conn.begin_nested():
+                for statement in statements:
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(text(statement))
+                conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
@@ -1,11 +1,32 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, Text, DateTime, JSON
-from sqlalchemy.dialects.postgresql import UUID, JSONB
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    Column, String, Integer, ForeignKey, ForeignKeyConstraint, Text, DateTime, JSON, Index, Computed, text
+)
+from sqlalchemy.dialects.postgresql import UUID, JSONB, TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 import uuid
 from datetime import datetime, timezone
 
 from . import db
 
+# text search configuration for message bodies; queries must use the same one
+SEARCH_CONFIG = 'english'
+
+# what gets indexed for search: the body, with tags stripped from emails
+MESSAGE_SEARCH_VECTOR_SQL = (
+    f"to_tsvector('{SEARCH_CONFIG}', CASE WHEN type = 'email'"
+    " THEN regexp_replace(body, '<[^>]*>', ' ', 'g') ELSE body END)"
+)
+
+# a conversation's last_message_preview: the first 160 characters of the body, with tags stripped from emails
+MESSAGE_PREVIEW_SQL = """
+    left(CASE WHEN type = 'email' THEN btrim(regexp_replace(body, '<[^>]*>', '', 'g')) ELSE body END, 160)
+"""
+
+
+def utcnow() -> datetime:
+    # a callable, so each row gets its own time rather than the import time
+    return datetime.now(timezone.utc)
+
 
 class Conversation(db.Model):
     __tablename__ = 'conversations'
@@ -13,11 +34,33 @@ class Conversation(db.Model):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     participant_1 = Column(Text, nullable=False)
     participant_2 = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
-    updated_at = Column(DateTime, default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+    # order-independent, normalized pair of participants; see service.participant_key
+    participant_key = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=utcnow)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+
+    # summary of the latest message, kept up to date by the messages_conversation_summary
+    # trigger (migrations.py) in the same statement as each message insert
+    last_message_at = Column(DateTime, nullable=False, default=utcnow)
+    last_message_preview = Column(Text, nullable=True)
+    last_message_direction = Column(String(10), nullable=True)
+    last_message_type = Column(String(10), nullable=True)
+    message_count = Column(Integer, nullable=False, default=0, server_default='0')
 
     messages = relationship('Message', back_populates='conversation', cascade='all, delete-orphan')
 
+    __table_args__ = (
+        Index('ux_conversations_participant_key', 'participant_key', unique=True),
+        # covers the conversation listing, so it can be an index-only scan
+        Index('ix_conversations_last_message_at_id', 'last_message_at', 'id', postgresql_include=[
+            'participant_1', 'participant_2', 'created_at', 'updated_at', 'last_message_preview',
+            'last_message_direction', 'last_message_type', 'message_count'
+        ]),
+        # per-participant inboxes, one range scan per side of the pair
+        Index('ix_conversations_participant_1_last_message_at_id', 'participant_1', 'last_message_at', 'id'),
+        Index('ix_conversations_participant_2_last_message_at_id', 'participant_2', 'last_message_at', 'id'),
+    )
+
 
 class Message(db.Model):
     __tablename__ = 'messages'
@@ -31,8 +74,92 @@ class Message(db.Model):
     body = Column(Text, nullable=False)
     attachments = Column(JSONB, default=list)  # list of attachment URLs
     provider_message_id = Column(Text, nullable=True)
-    timestamp = Column(DateTime, nullable=False)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
+    # the partition key (partitions.py), so part of the primary key and of every unique index
+    timestamp = Column(DateTime, primary_key=True)
+    created_at = Column(DateTime, default=utcnow)
+    # computed by Postgres on insert; deferred so loading a message doesn't fetch it
+    body_tsv = deferred(Column(TSVECTOR, Computed(MESSAGE_SEARCH_VECTOR_SQL, persisted=True)))
 
     conversation = relationship('Conversation', back_populates='messages')
 
+    # don't have INSERTs return body_tsv, nothing reads it back
+    __mapper_args__ = {'eager_defaults': False}
+
+    __table_args__ = (
+        Index('ix_messages_conversation_id_timestamp_id', 'conversation_id', 'timestamp', 'id'),
+        # partitioning requires the timestamp in this key, so on its own it wouldn't catch a
+        # redelivery with a different timestamp; InboundMessageId is what dedupes webhooks
+        Index('ux_messages_inbound_provider_message_id', 'type', 'provider_message_id', 'timestamp', unique=True,
+              postgresql_where=text("direction = 'inbound' AND provider_message_id IS NOT NULL")),
+        # live message feeds read what's arrived since their cursor
+        Index('ix_messages_created_at_id', 'created_at', 'id'),
+        # fastupdate queues new entries in a pending list instead of updating the tree on every insert
+        Index('ix_messages_body_tsv', 'body_tsv', postgresql_using='gin', postgresql_with={'fastupdate': 'on'}),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
+
+
+class InboundMessageId(db.Model):
+    __tablename__ = 'inbound_message_ids'
+
+    # carriers redeliver webhooks; each inbound provider message is stored once. Claimed in
+    # the statement that inserts the message, and not partitioned, so a redelivery is
+    # caught whatever timestamp it carries
+    type = Column(String(10), primary_key=True)
+    provider_message_id = Column(Text, primary_key=True)
+    message_id = Column(UUID(as_uuid=True), nullable=False)
+    message_timestamp = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # claims go with their month's messages when it's archived
+        Index('ix_inbound_message_ids_message_timestamp', 'message_timestamp'),
+    )
+
+
+class Broadcast(db.Model):
+    __tablename__ = 'broadcasts'
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    from_address = Column(Text, nullable=False)
+    type = Column(String(10), nullable=False)
+    body = Column(Text, nullable=False)
+    attachments = Column(JSONB, default=list)
+    # one message and outbox entry per recipient, progress is counted from the outbox
+    recipient_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=utcnow)
+
+
+def _messages_partitioned(ddl, target, bind, **kw) -> bool:
+    # create_all on a database from before migration 0011 finds messages keyed on
+    # id alone; 0011 rebuilds it partitioned and adds outbox's foreign key then
+    from app.partitions import is_partitioned
+    return is_partitioned(bind)
+
+
+class OutboxEntry(db.Model):
+    __tablename__ = 'outbox'
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    message_id = Column(UUID(as_uuid=True), nullable=False, unique=True)
+    # with message_id, the message's key; messages is partitioned on timestamp
+    message_timestamp = Column(DateTime, nullable=False)
+    status = Column(String(16), nullable=False, default='pending')  # pending / in_flight / sent / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    # when the entry may next be claimed; for in_flight entries this doubles as the lease expiry
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    broadcast_id = Column(UUID(as_uuid=True), ForeignKey('broadcasts.id'), nullable=True)
+
+    message = relationship('Message')
+
+    __table_args__ = (
+        # added after the tables are created, and only once messages is partitioned
+        ForeignKeyConstraint(['message_id', 'message_timestamp'], ['messages.id', 'messages.timestamp'],
+                             name='outbox_message_id_message_timestamp_fkey',
+                             use_alter=True).ddl_if(callable_=_messages_partitioned),
+        Index('ix_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+        # a broadcast's progress is a count by status
+        Index('ix_outbox_broadcast_id_status', 'broadcast_id', 'status',
+              postgresql_where=text("broadcast_id IS NOT NULL")),
+    )
@@ -0,0 +1,246 @@
+import json
+import logging
+import select
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select as sql_select, or_, tuple_
+
+from app import db
+from app.models import Message
+from app.service import MESSAGE_LISTING_COLUMNS, encode_cursor, decode_cursor
+
+# raised by the messages_notify_new trigger (migration 0009) once per conversation per insert statement
+NOTIFY_CHANNEL = 'new_messages'
+
+# created_at is stamped before commit, so a message can commit after one stamped later
+# than it. Feeds re-read this far behind their cursor to pick those up.
+STRAGGLER_WINDOW = timedelta(seconds=2)
+
+FEED_BATCH_SIZE = 500
+
+FEED_COLUMNS = MESSAGE_LISTING_COLUMNS + (Message.conversation_id,)
+
+
+class Subscription:
+    def __init__(self, key: tuple):
+        self.key = key
+        self._event = threading.Event()
+
+    def notify(self):
+        self._event.set()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        True if notified since the last wait. Clears the flag, so a
+        notification that lands while the caller fetches wakes the next wait.
+        """
+        notified = self._event.wait(timeout)
+        self._event.clear()
+        return notified
+
+
+class MessageNotifier:
+    """
+    One LISTEN connection per process, fanned out to in-process subscribers.
+    An idle subscriber is a waiting thread with no database connection; it is
+    only woken when a message lands in its conversation or for its participant.
+    """
+
+    def __init__(self, app, reconnect_delay: float = 1.0):
+        self.app = app
+        self.reconnect_delay = reconnect_delay
+        self._subscribers = {}  # ('conversation', id) or ('participant', address) -> set of Subscription
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self.connected = False
+        self.notifications = 0
+        self.wakeups = 0
+        self.reconnects = 0
+
+    def subscribe(self, key: tuple) -> Subscription:
+        subscription = Subscription(key)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='message-notifier', daemon=True)
+                self._thread.start()
+            self._subscribers.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.key]
+
+    def stop(self, timeout: float = None):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _dispatch(self, payload: str):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            logging.info(f"Ignoring malformed {NOTIFY_CHANNEL} notification: {payload!r}")
+            return
+        keys = [('conversation', event['conversation_id'])]
+        keys += [('participant', address) for address in event['participants']]
+        with self._lock:
+            self.notifications += 1
+            woken = [subscription for key in keys for subscription in self._subscribers.get(key, ())]
+            self.wakeups += len(woken)
+        for subscription in woken:
+            subscription.notify()
+
+    def _wake_all(self):
+        # notifications sent while we weren't listening are gone, have everyone re-read
+        with self._lock:
+            woken = [subscription for subscribers in self._subscribers.values() for subscription in subscribers]
+        for subscription in woken:
+            subscription.notify()
+
+    def _connect(self):
+        with self.app.app_context():
+            connection = db.engine.raw_connection()
+        # ours for good, not something to hand back to the pool
+        connection.detach()
+        dbapi_connection = connection.dbapi_connection
+        dbapi_connection.autocommit = True
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        return dbapi_connection
+
+    def _run(self):
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = self._connect()
+                self.connected = True
+                self._wake_all()
+                while not self._stopped.is_set():
+                    # the timeout only bounds how long stop() waits
+                    if select.select([connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self._dispatch(connection.notifies.pop(0).payload)
+            except Exception as e:
+                logging.info(f"Message notifier connection lost, reconnecting: {e}")
+                self.reconnects += 1
+            finally:
+                self.connected = False
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+            self._stopped.wait(self.reconnect_delay)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "connected": self.connected,
+                "subscribed_keys": len(self._subscribers),
+                "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+                "notifications": self.notifications,
+                "wakeups": self.wakeups,
+                "reconnects": self.reconnects
+            }
+
+
+class MessageFeed:
+    """
+    New messages in one conversation or for one participant, oldest first.
+    Each message carries an event id (a (created_at, id) cursor); starting from
+    one resumes just after that message, starting without one means from now.
+    Raises ValueError for an event id we didn't hand out.
+    """
+
+    def __init__(self, notifier: MessageNotifier, engine, conversation_id=None, participant: str = None,
+                 last_event_id: str = None):
+        self.notifier = notifier
+        self.engine = engine
+        if conversation_id is not None:
+            self._scope = Message.conversation_id == conversation_id
+            key = ('conversation', str(conversation_id))
+        else:
+            self._scope = or_(Message.from_address == participant, Message.to_address == participant)
+            key = ('participant', participant)
+        if last_event_id is not None:
+            self.cursor = decode_cursor(last_event_id)
+        else:
+            # just before anything stamped from now on (created_at is stored as naive UTC)
+            self.cursor = (datetime.now(timezone.utc).replace(tzinfo=None), uuid.UUID(int=0))
+        # nothing at or before where the feed started is delivered, stragglers included
+        self._floor = self.cursor
+        self._delivered = {}  # id -> created_at, for messages inside the straggler window
+        self._caught_up = False
+        # subscribed before the first read, so nothing committed in between is missed
+        self._subscription = notifier.subscribe(key)
+
+    @property
+    def last_event_id(self) -> str:
+        return encode_cursor(*self.cursor)
+
+    def poll(self, timeout: float) -> list:
+        """
+        (event id, message row) for each message not yet delivered, waiting up
+        to timeout for some to arrive. Resuming from an event id skips every
+        message delivered before it.
+        """
+        if not self._caught_up:
+            events = self._fetch()
+            if events:
+                return events
+
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            # without a listener nothing will wake us, fall back to re-reading every second
+            notified = self._subscription.wait(remaining if self.notifier.connected else min(remaining, 1.0))
+            if notified or not self.notifier.connected:
+                events = self._fetch()
+                if events:
+                    return events
+        return []
+
+    def close(self):
+        self.notifier.unsubscribe(self._subscription)
+
+    def _fetch(self) -> list:
+        key = tuple_(Message.created_at, Message.id)
+        query = sql_select(*FEED_COLUMNS).where(self._scope)
+        if self._delivered:
+            # everything from a little before the cursor that hasn't gone out yet
+            query = query.where(
+                key > self._floor,
+                Message.created_at > self.cursor[0] - STRAGGLER_WINDOW,
+                Message.id.not_in(list(self._delivered))
+            )
+        else:
+            query = query.where(key > self.cursor)
+        query = query.order_by(Message.created_at, Message.id).limit(FEED_BATCH_SIZE)
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).all()
+        self._caught_up = len(rows) < FEED_BATCH_SIZE
+
+        events = []
+        for row in rows:
+            self._delivered[row.id] = row.created_at
+            # a straggler doesn't move the cursor back
+            if (row.created_at, row.id) > self.cursor:
+                self.cursor = (row.created_at, row.id)
+            events.append((self.last_event_id, row))
+        horizon = self.cursor[0] - STRAGGLER_WINDOW
+        self._delivered = {key: value for key, value in self._delivered.items() if value > horizon}
+        return events
+
+
+def notifier_from_config(app) -> MessageNotifier:
+    return MessageNotifier(app)
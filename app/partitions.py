@@ -0,0 +1,363 @@
+import gzip
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+import click
+from sqlalchemy import text
+
+from app import db
+from app.models import Message, MESSAGE_PREVIEW_SQL
+
+# messages is range partitioned on timestamp, one partition per calendar month
+# named messages_pYYYYMM, plus a default partition for anything outside them.
+# Timestamps come from clients, so that can be any date. Maintenance moves rows
+# within partition_window into partitions of their own; anything further out
+# stays in the default rather than every stray date getting a partition.
+
+PARTITION_NAME = re.compile(r'^messages_p(\d{4})(\d{2})$')
+DEFAULT_PARTITION = 'messages_default'
+MAINTENANCE_LOCK_ID = 72180302
+
+# partitioned tables can't have storage parameters, each partition gets these
+# (see migration 0008: autovacuum merges the GIN pending list every ~10k inserts)
+PARTITION_STORAGE = "autovacuum_vacuum_insert_threshold = 10000, autovacuum_vacuum_insert_scale_factor = 0"
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"messages_p{month:%Y%m}"
+
+
+def partition_month(name: str) -> datetime | None:
+    match = PARTITION_NAME.match(name)
+    return datetime(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def retention_cutoff(now: datetime, retention_months: int) -> datetime:
+    """
+    Partitions for months before this are archived: the current month and the
+    retention_months before it are kept.
+    """
+    return add_months(month_start(now), -retention_months)
+
+
+def partition_window(now: datetime, months_ahead: int, months_back: int) -> tuple:
+    """
+    (first month, end) of the months partitions are created for: months_back
+    before the current month through months_ahead after it. end is exclusive.
+    """
+    current = month_start(now)
+    return add_months(current, -months_back), add_months(current, months_ahead + 1)
+
+
+def stored_columns() -> str:
+    # body_tsv is generated, Postgres computes it again wherever rows land
+    return ', '.join(f'"{column.name}"' for column in Message.__table__.columns if column.computed is None)
+
+
+def _literal(month: datetime) -> str:
+    return f"'{month:%Y-%m-%d}'"
+
+
+def is_partitioned(conn) -> bool:
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('messages'))"
+    )).scalar()
+
+
+def attached_partitions(conn) -> list:
+    return list(conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass ORDER BY c.relname
+    """)).scalars())
+
+
+def detached_partitions(conn) -> list:
+    """
+    Monthly tables no longer attached: detached for archiving, not yet dropped.
+    """
+    return list(conn.execute(text("""
+        SELECT c.relname FROM pg_class c
+        WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace
+          AND c.relname ~ '^messages_p[0-9]{6}$'
+          AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+        ORDER BY c.relname
+    """)).scalars())
+
+
+def months_with_rows(conn, table: str, first: datetime, end: datetime) -> list:
+    """
+    The months from first up to end that table has messages in.
+    """
+    return list(conn.execute(text(
+        f"SELECT DISTINCT date_trunc('month', timestamp) FROM {table}"
+        " WHERE timestamp >= :first AND timestamp < :end ORDER BY 1"
+    ), {"first": first, "end": end}).scalars())
+
+
+def create_default_partition(conn):
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF messages DEFAULT WITH ({PARTITION_STORAGE})"
+    ))
+
+
+def create_partition(conn, month: datetime) -> int:
+    """
+    Creates month's partition and moves in any of its rows from the default
+    partition. Built apart and then attached, which only takes a SHARE UPDATE
+    EXCLUSIVE lock on messages, so reads and writes carry on meanwhile.
+    Returns the number of rows moved.
+    """
+    name = partition_name(month)
+    lower, upper = _literal(month), _literal(add_months(month, 1))
+    conn.execute(text(
+        f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING GENERATED) WITH ({PARTITION_STORAGE})"
+    ))
+    # lets ATTACH skip scanning the new table for rows out of bounds
+    conn.execute(text(
+        f"ALTER TABLE {name} ADD CONSTRAINT {name}_bounds CHECK (timestamp >= {lower} AND timestamp < {upper})"
+    ))
+    moved = 0
+    if conn.execute(text(f"SELECT to_regclass('{DEFAULT_PARTITION}') IS NOT NULL")).scalar():
+        # hold off inserts into the default partition until the new one is attached,
+        # or one landing in between would fail the ATTACH
+        conn.execute(text(f"LOCK TABLE {DEFAULT_PARTITION} IN SHARE ROW EXCLUSIVE MODE"))
+        columns = stored_columns()
+        moved = conn.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= {lower} AND timestamp < {upper}
+                RETURNING {columns}
+            )
+            INSERT INTO {name} ({columns}) SELECT {columns} FROM moved
+        """)).rowcount
+    conn.execute(text(f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper})"))
+    conn.execute(text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_bounds"))
+    return moved
+
+
+def ensure_partitions(conn, months_ahead: int, months_back: int, now: datetime = None) -> list:
+    """
+    Creates the default partition, the partitions from last month through
+    months_ahead from now, and one for each month in partition_window with
+    rows in the default partition. Returns the names created.
+    """
+    now = now or datetime.now(timezone.utc)
+    create_default_partition(conn)
+    current = month_start(now)
+    wanted = {add_months(current, offset) for offset in range(-1, months_ahead + 1)}
+    wanted.update(months_with_rows(conn, DEFAULT_PARTITION, *partition_window(now, months_ahead, months_back)))
+    existing = {partition_month(name) for name in attached_partitions(conn)}
+
+    created = []
+    for month in sorted(wanted - existing):
+        moved = create_partition(conn, month)
+        created.append(partition_name(month))
+        print(f"CREATED PARTITION {partition_name(month)}" + (f", moved {moved} rows from the default" if moved else ""))
+    return created
+
+
+def detach_partition(conn, name: str):
+    """
+    Detaches a partition to be archived. Outbox entries and webhook dedupe
+    claims for its messages go with it: at that age they were settled long
+    ago. The summaries of the conversations it had messages in are recomputed
+    from the messages left.
+    """
+    month = partition_month(name)
+    lower, upper = _literal(month), _literal(add_months(month, 1))
+    in_month = f"message_timestamp >= {lower} AND message_timestamp < {upper}"
+    conn.execute(text(f"DELETE FROM outbox WHERE {in_month}"))
+    conn.execute(text(f"DELETE FROM inbound_message_ids WHERE {in_month}"))
+    # not CONCURRENTLY, which a table with a default partition doesn't allow; the
+    # exclusive lock is only held for the detach itself
+    conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+    refresh_conversation_summaries(conn, f"SELECT DISTINCT conversation_id FROM {name}")
+
+
+def refresh_conversation_summaries(conn, conversation_ids_sql: str):
+    """
+    Recomputes message_count and the last message summary of the conversations
+    conversation_ids_sql selects from the messages they have now. One left with
+    none reads as it did before its first message.
+    """
+    conn.execute(text(f"""
+        UPDATE conversations c SET
+            message_count = coalesce(latest.message_count, 0),
+            last_message_at = coalesce(latest.timestamp, c.created_at),
+            last_message_preview = latest.preview,
+            last_message_direction = latest.direction,
+            last_message_type = latest.type
+        FROM ({conversation_ids_sql}) affected (conversation_id)
+        LEFT JOIN LATERAL (
+            SELECT timestamp, direction, type, {MESSAGE_PREVIEW_SQL} AS preview,
+                (SELECT count(*) FROM messages WHERE conversation_id = affected.conversation_id) AS message_count
+            FROM messages
+            WHERE conversation_id = affected.conversation_id
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1
+        ) latest ON true
+        WHERE c.id = affected.conversation_id
+    """))
+
+
+def dump_partition(name: str, archive_dir: str) -> tuple:
+    """
+    Writes a detached partition to <archive_dir>/<name>.csv.gz (CSV with a
+    header row, loadable with COPY). Returns (path, rows).
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    partial = path + '.partial'
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        with gzip.open(partial, 'wb') as f:
+            cursor.copy_expert(f"COPY {name} ({stored_columns()}) TO STDOUT WITH (FORMAT csv, HEADER)", f)
+        rows = cursor.rowcount
+        connection.commit()
+    finally:
+        connection.close()
+    # only a complete dump takes the final name
+    os.replace(partial, path)
+    return path, rows
+
+
+def archive_partition(name: str, archive_dir: str) -> int:
+    """
+    Detaches (if still attached), dumps and drops a partition. The detach
+    commits first so messages isn't locked during the dump; a partition whose
+    dump fails stays detached and is retried by the next run.
+    """
+    with db.engine.begin() as conn:
+        conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+        if name in attached_partitions(conn):
+            detach_partition(conn, name)
+    path, rows = dump_partition(name, archive_dir)
+    with db.engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE {name}"))
+    print(f"ARCHIVED PARTITION {name}: {rows} rows to {path}")
+    return rows
+
+
+class PartitionMaintainer:
+    """
+    Keeps messages partitioned ahead of time and, with a retention period,
+    archives partitions older than it. Partitions go back retention_months,
+    or months_back without a retention period. One process at a time does the
+    work, under an advisory lock; run() from every process is safe.
+    """
+
+    def __init__(self, app, months_ahead: int = 3, retention_months: int = 0, months_back: int = 24,
+                 archive_dir: str = 'archive', interval: float = 3600.0):
+        self.app = app
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.months_back = retention_months or months_back
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self._thread = None
+        self._stopped = threading.Event()
+        self.last_run = None
+        self.created = []
+        self.archived = []
+        self.errors = 0
+
+    def run(self, archive: bool = True) -> bool:
+        """
+        One maintenance pass. False if another process holds the lock.
+        """
+        with self.app.app_context():
+            with db.engine.connect() as lock_conn:
+                if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:id)"),
+                                         {"id": MAINTENANCE_LOCK_ID}).scalar():
+                    return False
+                try:
+                    self._maintain(archive)
+                finally:
+                    lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MAINTENANCE_LOCK_ID})
+                    lock_conn.commit()
+        self.last_run = time.time()
+        return True
+
+    def _maintain(self, archive: bool):
+        now = datetime.now(timezone.utc)
+        with db.engine.begin() as conn:
+            if not is_partitioned(conn):
+                return
+            # wait this long at most behind other queries' locks, rather than
+            # queueing every new query behind the DDL
+            conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+            self.created += ensure_partitions(conn, self.months_ahead, self.months_back, now)
+            expired = [name for name in attached_partitions(conn) + detached_partitions(conn)
+                       if partition_month(name) and self.retention_months
+                       and partition_month(name) < retention_cutoff(now, self.retention_months)]
+        if archive:
+            for name in sorted(set(expired)):
+                archive_partition(name, self.archive_dir)
+                self.archived.append(name)
+
+    def start(self):
+        if self.interval and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='partition-maintenance', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run()
+            except Exception as e:
+                self.errors += 1
+                logging.info(f"Partition maintenance error: {e}")
+
+    def get_stats(self) -> dict:
+        with self.app.app_context(), db.engine.connect() as conn:
+            default_rows = conn.execute(text(f"SELECT count(*) FROM {DEFAULT_PARTITION}")).scalar() \
+                if is_partitioned(conn) else None
+            partitions = attached_partitions(conn) if default_rows is not None else []
+        return {
+            "partitions": [name for name in partitions if name != DEFAULT_PARTITION],
+            "default_partition_rows": default_rows,
+            "retention_months": self.retention_months or None,
+            "last_run": datetime.fromtimestamp(self.last_run, timezone.utc).isoformat() if self.last_run else None,
+            "created": self.created[-12:],
+            "archived": self.archived[-12:],
+            "errors": self.errors
+        }
+
+
+def maintainer_from_config(app) -> PartitionMaintainer:
+    return PartitionMaintainer(
+        app,
+        months_ahead=app.config['MESSAGE_PARTITION_MONTHS_AHEAD'],
+        retention_months=app.config['MESSAGE_RETENTION_MONTHS'],
+        months_back=app.config['MESSAGE_PARTITION_MONTHS_BACK'],
+        archive_dir=app.config['MESSAGE_ARCHIVE_DIR'],
+        interval=app.config['PARTITION_MAINTENANCE_INTERVAL']
+    )
+
+
+def register_cli(app):
+    @app.cli.command('partitions')
+    @click.option('--no-archive', is_flag=True, help='Only create partitions.')
+    def partitions_command(no_archive):
+        """Create upcoming message partitions and archive expired ones."""
+        maintainer = app.extensions.get('partition_maintainer') or maintainer_from_config(app)
+        if not maintainer.run(archive=not no_archive):
+            print('PARTITION MAINTENANCE ALREADY RUNNING ELSEWHERE')
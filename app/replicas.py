@@ -0,0 +1,189 @@
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.sql import Select, CompoundSelect
+
+# 0 on a primary or a replica that has replayed everything it received,
+# else the age of the last transaction it replayed
+REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+# set on write responses; until it expires the client's GETs read from the primary
+READ_YOUR_WRITES_COOKIE = 'read_primary_until'
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+def read_engine():
+    """
+    The engine reads in the current request or replica_reads() block go to,
+    None for the primary. The replica is picked on first use, so requests
+    that never query don't count against any.
+    """
+    router = g.pop('replica_router', None)
+    if router is not None:
+        g.read_engine = router.read_engine()
+    return g.get('read_engine')
+
+
+class RoutingSession(Session):
+    """
+    Sends plain SELECTs to the read_engine() replica, if there is one.
+    Flushes, writes, locking reads and raw SQL stay on the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and isinstance(clause, (Select, CompoundSelect))
+                and clause._for_update_arg is None and has_app_context()):
+            engine = read_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class Replica:
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.lag = None  # seconds, None until measured or while unreachable
+        self.reads = 0
+        self.errors = 0
+
+
+class ReplicaRouter:
+    """
+    Picks a read replica, round robin among those whose last measured lag is
+    within max_lag_seconds. With none fit to serve, reads go to the primary.
+    Lag is measured every check_interval seconds by a thread started with the
+    first read.
+    """
+
+    def __init__(self, replicas: dict, max_lag_seconds: float = 5.0, check_interval: float = 1.0,
+                 read_your_writes_seconds: float = 5.0):
+        self.replicas = [Replica(name, engine) for name, engine in replicas.items()]
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval = check_interval
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self.primary_reads = 0
+
+    def read_engine(self):
+        """
+        A replica's engine to read from, or None for the primary.
+        """
+        if self._thread is None:
+            self._start()
+        fit = [replica for replica in self.replicas
+               if replica.lag is not None and replica.lag <= self.max_lag_seconds]
+        with self._lock:
+            if not fit:
+                self.primary_reads += 1
+                return None
+            replica = fit[next(self._next) % len(fit)]
+            replica.reads += 1
+        return replica.engine
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='replica-lag', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def check_lag(self):
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as conn:
+                    replica.lag = float(conn.execute(REPLICA_LAG_SQL).scalar())
+            except Exception as e:
+                if replica.lag is not None:
+                    logging.info(f"Replica {replica.name} unreachable, reading from the primary: {e}")
+                replica.lag = None
+                replica.errors += 1
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.check_lag()
+            self._stopped.wait(self.check_interval)
+
+    def install(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_request(self):
+        if request.method in READ_METHODS and not self._reads_own_writes():
+            g.replica_router = self
+
+    def _reads_own_writes(self) -> bool:
+        try:
+            return float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def _after_request(self, response):
+        if request.method not in READ_METHODS and response.status_code < 400 and self.read_your_writes_seconds:
+            until = time.time() + self.read_your_writes_seconds
+            response.set_cookie(READ_YOUR_WRITES_COOKIE, f"{until:.3f}",
+                                max_age=int(self.read_your_writes_seconds) + 1, httponly=True)
+        return response
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_lag_seconds": self.max_lag_seconds,
+                "primary_reads": self.primary_reads,
+                "replicas": [{
+                    "name": replica.name,
+                    "lag_seconds": round(replica.lag, 3) if replica.lag is not None else None,
+                    "reads": replica.reads,
+                    "errors": replica.errors
+                } for replica in self.replicas]
+            }
+
+
+@contextmanager
+def replica_reads():
+    """
+    Lets SELECTs in the block go to a replica. Inside a request the choice
+    made for the request stands, so writes and read-your-writes reads keep
+    using the primary.
+    """
+    router = current_app.extensions.get('replica_router')
+    if router is None or has_request_context() or 'read_engine' in g or 'replica_router' in g:
+        yield
+        return
+    g.replica_router = router
+    try:
+        yield
+    finally:
+        g.pop('replica_router', None)
+        g.pop('read_engine', None)
+
+
+def router_from_config(app, engines: dict) -> ReplicaRouter:
+    router = ReplicaRouter(
+        engines,
+        max_lag_seconds=app.config['REPLICA_MAX_LAG_SECONDS'],
+        check_interval=app.config['REPLICA_LAG_CHECK_INTERVAL'],
+        read_your_writes_seconds=app.config['READ_YOUR_WRITES_SECONDS']
+    )
+    router.install(app)
+    return router
@@ -1,7 +1,22 @@
-from flask import Blueprint, request, jsonify
-from app.service import send_message, save_message, get_conversations_all, get_messages_by_conversations
+from flask import Blueprint, Response, request, jsonify, current_app
+from app import db
+from app.service import (
+    send_message, save_inbound_message, save_messages_bulk, get_conversations_all, get_messages_by_conversations,
+    get_conversations_for_participant, search_messages, create_broadcast, get_broadcast_progress,
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+)
+from app.addresses import normalize_phone, normalize_address, get_stats as get_address_cache_stats
+from app.export import (
+    EXPORT_FORMATS, conversation_export_query, participant_export_query, range_export_query, stream_export
+)
+from app.dispatcher import ensure_inprocess_dispatcher
+from app.group_commit import BufferFull
+from app.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, phase
+from app.notifications import MessageFeed
+from app.replicas import read_engine
+from app.serialization import dumps, json_response, records
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime
-import phonenumbers
 
 api = Blueprint('api', __name__)
 
@@ -14,7 +29,7 @@ def send_sms():
     if error:
         return error
     try:
-        message = send_message(
+        result = send_message(
             from_address=data['from'],
             to_address=data['to'],
             msg_type=data['type'],  # should be 'sms' or 'mms'
@@ -22,7 +37,7 @@ def send_sms():
             attachments=data.get('attachments', []),
             timestamp=data['timestamp']
         )
-        return jsonify({"message_id": str(message.id)}), 201
+        return send_response(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -34,7 +49,7 @@ def send_email():
     if error:
         return error
     try:
-        message = send_message(
+        result = send_message(
             from_address=data['from'],
             to_address=data['to'],
             msg_type='email',
@@ -42,33 +57,96 @@ def send_email():
             attachments=data.get('attachments', []),
             timestamp=data['timestamp']
         )
-        return jsonify({"message_id": str(message.id)}), 201
+        return send_response(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-# --- Inbound Webhook Endpoints ---
+# --- Broadcast Endpoints ---
 
-@api.route('/api/webhooks/sms', methods=['POST'])
-def receive_sms_webhook():
+@api.route('/api/broadcasts/sms', methods=['POST'])
+def broadcast_sms():
+    return start_broadcast(is_email=False)
+
+
+@api.route('/api/broadcasts/email', methods=['POST'])
+def broadcast_email():
+    return start_broadcast(is_email=True)
+
+
+def start_broadcast(is_email: bool):
+    """
+    One message (from, type, body, attachments, timestamp) to a list of
+    recipients in 'to'. Invalid recipients are reported and skipped, repeats
+    (after normalizing) are sent once. Sending happens in the background; poll
+    GET /api/broadcasts/<id> for progress.
+    """
     data = request.get_json()
-    error = validate_message_payload(data, inbound=True)
+    recipients = data.get('to') if isinstance(data, dict) else None
+    if not isinstance(recipients, list) or not recipients:
+        return jsonify({"error": "'to' must be a non-empty list of recipients"}), 400
+    max_recipients = current_app.config['BROADCAST_MAX_RECIPIENTS']
+    if len(recipients) > max_recipients:
+        return jsonify({"error": f"Too many recipients, max {max_recipients}"}), 413
+    msg_type = 'email' if is_email else data.get('type', 'sms')
+    if msg_type not in ('sms', 'mms', 'email'):
+        return jsonify({"error": "'type' must be 'sms' or 'mms'"}), 400
+    # everything but the recipients, which are checked one by one below
+    error = payload_error(dict(data, to=data.get('from'), type=msg_type), is_email=is_email)
     if error:
-        return error
+        return jsonify({"error": error}), 400
+
+    accepted = {}
+    rejected = []
+    for index, recipient in enumerate(recipients):
+        canonical = normalize_address(recipient, is_email=is_email)
+        if canonical is None:
+            kind = "email address" if is_email else "phone number"
+            rejected.append({"index": index, "to": recipient, "error": f"Not a valid {kind}"})
+            continue
+        accepted.setdefault(canonical, index)
+    if not accepted:
+        return jsonify({"error": "No valid recipients", "rejected": rejected}), 400
+
     try:
-        message = save_message(
-            direction='inbound',
+        broadcast = create_broadcast(
             from_address=data['from'],
-            to_address=data['to'],
-            msg_type=data['type'],  # 'sms' or 'mms'
+            recipients=list(accepted),
+            msg_type=msg_type,
             body=data['body'],
             attachments=data.get('attachments', []),
-            timestamp=data['timestamp'],
-            provider_message_id=data.get('messaging_provider_id')
+            timestamp=data['timestamp']
         )
-        return jsonify({"message_id": str(message.id)}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    if current_app.config['BROADCAST_INPROCESS_DISPATCH']:
+        ensure_inprocess_dispatcher(current_app._get_current_object())
+
+    return jsonify({
+        "broadcast_id": str(broadcast.id),
+        "recipients": broadcast.recipient_count,
+        "duplicates": len(recipients) - len(rejected) - len(accepted),
+        "rejected": rejected
+    }), 202
+
+
+@api.route('/api/broadcasts/<uuid:broadcast_id>', methods=['GET'])
+def get_broadcast(broadcast_id):
+    progress = get_broadcast_progress(broadcast_id)
+    if progress is None:
+        return jsonify({"error": "Broadcast not found"}), 404
+    return jsonify(progress), 200
+
+
+# --- Inbound Webhook Endpoints ---
+
+@api.route('/api/webhooks/sms', methods=['POST'])
+def receive_sms_webhook():
+    data = request.get_json()
+    error = validate_message_payload(data, inbound=True)
+    if error:
+        return error
+    return ingest_webhook(data)
 
 
 @api.route('/api/webhooks/email', methods=['POST'])
@@ -77,67 +155,461 @@ def receive_email_webhook():
     error = validate_message_payload(data, inbound=True, is_email=True)
     if error:
         return error
+    return ingest_webhook(data, is_email=True)
+
+
+def inbound_message(data: dict, is_email: bool = False) -> dict:
+    """
+    save_inbound_message's arguments for a validated webhook payload.
+    """
+    return {
+        "from_address": data['from'],
+        "to_address": data['to'],
+        "msg_type": 'email' if is_email else data['type'],  # 'sms' or 'mms'
+        "body": data['body'],
+        "attachments": data.get('attachments', []),
+        "timestamp": data['timestamp'],
+        "provider_message_id": data.get('messaging_provider_id') or data.get('provider_message_id')
+    }
+
+
+def ingest_webhook(data: dict, is_email: bool = False):
+    """
+    Saves a webhook message, through the group commit buffer when it's enabled.
+    Either way the 201 is only sent once the message is committed. A
+    redelivered message gets a 200 with the id of the copy already stored.
+    """
+    buffer = current_app.extensions.get('group_commit')
     try:
-        message = save_message(
-            direction='inbound',
-            from_address=data['from'],
-            to_address=data['to'],
-            msg_type='email',
-            body=data['body'],
-            attachments=data.get('attachments', []),
-            timestamp=data['timestamp'],
-            provider_message_id=data.get('provider_message_id')
-        )
-        return jsonify({"message_id": str(message.id)}), 201
+        message = inbound_message(data, is_email)
+        if buffer is None:
+            saved = save_inbound_message(**message)
+        else:
+            # the flusher's queries run on its own thread, so time the wait as a phase of its own
+            with phase('group_commit'):
+                saved = buffer.submit('inbound', message).result(timeout=current_app.config['GROUP_COMMIT_TIMEOUT'])
+    except BufferFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+    except FutureTimeout:
+        return jsonify({"error": "Timed out waiting for the message to be saved"}), 503, {"Retry-After": "1"}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    if saved.duplicate:
+        return jsonify({"message_id": str(saved.message_id), "duplicate": True}), 200
+    return jsonify({"message_id": str(saved.message_id)}), 201
+
+
+@api.route('/api/webhooks/sms/batch', methods=['POST'])
+def receive_sms_webhook_batch():
+    return receive_webhook_batch(is_email=False)
+
+
+@api.route('/api/webhooks/email/batch', methods=['POST'])
+def receive_email_webhook_batch():
+    return receive_webhook_batch(is_email=True)
+
+
+def receive_webhook_batch(is_email: bool):
+    """
+    Accepts a JSON array (or {"messages": [...]}) of webhook payloads.
+    Invalid items are reported and skipped, valid ones are saved together.
+    """
+    data = request.get_json()
+    items = data.get('messages') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        return jsonify({"error": "Expected a list of messages"}), 400
+    max_items = current_app.config['WEBHOOK_BATCH_MAX']
+    if len(items) > max_items:
+        return jsonify({"error": f"Batch too large, max {max_items} messages"}), 413
+
+    results = [None] * len(items)
+    valid_indexes = []
+    to_save = []
+    for index, item in enumerate(items):
+        error = payload_error(item, inbound=True, is_email=is_email)
+        if error:
+            results[index] = {"index": index, "status": 400, "error": error}
+            continue
+        valid_indexes.append(index)
+        to_save.append(inbound_message(item, is_email))
+
+    try:
+        saved = save_messages_bulk('inbound', to_save)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    for index, (message_id, duplicate) in zip(valid_indexes, saved):
+        results[index] = {"index": index, "status": 200 if duplicate else 201, "message_id": str(message_id)}
+        if duplicate:
+            results[index]["duplicate"] = True
+
+    return jsonify({
+        "accepted": len(valid_indexes),
+        "rejected": len(items) - len(valid_indexes),
+        "results": results
+    }), 200
 
 
 # --- Conversation Endpoints ---
 
 @api.route('/api/conversations', methods=['GET'])
 def get_conversations():
-    conversations = get_conversations_all()
-    result = [
-        {
-            "id": str(conv.id),
-            "participant_1": conv.participant_1,
-            "participant_2": conv.participant_2,
-            "created_at": conv.created_at.isoformat(),
-            "updated_at": conv.updated_at.isoformat()
-        } for conv in conversations
-    ]
-    return jsonify(result), 200
+    page_args, error = parse_page_args()
+    if error:
+        return error
+    try:
+        page = get_conversations_all(**page_args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return conversations_response(page)
+
+
+@api.route('/api/participants/<address>/conversations', methods=['GET'])
+def get_participant_conversations(address):
+    canonical = normalize_address(address, is_email='@' in address)
+    if canonical is None:
+        return jsonify({"error": "Address must be a valid phone number or email address"}), 400
+    page_args, error = parse_page_args()
+    if error:
+        return error
+    try:
+        page = get_conversations_for_participant(canonical, **page_args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return conversations_response(page)
+
+
+@api.route('/api/messages/search', methods=['GET'])
+def search():
+    terms = request.args.get('q', '').strip()
+    if not terms:
+        return jsonify({"error": "Missing required parameter: 'q'"}), 400
+
+    filters = {}
+    participant = request.args.get('participant')
+    if participant is not None:
+        filters['participant'] = normalize_address(participant, is_email='@' in participant)
+        if filters['participant'] is None:
+            return jsonify({"error": "'participant' must be a valid phone number or email address"}), 400
+    msg_type = request.args.get('type')
+    if msg_type is not None:
+        if msg_type not in ('sms', 'mms', 'email'):
+            return jsonify({"error": "'type' must be one of: sms, mms, email"}), 400
+        filters['msg_type'] = msg_type
+    direction = request.args.get('direction')
+    if direction is not None:
+        if direction not in ('inbound', 'outbound'):
+            return jsonify({"error": "'direction' must be one of: inbound, outbound"}), 400
+        filters['direction'] = direction
+
+    time_range, error = parse_time_range()
+    if error:
+        return error
+    page_args, error = parse_page_args()
+    if error:
+        return error
+    try:
+        page = search_messages(terms, **filters, since=time_range[0], until=time_range[1], **page_args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return json_response({
+        "messages": records(page.items),
+        "next_cursor": page.next_cursor,
+        "prev_cursor": page.prev_cursor
+    })
+
+
+# --- Live Message Streams ---
+
+@api.route('/api/conversations/<uuid:conversation_id>/stream', methods=['GET'])
+def stream_conversation(conversation_id):
+    return sse_response(conversation_id=conversation_id)
+
+
+@api.route('/api/participants/<address>/stream', methods=['GET'])
+def stream_participant(address):
+    canonical = normalize_address(address, is_email='@' in address)
+    if canonical is None:
+        return jsonify({"error": "Address must be a valid phone number or email address"}), 400
+    return sse_response(participant=canonical)
+
+
+@api.route('/api/conversations/<uuid:conversation_id>/updates', methods=['GET'])
+def poll_conversation(conversation_id):
+    return long_poll_response(conversation_id=conversation_id)
+
+
+@api.route('/api/participants/<address>/updates', methods=['GET'])
+def poll_participant(address):
+    canonical = normalize_address(address, is_email='@' in address)
+    if canonical is None:
+        return jsonify({"error": "Address must be a valid phone number or email address"}), 400
+    return long_poll_response(participant=canonical)
+
+
+def sse_response(**scope):
+    """
+    Server-Sent Events: one 'message' event per new message, its id the
+    event id to resume from. Browsers send it back as Last-Event-ID when they
+    reconnect; ?last_event_id= does the same for a first connection.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        # on the primary: a lagging replica would miss what the notification was about
+        feed = MessageFeed(current_app.extensions['message_notifier'], db.engine,
+                           last_event_id=last_event_id, **scope)
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID"}), 400
+    heartbeat = current_app.config['STREAM_HEARTBEAT_SECONDS']
+
+    def events():
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                batch = feed.poll(heartbeat)
+                if not batch:
+                    # keeps proxies from timing us out, and finds clients that have gone
+                    yield b": keep-alive\n\n"
+                    continue
+                yield b"".join(
+                    b"id: " + event_id.encode() + b"\nevent: message\ndata: " + dumps(row._asdict()) + b"\n\n"
+                    for event_id, row in batch
+                )
+        finally:
+            feed.close()
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
+def long_poll_response(**scope):
+    """
+    Answers as soon as there are messages after ?after=<cursor> (or after now),
+    otherwise after ?timeout= seconds with none. Pass the returned cursor to the next call.
+    """
+    max_timeout = current_app.config['LONG_POLL_MAX_SECONDS']
+    try:
+        timeout = float(request.args.get('timeout', max_timeout))
+    except ValueError:
+        return jsonify({"error": "'timeout' must be a number"}), 400
+    if not 0 <= timeout <= max_timeout:
+        return jsonify({"error": f"'timeout' must be between 0 and {max_timeout:g}"}), 400
+    try:
+        feed = MessageFeed(current_app.extensions['message_notifier'], db.engine,
+                           last_event_id=request.args.get('after'), **scope)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    try:
+        batch = feed.poll(timeout)
+    finally:
+        feed.close()
+    return json_response({
+        "messages": records([row for _, row in batch]),
+        "cursor": feed.last_event_id
+    })
+
+
+@api.route('/api/streams/stats', methods=['GET'])
+def get_stream_stats():
+    return jsonify(current_app.extensions['message_notifier'].get_stats()), 200
+
+
+# --- Export Endpoints ---
+
+@api.route('/api/conversations/<uuid:conversation_id>/export', methods=['GET'])
+def export_conversation(conversation_id):
+    return export_response(conversation_export_query(conversation_id), f"conversation-{conversation_id}")
+
+
+@api.route('/api/participants/<address>/export', methods=['GET'])
+def export_participant(address):
+    canonical = normalize_address(address, is_email='@' in address)
+    if canonical is None:
+        return jsonify({"error": "Address must be a valid phone number or email address"}), 400
+    time_range, error = parse_time_range()
+    if error:
+        return error
+    return export_response(participant_export_query(canonical, *time_range), "participant-export")
+
+
+@api.route('/api/messages/export', methods=['GET'])
+def export_messages():
+    time_range, error = parse_time_range()
+    if error:
+        return error
+    return export_response(range_export_query(*time_range), "messages-export")
+
+
+def export_response(query, filename: str):
+    """
+    Streams the query as ?format=ndjson (default) or csv, flushing a chunk
+    at a time as rows arrive.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"'format' must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    return Response(
+        stream_export(read_engine() or db.engine, query, fmt),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'}
+    )
+
+
+def parse_time_range():
+    """
+    Reads optional ISO 8601 'since' (inclusive) and 'until' (exclusive).
+    Returns ((since, until), None) or (None, error response).
+    """
+    bounds = []
+    for name in ('since', 'until'):
+        value = request.args.get(name)
+        if value is None:
+            bounds.append(None)
+            continue
+        try:
+            bounds.append(datetime.fromisoformat(value.replace("Z", "+00:00")))
+        except ValueError:
+            return None, (jsonify({"error": f"Invalid ISO 8601 format for '{name}'"}), 400)
+    return tuple(bounds), None
+
+
+def conversations_response(page):
+    return json_response({
+        "conversations": records(page.items),
+        "next_cursor": page.next_cursor,
+        "prev_cursor": page.prev_cursor
+    })
 
 
 @api.route('/api/conversations/<uuid:conversation_id>/messages', methods=['GET'])
 def get_conversation_messages(conversation_id):
-    messages = get_messages_by_conversations(conversation_id)
-    result = [
-        {
-            "id": str(msg.id),
-            "direction": msg.direction,
-            "from": msg.from_address,
-            "to": msg.to_address,
-            "type": msg.type,
-            "body": msg.body,
-            "attachments": msg.attachments,
-            "provider_message_id": msg.provider_message_id,
-            "timestamp": msg.timestamp.isoformat(),
-            "created_at": msg.created_at.isoformat()
-        } for msg in messages
-    ]
-    return jsonify(result), 200
+    page_args, error = parse_page_args()
+    if error:
+        return error
+    try:
+        page = get_messages_by_conversations(conversation_id, **page_args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return json_response({
+        "messages": records(page.items),
+        "next_cursor": page.next_cursor,
+        "prev_cursor": page.prev_cursor
+    })
 
 
-def is_valid_phone(number: str) -> bool:
+# --- Provider Endpoints ---
+
+@api.route('/health', methods=['GET'])
+def health():
+    providers = {
+        "sms": current_app.config['sms_provider'].health(),
+        "email": current_app.config['email_provider'].health()
+    }
+    healthy = all(provider["state"] == "closed" for provider in providers.values())
+    return jsonify({"status": "ok" if healthy else "degraded", "providers": providers}), 200
+
+
+@api.route('/api/providers/stats', methods=['GET'])
+def get_provider_stats():
+    return jsonify({
+        "sms": current_app.config['sms_provider'].get_stats(),
+        "email": current_app.config['email_provider'].get_stats()
+    }), 200
+
+
+@api.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    cache = current_app.config.get('conversation_cache')
+    recent = current_app.config.get('recent_message_ids')
+    return jsonify({
+        "conversations": cache.get_stats() if cache is not None else None,
+        "recent_message_ids": recent.get_stats() if recent is not None else None,
+        "phone_numbers": get_address_cache_stats()
+    }), 200
+
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    registry = current_app.extensions.get('metrics')
+    if registry is None:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@api.route('/api/db/stats', methods=['GET'])
+def get_db_stats():
+    router = current_app.extensions.get('replica_router')
+    maintainer = current_app.extensions.get('partition_maintainer')
+    pools = {name or 'primary': engine.pool.status() for name, engine in db.engines.items()}
+    return jsonify({
+        "pools": pools,
+        "replicas": router.get_stats() if router is not None else None,
+        "partitions": maintainer.get_stats() if maintainer is not None else None
+    }), 200
+
+
+@api.route('/api/webhooks/stats', methods=['GET'])
+def get_webhook_stats():
+    buffer = current_app.extensions.get('group_commit')
+    return jsonify({"group_commit": buffer.get_stats() if buffer is not None else None}), 200
+
+
+def parse_page_args():
+    """
+    Reads limit/after/before from the query string.
+    Returns (kwargs, None) or (None, error response).
+    """
+    page_args, error = page_args_error(request.args)
+    if error:
+        return None, (jsonify({"error": error}), 400)
+    return page_args, None
+
+
+def page_args_error(args) -> tuple:
+    """
+    (kwargs, None) for valid limit/after/before query args, or (None, what's wrong).
+    """
     try:
-        parsed = phonenumbers.parse(number, None)
-        return phonenumbers.is_possible_number(parsed) and phonenumbers.is_valid_number(parsed)
-    except phonenumbers.NumberParseException:
-        return False
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return None, "'limit' must be an integer"
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return None, f"'limit' must be between 1 and {MAX_PAGE_SIZE}"
+
+    after = args.get('after')
+    before = args.get('before')
+    if after and before:
+        return None, "Use only one of 'after' or 'before'"
+
+    return {"limit": limit, "after": after, "before": before}, None
+
+
+def send_response(result):
+    # queued sends are accepted but not yet delivered to the provider
+    if result.queued:
+        return jsonify({"message_id": str(result.message.id), "status": "queued"}), 202
+    return jsonify({"message_id": str(result.message.id)}), 201
+
+
+def is_valid_phone(number: str) -> bool:
+    return normalize_phone(number) is not None
 
 def validate_message_payload(data, inbound=False, is_email=False):
+    error = payload_error(data, inbound=inbound, is_email=is_email)
+    if error:
+        return jsonify({"error": error}), 400
+    return None
+
+
+def payload_error(data, inbound=False, is_email=False) -> str | None:
+    """
+    Returns a description of what's wrong with a message payload, or None.
+    """
+    if not isinstance(data, dict):
+        return "Message payload must be a JSON object"
+
     required_fields = ["from", "to", "body", "timestamp"]
 
     if inbound:
@@ -145,32 +617,34 @@ def validate_message_payload(data, inbound=False, is_email=False):
 
     missing = [field for field in required_fields if field not in data]
     if missing:
-        return jsonify({"error": f"Missing required fields: {', '.join(missing)}"}), 400
+        return f"Missing required fields: {', '.join(missing)}"
 
     # Validate 'from' and 'to' for phone or email
     if not is_email:
+        if data.get("type") not in ("sms", "mms"):
+            return "'type' must be 'sms' or 'mms'"
         if not isinstance(data["from"], str) or not is_valid_phone(data["from"]):
-            return jsonify({"error": "'from' must be a valid phone number"}), 400
+            return "'from' must be a valid phone number"
         if not isinstance(data["to"], str) or not is_valid_phone(data["to"]):
-            return jsonify({"error": "'to' must be a valid phone number"}), 400
+            return "'to' must be a valid phone number"
     else:
-        if not isinstance(data["from"], str) or "@" not in data["from"]:
-            return jsonify({"error": "'from' must be a valid email address"}), 400
-        if not isinstance(data["to"], str) or "@" not in data["to"]:
-            return jsonify({"error": "'to' must be a valid email address"}), 400
+        if normalize_address(data["from"], is_email=True) is None:
+            return "'from' must be a valid email address"
+        if normalize_address(data["to"], is_email=True) is None:
+            return "'to' must be a valid email address"
 
     if not isinstance(data["body"], str):
-        return jsonify({"error": "'body' must be a string"}), 400
+        return "'body' must be a string"
 
     if "attachments" in data and data["attachments"] is not None:
         if not isinstance(data["attachments"], list):
-            return jsonify({"error": "'attachments' must be a list or null"}), 400
+            return "'attachments' must be a list or null"
         if not all(isinstance(item, str) for item in data["attachments"]):
-            return jsonify({"error": "All attachments must be strings"}), 400
+            return "All attachments must be strings"
 
     try:
         datetime.fromisoformat(data["timestamp"].replace("Z", "+00:00"))
     except Exception:
-        return jsonify({"error": "Invalid ISO 8601 format for 'timestamp'"}), 400
+        return "Invalid ISO 8601 format for 'timestamp'"
 
     return None
@@ -1,15 +1,105 @@
 from flask import current_app
-from datetime import datetime, timezone
-from sqlalchemy import or_, and_
-from sqlalchemy.exc import SQLAlchemyError
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+from sqlalchemy import tuple_, event, select, literal, or_, func, cast, Float
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.orm import selectinload
 
 from app import db
-from app.models import Message, Conversation
+from app.models import Message, Conversation, OutboxEntry, Broadcast, InboundMessageId, SEARCH_CONFIG
+from app.addresses import canonical_address
+from app.metrics import phase
+from app.replicas import replica_reads
+from client_integrations.providers import ProviderError, CircuitOpenError
 
-# stuff for mocking cleint call
-import requests_mock
+import base64
+import json
 import uuid
-import os
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+FOREIGN_KEY_VIOLATION = '23503'
+
+# Listings select just these columns as plain row tuples, labelled with their JSON
+# keys, instead of hydrating ORM objects. Conversation columns are all covered by
+# ix_conversations_last_message_at_id, so the global listing is an index-only scan.
+CONVERSATION_LISTING_COLUMNS = (
+    Conversation.id, Conversation.participant_1, Conversation.participant_2,
+    Conversation.created_at, Conversation.updated_at, Conversation.last_message_at,
+    Conversation.last_message_preview, Conversation.last_message_direction,
+    Conversation.last_message_type, Conversation.message_count
+)
+MESSAGE_LISTING_COLUMNS = (
+    Message.id, Message.direction, Message.from_address.label('from'), Message.to_address.label('to'),
+    Message.type, Message.body, Message.attachments, Message.provider_message_id,
+    Message.timestamp, Message.created_at
+)
+
+
+def participant_key(address_1: str, address_2: str) -> str:
+    """
+    Order-independent key for a pair of participants.
+    Must stay in sync with the backfill in migrations.py.
+    """
+    return '|'.join(sorted(address.strip().lower() for address in (address_1, address_2)))
+
+
+def get_conversation_cache():
+    return current_app.config.get('conversation_cache')
+
+
+@event.listens_for(Conversation, 'after_delete')
+def _evict_deleted_conversation(mapper, connection, target):
+    cache = get_conversation_cache()
+    if cache is not None:
+        cache.invalidate_id(target.id)
+
+
+def is_foreign_key_violation(e: SQLAlchemyError) -> bool:
+    return isinstance(e, IntegrityError) and getattr(e.orig, 'pgcode', None) == FOREIGN_KEY_VIOLATION
+
+
+def get_or_create_conversation_id(from_address: str, to_address: str) -> uuid.UUID:
+    """
+    Returns the conversation for this pair, from the conversation cache when
+    possible. Otherwise upserts it in a single round trip; concurrent callers
+    for a new pair all get back the same row.
+    """
+    key = participant_key(from_address, to_address)
+    cache = get_conversation_cache()
+    if cache is not None:
+        conversation_id = cache.get(key)
+        if conversation_id is not None:
+            return conversation_id
+
+    conversation_id = db.session.execute(
+        conversation_upsert(from_address, to_address, key, datetime.now(timezone.utc))
+    ).scalar_one()
+    if cache is not None:
+        cache.put(key, conversation_id)
+    return conversation_id
+
+
+def conversation_upsert(from_address: str, to_address: str, key: str, now: datetime):
+    """
+    INSERT ... RETURNING the id of the pair's conversation, new or existing.
+    """
+    stmt = insert(Conversation).values(
+        id=uuid.uuid4(),
+        participant_1=from_address,
+        participant_2=to_address,
+        participant_key=key,
+        created_at=now,
+        updated_at=now,
+        last_message_at=now
+    )
+    # DO UPDATE (rather than DO NOTHING) so RETURNING also yields existing rows
+    return stmt.on_conflict_do_update(
+        index_elements=[Conversation.participant_key],
+        set_={'updated_at': stmt.excluded.updated_at}
+    ).returning(Conversation.id)
 
 
 def save_message(
@@ -20,67 +110,529 @@ def save_message(
     body: str,
     attachments: list,
     timestamp: str,
-    provider_message_id=None
+    provider_message_id=None,
+    commit: bool = True
 ) -> Message:
     """
     Finds or creates a conversation, then saves a message tied to it.
+    With commit=False the message is only flushed, so the caller can add more
+    rows to the same transaction before committing.
+    """
+    from_address = canonical_address(from_address, msg_type)
+    to_address = canonical_address(to_address, msg_type)
+
+    for attempt in range(2):
+        # Find or create a conversation
+        try:
+            conversation_id = get_or_create_conversation_id(from_address, to_address)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise RuntimeError(f"Failed to fetch or create conversation: {e}")
+
+        # Create and save the message
+        message = Message(
+            direction=direction,
+            from_address=from_address,
+            to_address=to_address,
+            type=msg_type,
+            body=body,
+            attachments=attachments or [],
+            timestamp=timestamp,
+            created_at=datetime.now(timezone.utc),
+            conversation_id=conversation_id,
+            provider_message_id=provider_message_id
+        )
+
+        try:
+            db.session.add(message)
+            if commit:
+                db.session.commit()
+            else:
+                db.session.flush()
+            return message
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            cache = get_conversation_cache()
+            if attempt == 0 and cache is not None and is_foreign_key_violation(e):
+                # the cached conversation is gone; look it up again
+                cache.invalidate(participant_key(from_address, to_address))
+                continue
+            raise RuntimeError(f"Failed to save message: {e}")
+
+
+class SavedMessage(NamedTuple):
+    message_id: uuid.UUID
+    duplicate: bool  # True when this provider message was already stored
+
+
+def get_recent_id_filter():
+    return current_app.config.get('recent_message_ids')
+
+
+def parse_timestamp(timestamp) -> datetime:
+    """
+    An ISO 8601 payload timestamp as stored: psycopg2 passes the string
+    through and Postgres keeps its wall time, dropping any offset.
+    """
+    if isinstance(timestamp, datetime):
+        return timestamp.replace(tzinfo=None)
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).replace(tzinfo=None)
+
+
+def inbound_key(msg_type: str, provider_message_id: str) -> tuple:
+    """
+    What an inbound message is stored once per: its InboundMessageId key.
+    """
+    return msg_type, provider_message_id
+
+
+def _existing_inbound_ids(keys: list) -> dict:
+    """
+    inbound_key -> id for inbound messages already stored.
+    """
+    rows = db.session.execute(
+        select(InboundMessageId.type, InboundMessageId.provider_message_id, InboundMessageId.message_id)
+        .where(tuple_(InboundMessageId.type, InboundMessageId.provider_message_id).in_(keys))
+    ).all()
+    return {(msg_type, provider_id): message_id for msg_type, provider_id, message_id in rows}
+
+
+def save_inbound_message(
+    from_address: str,
+    to_address: str,
+    msg_type: str,
+    body: str,
+    attachments: list,
+    timestamp: str,
+    provider_message_id=None
+) -> SavedMessage:
+    """
+    Saves a webhook message once per inbound_key.
+    Redeliveries get back the id of the stored copy: from the recent id filter
+    without a query, otherwise from the same statement that tried the insert.
+    """
+    from_address = canonical_address(from_address, msg_type)
+    to_address = canonical_address(to_address, msg_type)
+    if not provider_message_id:
+        message = save_message('inbound', from_address, to_address, msg_type, body, attachments, timestamp)
+        return SavedMessage(message.id, False)
+
+    key = inbound_key(msg_type, provider_message_id)
+    recent = get_recent_id_filter()
+    if recent is not None:
+        message_id = recent.get(key)
+        if message_id is not None:
+            return SavedMessage(message_id, True)
+
+    for attempt in range(2):
+        try:
+            conversation_id = get_or_create_conversation_id(from_address, to_address)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise RuntimeError(f"Failed to fetch or create conversation: {e}")
+
+        stmt = inbound_insert(conversation_id, from_address, to_address, msg_type, body, attachments,
+                              timestamp, provider_message_id, datetime.now(timezone.utc))
+        try:
+            row = db.session.execute(stmt).first()
+            if row is None:
+                # lost a race with a copy committed after this statement's snapshot
+                row = (_existing_inbound_ids([key])[key], True)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            cache = get_conversation_cache()
+            if attempt == 0 and cache is not None and is_foreign_key_violation(e):
+                cache.invalidate(participant_key(from_address, to_address))
+                continue
+            raise RuntimeError(f"Failed to save message: {e}")
+
+        if recent is not None:
+            recent.add(key, row[0])
+        return SavedMessage(row[0], row[1])
+
+
+def inbound_insert(conversation_id, from_address: str, to_address: str, msg_type: str, body: str,
+                   attachments: list, timestamp, provider_message_id: str, created_at: datetime):
+    """
+    Claims the message's inbound_key and inserts it, in one round trip.
+    One row: (new id, False), or (the stored copy's id, True) if the key
+    was already claimed. No row if that claim committed after the
+    statement's snapshot.
+    """
+    message_id = uuid.uuid4()
+    claimed = insert(InboundMessageId.__table__).values(
+        type=msg_type,
+        provider_message_id=provider_message_id,
+        message_id=message_id,
+        message_timestamp=timestamp
+    ).on_conflict_do_nothing().returning(InboundMessageId.message_id).cte('claimed')
+    values = {
+        "conversation_id": conversation_id,
+        "direction": 'inbound',
+        "from_address": from_address,
+        "to_address": to_address,
+        "type": msg_type,
+        "body": body,
+        "attachments": attachments or [],
+        "provider_message_id": provider_message_id,
+        "timestamp": timestamp,
+        "created_at": created_at
+    }
+    columns = Message.__table__.c
+    inserted = insert(Message.__table__).from_select(
+        ['id', *values],
+        # one row when the claim went in, none when it was a redelivery
+        select(claimed.c.message_id, *(literal(value, columns[name].type) for name, value in values.items()))
+    ).returning(Message.id).cte('inserted')
+    return select(inserted.c.id, literal(False)).union_all(
+        select(InboundMessageId.message_id, literal(True)).where(
+            InboundMessageId.type == msg_type, InboundMessageId.provider_message_id == provider_message_id
+        )
+    )
+
+
+class Page(NamedTuple):
+    items: list
+    next_cursor: str | None
+    prev_cursor: str | None
+
+
+def encode_cursor(sort_value, row_id) -> str:
+    # datetimes as ISO strings, numeric sort values (search rank) as JSON numbers
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, str(row_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort_type: type = datetime) -> tuple:
+    """
+    Raises ValueError for anything that isn't a cursor we handed out
+    for a listing sorted by a sort_type value.
     """
-    # Find or create a conversation
     try:
-        conversation = Conversation.query.filter(
-            or_(
-                and_(
-                    Conversation.participant_1 == from_address,
-                    Conversation.participant_2 == to_address
-                ),
-                and_(
-                    Conversation.participant_1 == to_address,
-                    Conversation.participant_2 == from_address
-                )
-            )
-        ).first()
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        if sort_type is datetime:
+            sort_value = datetime.fromisoformat(sort_value)
+        elif isinstance(sort_value, (int, float)) and not isinstance(sort_value, bool):
+            sort_value = sort_type(sort_value)
+        else:
+            raise ValueError
+        return sort_value, uuid.UUID(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def keyset_page(query, sort_column, id_column, limit: int, after: str = None,
+                before: str = None, descending: bool = False) -> Page:
+    """
+    Returns one page of query ordered by (sort_column, id_column).
+    'after' continues in the listing's natural order, 'before' goes back the
+    other way. Each page is a range scan on a (sort_column, id_column) index.
+
+    query can also be a list of queries over the same entity. Each one is
+    paged on its own (so each can use its own index) and the results merged.
+    """
+    rows = keyset_query(query, sort_column, id_column, limit, after, before, descending).all()
+    return keyset_result(rows, sort_column, limit, after, before)
+
+
+def keyset_query(query, sort_column, id_column, limit: int, after: str = None,
+                 before: str = None, descending: bool = False):
+    """
+    The query (or Core select) for one keyset_page, fetching limit + 1 rows.
+    Raises ValueError for a bad cursor.
+    """
+    key = tuple_(sort_column, id_column)
+    backwards = before is not None
+    # walking backwards, read in reverse order from the cursor and flip afterwards
+    read_descending = descending != backwards
+    cursor = None
+    if backwards or after is not None:
+        cursor = decode_cursor(before if backwards else after, sort_column.type.python_type)
+
+    def page_query(query, filtered: bool = True):
+        if cursor is not None and filtered:
+            query = query.filter(key < cursor if read_descending else key > cursor)
+            # implied by the row comparison, but only a plain bound lets the planner
+            # skip partitions of a table partitioned on sort_column (messages)
+            query = query.filter(sort_column <= cursor[0] if read_descending else sort_column >= cursor[0])
+        if read_descending:
+            query = query.order_by(sort_column.desc(), id_column.desc())
+        else:
+            query = query.order_by(sort_column, id_column)
+        return query.limit(limit + 1)
+
+    if isinstance(query, list):
+        first, *rest = [page_query(branch) for branch in query]
+        return page_query(first.union_all(*rest), filtered=False)
+    return page_query(query)
+
+
+def keyset_result(rows: list, sort_column, limit: int, after: str = None, before: str = None) -> Page:
+    """
+    The Page for rows fetched with keyset_query.
+    """
+    backwards = before is not None
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        first, last = rows[0], rows[-1]
+        sort_key = sort_column.key
+        # there is always something on the far side of the cursor we paged from
+        if has_more or backwards:
+            next_cursor = encode_cursor(getattr(last, sort_key), last.id)
+        if (backwards and has_more) or (not backwards and after is not None):
+            prev_cursor = encode_cursor(getattr(first, sort_key), first.id)
+
+    return Page(rows, next_cursor, prev_cursor)
+
+
+def get_conversations_all(limit: int = DEFAULT_PAGE_SIZE, after: str = None, before: str = None) -> Page:
+    """
+    Conversations, most recently active first.
+    """
+    with replica_reads():
+        return keyset_page(
+            db.session.query(*CONVERSATION_LISTING_COLUMNS),
+            Conversation.last_message_at, Conversation.id,
+            limit, after=after, before=before, descending=True
+        )
+
+
+def get_conversations_for_participant(address: str, limit: int = DEFAULT_PAGE_SIZE,
+                                      after: str = None, before: str = None) -> Page:
+    """
+    Conversations that address (canonical form) takes part in, most recently
+    active first. Each side of the pair is paged on its own
+    (participant, last_message_at, id) index and the two pages merged, so a page
+    costs the same however many conversations there are.
+    """
+    with replica_reads():
+        return keyset_page(
+            participant_branches(db.session.query(*CONVERSATION_LISTING_COLUMNS), address),
+            Conversation.last_message_at, Conversation.id,
+            limit, after=after, before=before, descending=True
+        )
+
+
+def participant_branches(query, address: str) -> list:
+    """
+    query (ORM or Core, over conversations) narrowed to each side of the pair.
+    """
+    as_first = query.filter(Conversation.participant_1 == address)
+    # a conversation with yourself is already in the first branch
+    as_second = query.filter(Conversation.participant_2 == address, Conversation.participant_1 != address)
+    return [as_first, as_second]
+
 
-        if not conversation:
-            conversation = Conversation(
-                participant_1=from_address,
-                participant_2=to_address
+def get_messages_by_conversations(conversation_id, limit: int = DEFAULT_PAGE_SIZE,
+                                  after: str = None, before: str = None) -> Page:
+    """
+    Messages in a conversation, oldest first.
+    """
+    with replica_reads():
+        return keyset_page(
+            db.session.query(*MESSAGE_LISTING_COLUMNS).filter(Message.conversation_id == conversation_id),
+            Message.timestamp, Message.id,
+            limit, after=after, before=before
+        )
+
+def search_messages(terms: str, participant: str = None, msg_type: str = None, direction: str = None,
+                    since: datetime = None, until: datetime = None, limit: int = DEFAULT_PAGE_SIZE,
+                    after: str = None, before: str = None) -> Page:
+    """
+    Messages whose body matches terms (web search syntax: quoted phrases, OR,
+    -excluded), best match first. Matches are found through the body_tsv GIN
+    index; each page still ranks every match, but never reads past it.
+    """
+    query = func.websearch_to_tsquery(SEARCH_CONFIG, terms)
+    # float8, so the rank in a cursor compares equal to the one it came from
+    rank = cast(func.ts_rank(Message.body_tsv, query), Float).label('rank')
+    search = db.session.query(
+        *MESSAGE_LISTING_COLUMNS, Message.conversation_id, rank
+    ).filter(Message.body_tsv.op('@@')(query))
+
+    if participant is not None:
+        search = search.filter(Message.conversation_id.in_(
+            select(Conversation.id).where(
+                or_(Conversation.participant_1 == participant, Conversation.participant_2 == participant)
             )
-            db.session.add(conversation)
-            db.session.flush()
+        ))
+    if msg_type is not None:
+        search = search.filter(Message.type == msg_type)
+    if direction is not None:
+        search = search.filter(Message.direction == direction)
+    if since is not None:
+        search = search.filter(Message.timestamp >= since)
+    if until is not None:
+        search = search.filter(Message.timestamp < until)
+
+    with replica_reads():
+        return keyset_page(search, rank, Message.id, limit, after=after, before=before, descending=True)
+
+
+def save_messages_bulk(direction: str, messages: list, commit: bool = True, _retry: bool = True) -> list:
+    """
+    Saves many messages in one transaction. Each item holds save_message's
+    keyword arguments. Conversations missing from the conversation cache are
+    resolved with one multi-row upsert and the messages go in as multi-row INSERTs.
+    Inbound messages are de-duplicated on inbound_key like
+    save_inbound_message. Returns a SavedMessage per item, in input order.
+    With commit=False the rows are only flushed, as with save_message.
+    """
+    if not messages:
+        return []
+
+    results = [None] * len(messages)
+    recent = get_recent_id_filter() if direction == 'inbound' else None
+    pending = []
+    for index, item in enumerate(messages):
+        provider_id = item.get('provider_message_id')
+        message_id = recent.get(inbound_key(item['msg_type'], provider_id)) \
+            if recent is not None and provider_id else None
+        if message_id is not None:
+            results[index] = SavedMessage(message_id, True)
+        else:
+            pending.append(index)
+    if not pending:
+        return results
+    to_save = [
+        dict(
+            messages[index],
+            from_address=canonical_address(messages[index]['from_address'], messages[index]['msg_type']),
+            to_address=canonical_address(messages[index]['to_address'], messages[index]['msg_type'])
+        ) for index in pending
+    ]
+
+    now = datetime.now(timezone.utc)
+    pairs = {}
+    for item in to_save:
+        key = participant_key(item['from_address'], item['to_address'])
+        pairs.setdefault(key, (item['from_address'], item['to_address']))
 
+    cache = get_conversation_cache()
+    conversation_ids = {}
+    if cache is not None:
+        for key in pairs:
+            conversation_id = cache.get(key)
+            if conversation_id is not None:
+                conversation_ids[key] = conversation_id
+    missing = sorted((key, pair) for key, pair in pairs.items() if key not in conversation_ids)
+
+    try:
+        if missing:
+            # executemany rather than one .values() list, so the statement compiles once and
+            # caches, whatever the batch size. Sorted so concurrent batches lock
+            # conversation rows in the same order
+            stmt = insert(Conversation.__table__)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Conversation.participant_key],
+                set_={'updated_at': stmt.excluded.updated_at}
+            ).returning(Conversation.participant_key, Conversation.id)
+            upserted = dict(db.session.execute(stmt, [
+                {
+                    "id": uuid.uuid4(),
+                    "participant_1": from_address,
+                    "participant_2": to_address,
+                    "participant_key": key,
+                    "created_at": now,
+                    "updated_at": now
+                } for key, (from_address, to_address) in missing
+            ]).all())
+            conversation_ids.update(upserted)
+            if cache is not None:
+                for key, conversation_id in upserted.items():
+                    cache.put(key, conversation_id)
     except SQLAlchemyError as e:
         db.session.rollback()
-        raise RuntimeError(f"Failed to fetch or create conversation: {e}")
+        raise RuntimeError(f"Failed to fetch or create conversations: {e}")
 
-    # Create and save the message
-    message = Message(
-        direction=direction,
-        from_address=from_address,
-        to_address=to_address,
-        type=msg_type,
-        body=body,
-        attachments=attachments or [],
-        timestamp=timestamp,
-        created_at=datetime.now(timezone.utc),
-        conversation_id=conversation.id,
-        provider_message_id=provider_message_id
-    )
+    rows = [
+        {
+            "id": uuid.uuid4(),
+            "conversation_id": conversation_ids[participant_key(item['from_address'], item['to_address'])],
+            "direction": direction,
+            "from_address": item['from_address'],
+            "to_address": item['to_address'],
+            "type": item['msg_type'],
+            "body": item['body'],
+            "attachments": item.get('attachments') or [],
+            "provider_message_id": item.get('provider_message_id'),
+            "timestamp": item['timestamp'],
+            "created_at": now
+        } for item in to_save
+    ]
 
     try:
-        db.session.add(message)
-        db.session.commit()
+        if direction == 'inbound':
+            # sorted so concurrent batches wait on each other's claims in the same order
+            claims = sorted(
+                ({
+                    "type": row["type"],
+                    "provider_message_id": row["provider_message_id"],
+                    "message_id": row["id"],
+                    "message_timestamp": row["timestamp"]
+                } for row in rows if row["provider_message_id"]),
+                key=lambda claim: (claim["type"], claim["provider_message_id"])
+            )
+            claimed = set(db.session.execute(
+                insert(InboundMessageId.__table__).on_conflict_do_nothing().returning(InboundMessageId.message_id),
+                claims
+            ).scalars()) if claims else set()
+            # unclaimed rows are redeliveries, of stored messages or of an earlier item in this batch
+            inserted = {row["id"] for row in rows if not row["provider_message_id"] or row["id"] in claimed}
+            if inserted:
+                db.session.execute(insert(Message.__table__), [row for row in rows if row["id"] in inserted])
+            skipped = [inbound_key(row["type"], row["provider_message_id"]) for row in rows if row["id"] not in inserted]
+            existing = _existing_inbound_ids(skipped) if skipped else {}
+        else:
+            db.session.execute(insert(Message.__table__), rows)
+            inserted, existing = None, {}
+        if commit:
+            db.session.commit()
     except SQLAlchemyError as e:
         db.session.rollback()
-        raise RuntimeError(f"Failed to save message: {e}")
+        if cache is not None and is_foreign_key_violation(e):
+            # some cached conversation is gone; resolve the whole batch again.
+            # Without commit the caller's own rows went with the rollback, so they retry instead
+            for key in pairs:
+                cache.invalidate(key)
+            if _retry and commit:
+                return save_messages_bulk(direction, messages, _retry=False)
+        raise RuntimeError(f"Failed to save messages: {e}")
+
+    for index, row in zip(pending, rows):
+        key = inbound_key(row["type"], row["provider_message_id"]) \
+            if direction == 'inbound' and row["provider_message_id"] else None
+        if inserted is None or row["id"] in inserted:
+            results[index] = SavedMessage(row["id"], False)
+        else:
+            results[index] = SavedMessage(existing[key], True)
+        if recent is not None and key is not None:
+            recent.add(key, results[index].message_id)
+
+    return results
 
-    return message
 
+def get_provider(msg_type: str):
+    if msg_type == "sms" or msg_type == "mms":
+        return current_app.config['sms_provider']
+    elif msg_type == "email":
+        return current_app.config['email_provider']
+    raise ValueError(f"Unsupported message type: {msg_type}")
 
-def get_conversations_all():
-    return Conversation.query.order_by(Conversation.updated_at.desc()).all()
 
-def get_messages_by_conversations(conversation_id):
-    return Message.query.filter_by(conversation_id=conversation_id).order_by(Message.timestamp).all()
+class SendResult(NamedTuple):
+    message: Message
+    queued: bool  # True when left to the outbox dispatcher rather than sent inline
+
 
 def send_message(
     from_address: str,
@@ -89,13 +641,44 @@ def send_message(
     body: str,
     attachments: list,
     timestamp: str
-) -> Message:
+) -> SendResult:
     """
     Saves and sends a message via the appropriate provider.
     Handles retry logic and failures via the provider class.
+
+    In outbox mode the message and its pending dispatch are committed together
+    and the provider call is left to the outbox dispatcher. The same happens
+    when the provider's circuit is open and OUTBOX_DEFER_WHEN_OPEN is set.
     """
     direction = "outbound"
 
+    # fail before writing anything if the type can't be dispatched
+    provider = get_provider(msg_type)
+    from_address = canonical_address(from_address, msg_type)
+    to_address = canonical_address(to_address, msg_type)
+
+    if current_app.config.get('OUTBOX_ENABLED') or (
+        current_app.config.get('OUTBOX_DEFER_WHEN_OPEN') and provider.circuit_open()
+    ):
+        saved_message = save_message(
+            direction=direction,
+            from_address=from_address,
+            to_address=to_address,
+            msg_type=msg_type,
+            body=body,
+            attachments=attachments,
+            timestamp=timestamp,
+            commit=False
+        )
+        now = datetime.now(timezone.utc)
+        try:
+            db.session.add(OutboxEntry(message=saved_message, next_attempt_at=now, created_at=now))
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise RuntimeError(f"Failed to queue message: {e}")
+        return SendResult(saved_message, True)
+
     # Save the message without provider_message_id
     saved_message = save_message(
         direction=direction,
@@ -107,36 +690,284 @@ def send_message(
         timestamp=timestamp
     )
 
-    # Choose the appropriate provider
-    if msg_type == "sms" or msg_type == "mms":
-        provider = current_app.config['sms_provider']
-    elif msg_type == "email":
-        provider = current_app.config['email_provider']
-    else:
-        raise ValueError(f"Unsupported message type: {msg_type}")
+    # if rate limited, retries run later on the provider's scheduler and report back here
+    app = current_app._get_current_object()
+    message_id, message_timestamp = saved_message.id, saved_message.timestamp
 
-    # Try sending via the mocked provider
     try:
-        with requests_mock.Mocker() as m:
-            # simluate real http client call
-            m.post(os.environ['VERIZON_POST_ENDPOINT'], json={'id': f"sms-{uuid.uuid4()}"})
-            m.post(os.environ['GMAIL_POST_ENDPOINT'], json={'id': f"email-{uuid.uuid4()}"})
-
+        with phase('provider'):
             external_id = provider.send_with_retry({
                 "from": from_address,
                 "to": to_address,
                 "body": body,
                 "attachments": attachments,
                 "timestamp": timestamp
-            })
+            }, on_complete=lambda provider_id: record_provider_message_id(
+                app, message_id, message_timestamp, provider_id
+            ))
 
-            if external_id:
-                # Update message with external ID
-                saved_message.provider_message_id = external_id
-                db.session.commit()
+        if external_id:
+            # Update message with external ID
+            saved_message.provider_message_id = external_id
+            db.session.commit()
 
     except Exception as e:
         # outbound messages without a provider_message_id can be assumed to have failed
         print(f"Message sending failed: {e}")
 
-    return saved_message
+    return SendResult(saved_message, False)
+
+
+def create_broadcast(
+    from_address: str,
+    recipients: list,
+    msg_type: str,
+    body: str,
+    attachments: list,
+    timestamp: str,
+    chunk_size: int = 5000
+) -> Broadcast:
+    """
+    Saves one outbound message per recipient and queues each for the outbox
+    dispatcher, all in one transaction. Conversations are upserted and messages
+    and outbox entries inserted chunk_size at a time with multi-row statements.
+    """
+    get_provider(msg_type)
+    from_address = canonical_address(from_address, msg_type)
+    now = datetime.now(timezone.utc)
+    broadcast = Broadcast(
+        id=uuid.uuid4(),
+        from_address=from_address,
+        type=msg_type,
+        body=body,
+        attachments=attachments or [],
+        recipient_count=len(recipients),
+        created_at=now
+    )
+    try:
+        db.session.add(broadcast)
+        db.session.flush()
+        for start in range(0, len(recipients), chunk_size):
+            saved = save_messages_bulk('outbound', [
+                {
+                    "from_address": from_address,
+                    "to_address": to_address,
+                    "msg_type": msg_type,
+                    "body": body,
+                    "attachments": attachments,
+                    "timestamp": timestamp
+                } for to_address in recipients[start:start + chunk_size]
+            ], commit=False)
+            db.session.execute(insert(OutboxEntry.__table__), [
+                {
+                    "id": uuid.uuid4(),
+                    "message_id": message.message_id,
+                    "message_timestamp": timestamp,
+                    "status": 'pending',
+                    "attempts": 0,
+                    "next_attempt_at": now,
+                    "created_at": now,
+                    "broadcast_id": broadcast.id
+                } for message in saved
+            ])
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise RuntimeError(f"Failed to queue broadcast: {e}")
+    return broadcast
+
+
+def get_broadcast_progress(broadcast_id) -> dict | None:
+    broadcast = db.session.get(Broadcast, broadcast_id)
+    if broadcast is None:
+        return None
+    counts = dict(
+        db.session.query(OutboxEntry.status, func.count())
+        .filter(OutboxEntry.broadcast_id == broadcast_id)
+        .group_by(OutboxEntry.status)
+        .all()
+    )
+    pending = counts.get('pending', 0) + counts.get('in_flight', 0)
+    return {
+        "broadcast_id": str(broadcast.id),
+        "status": "sending" if pending else "done",
+        "recipients": broadcast.recipient_count,
+        "sent": counts.get('sent', 0),
+        "failed": counts.get('failed', 0),
+        "pending": pending,
+        "created_at": broadcast.created_at.isoformat()
+    }
+
+
+def record_provider_message_id(app, message_id, message_timestamp, provider_message_id):
+    """
+    Completion callback for sends whose retries finished after the request returned.
+    """
+    if not provider_message_id:
+        print(f"Message sending failed after retries: {message_id}")
+        return
+    with app.app_context():
+        try:
+            # by the full key, so only the message's partition is searched
+            Message.query.filter_by(id=message_id, timestamp=message_timestamp).update(
+                {"provider_message_id": provider_message_id}
+            )
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            print(f"Failed to record provider id for {message_id}: {e}")
+
+
+# --- Outbox ---
+
+def claim_outbox_batch(batch_size: int, lease_seconds: float) -> tuple:
+    """
+    Claims up to batch_size due outbox entries for this worker.
+    Rows locked by other workers are skipped, and entries whose lease ran out
+    (worker died mid-send) become claimable again.
+    Returns (entries, lease), the lease being their next_attempt_at.
+    """
+    now = datetime.now(timezone.utc)
+    lease = now + timedelta(seconds=lease_seconds)
+    try:
+        entries = (
+            OutboxEntry.query
+            .filter(
+                OutboxEntry.status.in_(('pending', 'in_flight')),
+                OutboxEntry.next_attempt_at <= now
+            )
+            .order_by(OutboxEntry.next_attempt_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            # the batch's messages in one query rather than one per entry
+            .options(selectinload(OutboxEntry.message))
+            # an entry claimed before may still be in the session, take the row as locked now
+            .populate_existing()
+            .all()
+        )
+        for entry in entries:
+            entry.status = 'in_flight'
+            entry.attempts += 1
+            entry.next_attempt_at = lease
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise RuntimeError(f"Failed to claim outbox entries: {e}")
+
+    return entries, lease
+
+
+def update_leased_entry(entry: OutboxEntry, lease, **values) -> bool:
+    """
+    Updates and commits a claimed entry, provided this worker still holds its
+    lease: once the lease runs out another worker may claim the entry, and its
+    next_attempt_at no longer matches. False (and nothing written) if so.
+    """
+    try:
+        updated = db.session.execute(
+            OutboxEntry.__table__.update()
+            .where(
+                OutboxEntry.id == entry.id,
+                OutboxEntry.status == 'in_flight',
+                OutboxEntry.next_attempt_at == lease
+            )
+            .values(**values)
+        ).rowcount
+        if not updated:
+            db.session.rollback()
+            print(f"Outbox entry {entry.id} was reclaimed by another worker, leaving it")
+            return False
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise RuntimeError(f"Failed to record dispatch result: {e}")
+    return True
+
+
+def dispatch_outbox_entry(entry: OutboxEntry, lease, lease_seconds: float = 60.0) -> bool:
+    """
+    Sends a claimed entry's message and records the outcome. The lease is
+    renewed as the send starts, so lease_seconds only has to cover one send
+    rather than the whole batch before it; a lost lease skips the entry.
+    """
+    send_lease = datetime.now(timezone.utc) + timedelta(seconds=lease_seconds)
+    if not update_leased_entry(entry, lease, next_attempt_at=send_lease):
+        return False
+    lease = send_lease
+
+    message = entry.message
+    payload = {
+        "from": message.from_address,
+        "to": message.to_address,
+        "body": message.body,
+        "attachments": message.attachments,
+        "timestamp": message.timestamp.isoformat()
+    }
+    external_id = None
+    retry_at = None
+    last_error = None
+    try:
+        provider = get_provider(message.type)
+        wait = provider.acquire_send_slot(payload)
+        if wait:
+            # over our own rate policy: put it back without spending an attempt
+            update_leased_entry(
+                entry, lease, status='pending', attempts=OutboxEntry.attempts - 1,
+                next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=wait)
+            )
+            return False
+        external_id = provider.send_once(payload)
+    except CircuitOpenError as e:
+        # provider is down: wait out the open circuit without spending an attempt
+        update_leased_entry(
+            entry, lease, status='pending', attempts=OutboxEntry.attempts - 1, last_error=str(e),
+            next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=e.retry_after)
+        )
+        return False
+    except ProviderError as e:
+        # rate limited: park the entry until its next attempt time rather than sleeping
+        last_error = str(e)
+        retry_at = next_outbox_attempt_at(entry, provider.retry_policy, e.retry_after)
+    except Exception as e:
+        last_error = str(e)
+
+    if external_id:
+        # in the same transaction as the entry, so only the lease holder records it
+        message.provider_message_id = external_id
+        return update_leased_entry(entry, lease, status='sent', last_error=None)
+    if retry_at:
+        if update_leased_entry(entry, lease, status='pending', next_attempt_at=retry_at, last_error=last_error):
+            provider.stats.record_retry()
+        return False
+    update_leased_entry(
+        entry, lease, status='failed', last_error=last_error or "Provider did not return a message id"
+    )
+    return False
+
+
+def next_outbox_attempt_at(entry: OutboxEntry, policy, retry_after: float = None):
+    """
+    When the entry should be retried, or None once its retry count or time
+    budget is used up. entry.attempts already includes the attempt that failed.
+    """
+    now = datetime.now(timezone.utc)
+    delay = policy.next_delay(entry.attempts, retry_after)
+    # columns are stored as naive UTC
+    elapsed = (now - entry.created_at.replace(tzinfo=timezone.utc)).total_seconds() + delay
+    if not policy.allows(entry.attempts, elapsed):
+        return None
+    return now + timedelta(seconds=delay)
+
+
+def dispatch_outbox_batch(batch_size: int = 50, lease_seconds: float = 60.0) -> int:
+    """
+    Claims and dispatches one batch. Returns the number of entries claimed.
+    """
+    entries, lease = claim_outbox_batch(batch_size, lease_seconds)
+    if not entries:
+        return 0
+
+    for entry in entries:
+        dispatch_outbox_entry(entry, lease, lease_seconds)
+
+    return len(entries)
@@ -0,0 +1,117 @@
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class CarrierSimulator:
+    """
+    Local stand-in for a carrier API. Accepts POSTs and answers with a
+    provider id, or 429 (Retry-After: 1) once more than max_rps requests
+    arrive within one second.
+
+    Each answer takes a latency drawn from a lognormal distribution with
+    median latency_ms and shape latency_sigma (0 for a fixed latency), and a
+    rate_limit_rate / error_rate fraction of requests get a 429 / 500 anyway.
+    Draws come from a seeded generator, so runs are repeatable.
+    """
+
+    def __init__(self, max_rps: float = None, host: str = '127.0.0.1', port: int = 0,
+                 latency_ms: float = 0.0, latency_sigma: float = 0.0,
+                 rate_limit_rate: float = 0.0, error_rate: float = 0.0, seed: int = None):
+        self.max_rps = max_rps
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = deque()
+        self.accepted = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/send"
+
+    def start(self) -> 'CarrierSimulator':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"accepted": self.accepted, "rate_limited": self.rate_limited, "server_errors": self.server_errors}
+
+    def _admit(self) -> int:
+        """
+        The status to answer with: 201, 429 or 500.
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._window and now - self._window[0] >= 1.0:
+                self._window.popleft()
+            draw = self._random.random()
+            if (self.max_rps is not None and len(self._window) >= self.max_rps) or draw < self.rate_limit_rate:
+                self.rate_limited += 1
+                return 429
+            if draw < self.rate_limit_rate + self.error_rate:
+                self.server_errors += 1
+                return 500
+            self._window.append(now)
+            self.accepted += 1
+            return 201
+
+    def _latency(self) -> float:
+        if not self.latency_ms:
+            return 0.0
+        if not self.latency_sigma:
+            return self.latency_ms / 1000
+        with self._lock:
+            return self._random.lognormvariate(0.0, self.latency_sigma) * self.latency_ms / 1000
+
+    def _handler(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                status = simulator._admit()
+                latency = simulator._latency()
+                if latency:
+                    time.sleep(latency)
+                if status == 201:
+                    self._reply(201, {"id": f"sim-{uuid.uuid4()}"})
+                elif status == 429:
+                    self._reply(429, {"error": "rate limited"}, {"Retry-After": "1"})
+                else:
+                    self._reply(500, {"error": "simulated carrier error"})
+
+            def _reply(self, status, payload, headers=None):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,365 @@
+"""
+Drives a mix of outbound sends, inbound webhooks and conversation reads at a
+target request rate and reports throughput, p50/p95/p99 latency and database
+queries per request for each endpoint, as JSON to diff between versions.
+
+The app is started as a subprocess using the DB_* settings from the
+environment (any local Postgres, e.g. `make db-up`), with both providers
+pointed at a local carrier simulator whose latency, 429 rate and 5xx rate are
+set here. --url runs against an app that is already up instead; point its
+provider endpoints at --carrier-port yourself. Latency is measured from when
+each request was due, so a backed-up server can't hide its queueing.
+
+    python -m benchmarks.load_test --rps 200 --duration 30 --mix send=3,webhook=5,read=2 --output before.json
+    python -m benchmarks.load_test --server-env GROUP_COMMIT_ENABLED=true --output after.json
+    python -m benchmarks.load_test --compare before.json after.json
+
+--server async serves the same app from create_async_app() (app/asgi.py) under
+hypercorn. /metrics only instruments routes the sync app serves, so
+db_queries_per_request is null for the routes the async app takes over.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from benchmarks.carrier_sim import CarrierSimulator
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# scenario -> (method, route template as labelled on /metrics)
+ENDPOINTS = {
+    "send": ('POST', '/api/messages/sms'),
+    "send_email": ('POST', '/api/messages/email'),
+    "webhook": ('POST', '/api/webhooks/sms'),
+    "read": ('GET', '/api/conversations/<uuid:conversation_id>/messages'),
+    "list": ('GET', '/api/participants/<address>/conversations'),
+}
+DEFAULT_MIX = "send=3,webhook=5,read=2"
+
+_DB_QUERIES_SAMPLE = re.compile(r'^http_request_db_queries_(sum|count)\{route="([^"]*)"\} (\S+)$', re.M)
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown scenario '{name}', expected one of {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(ordered: list, q: float) -> float | None:
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))]
+
+
+class Workload:
+    """
+    Request payloads for one run: customers texting one service number,
+    which answers them. Every run gets a fresh service number, so its
+    conversations start out empty.
+    """
+
+    def __init__(self, base_url: str, customers: int, seed: int):
+        self.base_url = base_url
+        self.random = random.Random(seed)
+        self.service = f"+1804555{random.SystemRandom().randint(0, 9999):04d}"
+        self.customers = [f"+1201555{i:04d}" for i in range(customers)]
+        self.conversation_ids = []
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_maxsize=1))
+        return session
+
+    def seed(self):
+        """
+        One inbound message per customer, then the conversations they opened.
+        """
+        for customer in self.customers:
+            self.session.post(f"{self.base_url}/api/webhooks/sms", json=self._webhook(customer)).raise_for_status()
+        after = None
+        while True:
+            params = {"limit": 500, **({"after": after} if after else {})}
+            page = self.session.get(f"{self.base_url}/api/participants/{self.service}/conversations", params=params)
+            page.raise_for_status()
+            page = page.json()
+            self.conversation_ids += [conversation["id"] for conversation in page["conversations"]]
+            after = page["next_cursor"]
+            if not after:
+                break
+
+    def _timestamp(self) -> str:
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+    def _webhook(self, customer: str) -> dict:
+        return {
+            "from": customer,
+            "to": self.service,
+            "type": "sms",
+            "messaging_provider_id": f"load-{uuid.uuid4()}",
+            "body": "load test inbound message",
+            "attachments": None,
+            "timestamp": self._timestamp()
+        }
+
+    def request(self, scenario: str, pick: float):
+        """
+        Sends one request for the scenario; pick (0..1) chooses the customer or conversation.
+        """
+        customer = self.customers[int(pick * len(self.customers))]
+        url = self.base_url + ENDPOINTS[scenario][1]
+        if scenario == 'send':
+            return self.session.post(url, json={
+                "from": self.service, "to": customer, "type": "sms", "body": "load test outbound message",
+                "attachments": [], "timestamp": self._timestamp()
+            })
+        if scenario == 'send_email':
+            return self.session.post(url, json={
+                "from": "support@example.com", "to": f"customer{customer[-4:]}@example.com",
+                "body": "<p>load test email</p>", "attachments": [], "timestamp": self._timestamp()
+            })
+        if scenario == 'webhook':
+            return self.session.post(url, json=self._webhook(customer))
+        if scenario == 'read':
+            conversation_id = self.conversation_ids[int(pick * len(self.conversation_ids))]
+            return self.session.get(f"{self.base_url}/api/conversations/{conversation_id}/messages",
+                                    params={"limit": 50})
+        return self.session.get(f"{self.base_url}/api/participants/{customer}/conversations")
+
+
+def scrape_db_queries(base_url: str) -> dict | None:
+    """
+    Route -> (queries, requests) from the server's /metrics, or None without metrics.
+    """
+    try:
+        resp = requests.get(f"{base_url}/metrics", timeout=10)
+    except requests.RequestException:
+        return None
+    if resp.status_code != 200:
+        return None
+    totals = {}
+    for kind, route, value in _DB_QUERIES_SAMPLE.findall(resp.text):
+        queries, count = totals.get(route, (0.0, 0.0))
+        totals[route] = (float(value), count) if kind == 'sum' else (queries, float(value))
+    return totals
+
+
+def run_load(workload: Workload, mix: dict, rps: float, duration: float, warmup: float,
+             concurrency: int, seed: int) -> dict:
+    """
+    Open loop: request i is due at start + i / rps whether or not earlier ones have finished.
+    """
+    schedule = random.Random(seed)
+    scenarios, weights = list(mix), list(mix.values())
+    results = {scenario: [] for scenario in mix}  # scenario -> [(latency_s, ok)]
+    lock = threading.Lock()
+    measure_from = None
+    db_before = None
+
+    def fire(scenario: str, pick: float, due: float):
+        try:
+            ok = workload.request(scenario, pick).status_code < 400
+        except requests.RequestException:
+            ok = False
+        finished = time.perf_counter()
+        if due >= measure_from:
+            with lock:
+                results[scenario].append((finished - due, ok))
+
+    started = time.perf_counter()
+    measure_from = started + warmup
+    total = int(rps * (warmup + duration))
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(total):
+            due = started + i / rps
+            if db_before is None and due >= measure_from:
+                db_before = scrape_db_queries(workload.base_url)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            scenario = schedule.choices(scenarios, weights)[0]
+            pool.submit(fire, scenario, schedule.random(), due)
+    elapsed = time.perf_counter() - measure_from
+    db_after = scrape_db_queries(workload.base_url)
+
+    endpoints = {}
+    for scenario, samples in results.items():
+        method, route = ENDPOINTS[scenario]
+        latencies = sorted(latency for latency, _ in samples)
+        queries_per_request = None
+        if db_before is not None and db_after is not None and route in db_after:
+            queries, count = db_after[route]
+            queries_before, count_before = db_before.get(route, (0.0, 0.0))
+            if count > count_before:
+                queries_per_request = round((queries - queries_before) / (count - count_before), 2)
+        endpoints[f"{method} {route}"] = {
+            "requests": len(samples),
+            "errors": sum(1 for _, ok in samples if not ok),
+            "throughput_rps": round(len(samples) / elapsed, 1),
+            "p50_ms": round(1000 * percentile(latencies, 0.50), 2) if latencies else None,
+            "p95_ms": round(1000 * percentile(latencies, 0.95), 2) if latencies else None,
+            "p99_ms": round(1000 * percentile(latencies, 0.99), 2) if latencies else None,
+            "max_ms": round(1000 * latencies[-1], 2) if latencies else None,
+            "db_queries_per_request": queries_per_request
+        }
+    completed = sum(endpoint["requests"] for endpoint in endpoints.values())
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "requests": completed,
+        "errors": sum(endpoint["errors"] for endpoint in endpoints.values()),
+        "throughput_rps": round(completed / elapsed, 1),
+        "endpoints": endpoints
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(carrier_url: str, server_env: list, server: str = 'sync', timeout: float = 120.0):
+    """
+    The app in a subprocess with its providers pointed at the simulator. Returns (process, base url).
+    server 'sync' is create_app() under `flask run`, 'async' is create_async_app() under hypercorn.
+    """
+    port = free_port()
+    env = dict(os.environ, VERIZON_POST_ENDPOINT=carrier_url, GMAIL_POST_ENDPOINT=carrier_url,
+               PROVIDER_SIMULATION='false', METRICS_ENABLED='true')
+    for item in server_env:
+        name, _, value = item.partition('=')
+        env[name] = value
+    if server == 'async':
+        command = [sys.executable, '-m', 'hypercorn', '-b', f'127.0.0.1:{port}', 'app.asgi:create_async_app()']
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port)]
+    process = subprocess.Popen(
+        command,
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"App exited with status {process.returncode} while starting")
+        try:
+            requests.get(f"{base_url}/health", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError(f"App did not come up within {timeout}s")
+
+
+def compare(before_path: str, after_path: str) -> dict:
+    """
+    Per-endpoint before/after values and percentage change for two reports.
+    """
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    changes = {}
+    for endpoint in sorted(set(before["endpoints"]) | set(after["endpoints"])):
+        old, new = before["endpoints"].get(endpoint, {}), after["endpoints"].get(endpoint, {})
+        changes[endpoint] = {}
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "errors", "db_queries_per_request"):
+            old_value, new_value = old.get(metric), new.get(metric)
+            change = None
+            if old_value and new_value is not None:
+                change = round(100 * (new_value - old_value) / old_value, 1)
+            changes[endpoint][metric] = {"before": old_value, "after": new_value, "change_pct": change}
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rps', type=float, default=100, help='target requests/sec')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds of load before measuring')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"scenario weights, from {', '.join(ENDPOINTS)}")
+    parser.add_argument('--concurrency', type=int, default=64, help='requests in flight at most')
+    parser.add_argument('--customers', type=int, default=200, help='conversations seeded and used')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--carrier-latency-ms', type=float, default=50, help='median carrier latency')
+    parser.add_argument('--carrier-latency-sigma', type=float, default=0.5, help='lognormal shape, 0 for fixed')
+    parser.add_argument('--carrier-429-rate', type=float, default=0.0)
+    parser.add_argument('--carrier-5xx-rate', type=float, default=0.0)
+    parser.add_argument('--carrier-max-rps', type=float, help='429 above this many requests/sec')
+    parser.add_argument('--carrier-port', type=int, default=0)
+    parser.add_argument('--server-env', action='append', default=[], metavar='NAME=VALUE',
+                        help='extra settings for the app subprocess, repeatable')
+    parser.add_argument('--server', choices=('sync', 'async'), default='sync',
+                        help='serve with create_app() under flask run or create_async_app() under hypercorn')
+    parser.add_argument('--url', help='use the app already running here')
+    parser.add_argument('--output', help='also write the report to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='diff two reports and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2, sort_keys=True))
+        return
+
+    logging.getLogger().setLevel(logging.WARNING)
+    mix = parse_mix(args.mix)
+    carrier = CarrierSimulator(
+        max_rps=args.carrier_max_rps, port=args.carrier_port,
+        latency_ms=args.carrier_latency_ms, latency_sigma=args.carrier_latency_sigma,
+        rate_limit_rate=args.carrier_429_rate, error_rate=args.carrier_5xx_rate, seed=args.seed
+    ).start()
+    process = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            process, base_url = start_server(carrier.url, args.server_env, args.server)
+        workload = Workload(base_url, args.customers, args.seed)
+        workload.seed()
+        report = run_load(workload, mix, args.rps, args.duration, args.warmup, args.concurrency, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(30)
+        carrier.stop()
+
+    report["config"] = {
+        "rps": args.rps, "duration_s": args.duration, "warmup_s": args.warmup, "mix": mix,
+        "concurrency": args.concurrency, "customers": args.customers, "seed": args.seed,
+        "server": None if args.url else args.server, "server_env": args.server_env,
+        "carrier": {
+            "latency_ms": args.carrier_latency_ms, "latency_sigma": args.carrier_latency_sigma,
+            "rate_limit_rate": args.carrier_429_rate, "error_rate": args.carrier_5xx_rate,
+            "max_rps": args.carrier_max_rps
+        }
+    }
+    report["carrier"] = carrier.stats()
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Sustained send throughput against a carrier that returns 429 above --quota rps,
+with and without the client-side rate limiter.
+
+    python -m benchmarks.rate_limit_bench --quota 50 --messages 1000
+    python -m benchmarks.rate_limit_bench --backend postgres --db-url postgresql://...
+"""
+import argparse
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.carrier_sim import CarrierSimulator
+from client_integrations.providers import SmsProvider
+from client_integrations.rate_limit import RateLimiter, RatePolicy
+from client_integrations.retry import RetryPolicy, RetryScheduler
+
+
+def run_scenario(name: str, quota: float, messages: int, concurrency: int, rate_limiter=None) -> dict:
+    carrier = CarrierSimulator(max_rps=quota).start()
+    provider = SmsProvider(
+        endpoint=carrier.url,
+        pool_maxsize=concurrency,
+        retry_policy=RetryPolicy(max_retries=8, base_delay=0.5, max_delay=8.0, max_elapsed=120.0),
+        scheduler=RetryScheduler(max_workers=concurrency),
+        rate_limiter=rate_limiter
+    )
+
+    delivered = []
+    lock = threading.Lock()
+
+    def done(provider_id):
+        with lock:
+            delivered.append(provider_id)
+
+    def send(i):
+        provider_id = provider.send_with_retry({"from": "+12016661234", "to": "+18045551234", "body": f"bench {i}"},
+                                               on_complete=done)
+        if provider_id is not None:
+            done(provider_id)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, range(messages)))
+
+    # deferred sends report through on_complete, wait until every message settled
+    deadline = started + 300
+    while time.monotonic() < deadline:
+        with lock:
+            if len(delivered) >= messages:
+                break
+        time.sleep(0.05)
+    elapsed = time.monotonic() - started
+
+    carrier_stats = carrier.stats()
+    carrier.stop()
+    provider.scheduler.shutdown()
+    ok = sum(1 for provider_id in delivered if provider_id)
+    return {
+        "scenario": name,
+        "messages": messages,
+        "delivered": ok,
+        "elapsed_s": round(elapsed, 2),
+        "delivered_per_s": round(ok / elapsed, 1),
+        "carrier_429s": carrier_stats["rate_limited"],
+        "provider": provider.get_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quota', type=float, default=50, help='carrier limit, requests/sec')
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--headroom', type=float, default=0.95, help='limiter rate as a fraction of the quota')
+    parser.add_argument('--backend', choices=('memory', 'postgres'), default='memory')
+    parser.add_argument('--db-url', help='needed for --backend postgres')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    engine = None
+    if args.backend == 'postgres':
+        from sqlalchemy import create_engine
+        engine = create_engine(args.db_url, pool_size=args.concurrency)
+
+    rate = args.quota * args.headroom
+    limiter = RateLimiter('bench', RatePolicy(rate=rate, burst=max(rate / 10, 1)), engine=engine)
+
+    results = [
+        run_scenario('no_limiter', args.quota, args.messages, args.concurrency),
+        run_scenario(f'limiter_{args.backend}', args.quota, args.messages, args.concurrency, limiter),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Rows/sec for reading and serializing one large conversation's messages: the
+old ORM + jsonify path against the column-projected path, with stdlib json
+and with orjson, and orjson against encoding each row straight from its tuple
+with a fixed key template. Uses the DB_* settings like the app and seeds its
+own conversation.
+
+    python -m benchmarks.serialization_bench --messages 20000 --page-size 500
+"""
+import argparse
+import json
+import random
+import time
+
+from flask import jsonify
+
+from app import create_app, db
+from app import serialization
+from app.models import Message
+from app.serialization import json_response, records
+from app.service import get_messages_by_conversations, keyset_page, save_messages_bulk
+
+
+def seed_conversation(messages: int):
+    sender = f"+1201555{random.randint(0, 9999):04d}"
+    rows = [{
+        "from_address": sender,
+        "to_address": "+18045551234",
+        "msg_type": "sms",
+        "body": f"benchmark message {i} " + "x" * 80,
+        "attachments": ["https://example.com/image.jpg"] if i % 10 == 0 else [],
+        "timestamp": f"2024-11-01T14:{(i // 60) % 60:02d}:{i % 60:02d}Z"
+    } for i in range(messages)]
+    saved = []
+    for start in range(0, messages, 5000):
+        saved += save_messages_bulk('outbound', rows[start:start + 5000])
+    return db.session.execute(
+        db.select(Message.conversation_id).where(Message.id == saved[0].message_id)
+    ).scalar_one()
+
+
+def orm_page(conversation_id, limit: int, after: str = None):
+    # the read path before column projection: ORM objects, per-field isoformat, jsonify
+    page = keyset_page(
+        Message.query.filter_by(conversation_id=conversation_id), Message.timestamp, Message.id,
+        limit, after=after
+    )
+    result = [
+        {
+            "id": str(msg.id),
+            "direction": msg.direction,
+            "from": msg.from_address,
+            "to": msg.to_address,
+            "type": msg.type,
+            "body": msg.body,
+            "attachments": msg.attachments,
+            "provider_message_id": msg.provider_message_id,
+            "timestamp": msg.timestamp.isoformat(),
+            "created_at": msg.created_at.isoformat()
+        } for msg in page.items
+    ]
+    body = jsonify({"messages": result, "next_cursor": page.next_cursor, "prev_cursor": page.prev_cursor}).get_data()
+    db.session.expunge_all()
+    return page, body
+
+
+def fast_page(conversation_id, limit: int, after: str = None):
+    page = get_messages_by_conversations(conversation_id, limit=limit, after=after)
+    body = json_response({
+        "messages": records(page.items), "next_cursor": page.next_cursor, "prev_cursor": page.prev_cursor
+    }).get_data()
+    return page, body
+
+
+def row_encoder(fields: tuple):
+    # the keys are encoded once, then each value on its own; no dict per row
+    keys = [serialization.dumps(field) + b':' for field in fields]
+    keys = [b'{' + keys[0]] + [b',' + key for key in keys[1:]]
+
+    def encode(row) -> bytes:
+        return b''.join([part for key, value in zip(keys, row) for part in (key, serialization.dumps(value))]) + b'}'
+    return encode
+
+
+def tuple_page(conversation_id, limit: int, after: str = None):
+    page = get_messages_by_conversations(conversation_id, limit=limit, after=after)
+    encode = row_encoder(page.items[0]._fields) if page.items else None
+    body = b'{"messages":[' + b','.join(encode(row) for row in page.items) + b'],"next_cursor":' + \
+        serialization.dumps(page.next_cursor) + b',"prev_cursor":' + serialization.dumps(page.prev_cursor) + b'}'
+    return page, body
+
+
+def run(name: str, conversation_id, page_size: int, rounds: int, read_page) -> dict:
+    rows = 0
+    size = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        cursor = None
+        while True:
+            page, body = read_page(conversation_id, page_size, cursor)
+            rows += len(page.items)
+            size += len(body)
+            cursor = page.next_cursor
+            if not cursor:
+                break
+    elapsed = time.perf_counter() - started
+    return {
+        "scenario": name,
+        "rows": rows,
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed),
+        "bytes_per_row": round(size / rows, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.test_request_context():
+        conversation_id = seed_conversation(args.messages)
+        results = [run('orm_jsonify', conversation_id, args.page_size, args.rounds, orm_page)]
+
+        has_orjson = serialization.orjson is not None
+        serialization.orjson = None
+        results.append(run('columns_stdlib_json', conversation_id, args.page_size, args.rounds, fast_page))
+        if has_orjson:
+            import orjson
+            serialization.orjson = orjson
+            results.append(run('columns_orjson', conversation_id, args.page_size, args.rounds, fast_page))
+            results.append(run('tuples_row_encoder', conversation_id, args.page_size, args.rounds, tuple_page))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+#!/bin/bash
+
+set -e
+
+echo "Starting the outbox dispatcher..."
+
+export FLASK_APP=app:create_app
+
+flask dispatch --workers "${OUTBOX_WORKERS:-4}"
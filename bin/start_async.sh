@@ -0,0 +1,8 @@
+#!/bin/bash
+
+set -e
+
+echo "Starting the API (async)..."
+echo "Environment: ${ENV:-development}"
+
+hypercorn --bind 0.0.0.0:5000 --workers "${WEB_CONCURRENCY:-1}" 'app.asgi:create_async_app()'
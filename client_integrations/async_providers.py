@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+import httpx
+
+from client_integrations.circuit_breaker import CircuitBreaker
+from client_integrations.pool import ProviderPool
+from client_integrations.providers import (
+    Provider, ProviderError, ProviderStats, NO_RESPONSE,
+    admit_send, record_send_error, record_send_result, is_final, next_retry, retry_budget_left, past_retry_budget
+)
+from client_integrations.rate_limit import RateLimiter
+from client_integrations.retry import RetryPolicy, parse_retry_after
+
+
+class AsyncProvider(ABC):
+    """
+    Provider for asyncio: the same retry, rate limit and circuit breaker
+    behaviour as Provider, on an httpx.AsyncClient. A send waiting on the
+    carrier holds a socket, not a thread. Rate-limited retries run as tasks
+    on the event loop and report through on_complete, as with Provider.
+    """
+
+    def __init__(self, endpoint: str, connect_timeout: float = 3.05, read_timeout: float = 10.0,
+                 pool_maxsize: int = 100, retry_policy: RetryPolicy = None,
+                 rate_limiter: RateLimiter = None, circuit_breaker: CircuitBreaker = None,
+                 stats: ProviderStats = None, transport: httpx.AsyncBaseTransport = None):
+        self.endpoint = endpoint
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.stats = stats or ProviderStats()
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize)
+        self._transport = transport
+        self._client = None
+        self._retries = set()  # pending retry tasks, kept so they aren't collected mid-flight
+
+    @classmethod
+    def from_provider(cls, provider: Provider, pool_maxsize: int = 100) -> 'AsyncProvider':
+        """
+        An async client for a sync provider's endpoint that shares its stats,
+        rate limiter, circuit breaker and retry policy.
+        """
+        connect_timeout, read_timeout = provider.timeout
+        return cls(
+            provider.endpoint, connect_timeout=connect_timeout, read_timeout=read_timeout,
+            pool_maxsize=pool_maxsize, retry_policy=provider.retry_policy,
+            rate_limiter=provider.rate_limiter, circuit_breaker=provider.circuit_breaker, stats=provider.stats
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # made on first use, so it belongs to the loop that serves requests
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, transport=self._transport)
+        return self._client
+
+    def simulate(self, id_prefix: str):
+        """
+        Test/simulation mode: answer every send locally with a fake provider id.
+        """
+        self._transport = httpx.MockTransport(
+            lambda request: httpx.Response(200, json={'id': f"{id_prefix}-{uuid.uuid4()}"})
+        )
+
+    async def aclose(self):
+        for task in list(self._retries):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def get_stats(self) -> dict:
+        stats = {"endpoint": self.endpoint, **self.stats.snapshot()}
+        if self.rate_limiter:
+            stats["rate_limit"] = self.rate_limiter.get_stats()
+        stats["circuit_breaker"] = self.circuit_breaker.snapshot()
+        return stats
+
+    def circuit_open(self) -> bool:
+        return self.circuit_breaker.is_open()
+
+    def health(self) -> dict:
+        return self.circuit_breaker.snapshot()
+
+    async def reserve_send_slot(self, message_data: dict, max_wait: float = None) -> float:
+        if not self.rate_limiter:
+            return 0.0
+        if self.rate_limiter.engine is not None:
+            # Postgres-backed buckets block on a query
+            return await asyncio.to_thread(self.rate_limiter.reserve, message_data, max_wait)
+        return self.rate_limiter.reserve(message_data, max_wait)
+
+    async def _post(self, message_data: dict) -> httpx.Response:
+        start = time.monotonic()
+        ok = False
+        try:
+            resp = await self.client.post(self.endpoint, json=message_data)
+            ok = resp.is_success
+            return resp
+        finally:
+            self.stats.record(time.monotonic() - start, ok)
+
+    async def send_with_retry(self, message_data: dict, max_retries: int = None, retry_delay: float = None,
+                              on_complete=None) -> str | None:
+        """
+        Sends right away. When rate limited, the retry is left to a task and
+        None is returned; on_complete(provider_id_or_None) is awaited once that
+        task settles. Not called when the first attempt settles the outcome.
+        """
+        policy = self.retry_policy.replace(max_retries=max_retries, base_delay=retry_delay)
+        return await self._attempt(message_data, policy, 0, time.monotonic(), on_complete)
+
+    async def _attempt(self, message_data: dict, policy: RetryPolicy, retries: int,
+                       started: float, on_complete, deferred: bool = False, reserved: bool = False) -> str | None:
+        budget = retry_budget_left(policy, started)
+        wait = 0 if reserved else await self.reserve_send_slot(message_data, max_wait=budget)
+        if wait and not past_retry_budget(wait, budget):
+            self._retry_later(wait, message_data, policy, retries, started, on_complete, reserved=True)
+            return None
+
+        try:
+            provider_id = None if wait else await self.send_once(message_data)
+        except ProviderError as e:
+            retries += 1
+            delay = next_retry(policy, self.stats, retries, started, e)
+            if delay is None:
+                provider_id = None
+            else:
+                self._retry_later(delay, message_data, policy, retries, started, on_complete)
+                return None
+
+        if deferred and on_complete:
+            await on_complete(provider_id)
+        return provider_id
+
+    def _retry_later(self, delay: float, message_data: dict, policy: RetryPolicy, retries: int,
+                     started: float, on_complete, reserved: bool = False):
+        async def retry():
+            await asyncio.sleep(delay)
+            await self._attempt(message_data, policy, retries, started, on_complete, True, reserved)
+
+        task = asyncio.get_running_loop().create_task(retry())
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def send_once(self, message_data: dict) -> str | None:
+        """
+        A single attempt. 429s and an open circuit are raised, anything else
+        is final and returns None.
+        """
+        try:
+            return await self.call(message_data)
+        except ProviderError as e:
+            if not is_final(e):
+                raise
+            return None
+
+    async def call(self, message_data: dict) -> str | None:
+        """
+        _send behind the circuit breaker. Every provider error is raised.
+        """
+        admit_send(self.circuit_breaker, self.stats)
+        try:
+            provider_id = await self._send(message_data)
+        except Exception as e:
+            record_send_error(self.circuit_breaker, self.stats, e)
+            raise
+        record_send_result(self.circuit_breaker, self.stats, provider_id)
+        return provider_id
+
+    async def _post_for_id(self, message_data: dict, channel: str) -> str | None:
+        try:
+            resp = await self._post(message_data)
+        except httpx.HTTPError as e:
+            raise ProviderError(NO_RESPONSE, f"{channel} connection error: {e}")
+        if resp.is_error:
+            raise ProviderError(resp.status_code, f"{channel} HTTP Error",
+                                parse_retry_after(resp.headers.get('Retry-After')))
+        try:
+            return resp.json()['id']
+        except Exception as e:
+            logging.info(f"Unexpected {channel} Client error: {e}. Not retrying.")
+            return None
+
+    @abstractmethod
+    async def _send(self, message_data: dict) -> str | None:
+        pass
+
+
+class AsyncSmsProvider(AsyncProvider):
+    async def _send(self, message_data: dict) -> str | None:
+        logging.info(f"[SMS] Sending message to endpoint: {self.endpoint}")
+        return await self._post_for_id(message_data, "SMS")
+
+
+class AsyncEmailProvider(AsyncProvider):
+    async def _send(self, message_data: dict) -> str | None:
+        logging.info(f"[Email] Sending message to endpoint: {self.endpoint}")
+        return await self._post_for_id(message_data, "Email")
+
+
+class ThreadedProvider:
+    """
+    The async provider interface over a sync provider (e.g. a ProviderPool,
+    whose hedging and failover have no async version), each send on a worker
+    thread. on_complete coroutines are run back on the calling loop.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.stats = provider.stats
+
+    def __getattr__(self, name):
+        return getattr(self.provider, name)
+
+    async def send_with_retry(self, message_data: dict, max_retries: int = None, retry_delay: float = None,
+                              on_complete=None) -> str | None:
+        loop = asyncio.get_running_loop()
+        callback = None
+        if on_complete:
+            def callback(provider_id):
+                asyncio.run_coroutine_threadsafe(on_complete(provider_id), loop)
+        return await asyncio.to_thread(
+            self.provider.send_with_retry, message_data, max_retries, retry_delay, callback
+        )
+
+    async def aclose(self):
+        pass
+
+
+def async_provider(provider, async_class, pool_maxsize: int = 100):
+    """
+    The async counterpart of a provider built by create_app.
+    """
+    if isinstance(provider, ProviderPool):
+        return ThreadedProvider(provider)
+    return async_class.from_provider(provider, pool_maxsize=pool_maxsize)
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Closed -> open when the failure rate over the last window_seconds reaches
+    failure_rate_threshold (given at least minimum_calls). After open_seconds
+    it lets up to half_open_probes requests through; if they all succeed it
+    closes again, any failure reopens it.
+    """
+
+    def __init__(self, failure_rate_threshold: float = 0.5, window_seconds: float = 30.0,
+                 minimum_calls: int = 10, open_seconds: float = 30.0, half_open_probes: int = 3):
+        self.failure_rate_threshold = failure_rate_threshold
+        self.window_seconds = window_seconds
+        self.minimum_calls = minimum_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._window = deque()  # (monotonic time, ok)
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.transitions = {}
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            return self._state
+
+    def is_open(self) -> bool:
+        return self.state == OPEN
+
+    def retry_after(self) -> float:
+        """
+        Seconds until an open circuit starts letting probes through.
+        """
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(self._opened_at + self.open_seconds - time.monotonic(), 0.0)
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._transition(CLOSED)
+            elif self._state == CLOSED:
+                self._record(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._transition(OPEN)
+            elif self._state == CLOSED:
+                self._record(False)
+                calls = len(self._window)
+                failures = sum(1 for _, ok in self._window if not ok)
+                if calls >= self.minimum_calls and failures / calls >= self.failure_rate_threshold:
+                    self._transition(OPEN)
+
+    def record_ignored(self):
+        """
+        For outcomes that say nothing about provider health (e.g. a 429).
+        Frees the probe slot without moving the breaker.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            self._maybe_half_open(now)
+            self._trim(now)
+            calls = len(self._window)
+            failures = sum(1 for _, ok in self._window if not ok)
+            return {
+                "state": self._state,
+                "failure_rate": round(failures / calls, 3) if calls else 0.0,
+                "window_calls": calls,
+                "rejected": self.rejected,
+                "transitions": dict(self.transitions),
+                "retry_after_s": round(max(self._opened_at + self.open_seconds - now, 0.0), 2)
+                if self._state == OPEN else 0.0
+            }
+
+    def _record(self, ok: bool):
+        now = time.monotonic()
+        self._window.append((now, ok))
+        self._trim(now)
+
+    def _trim(self, now: float):
+        while self._window and now - self._window[0][0] > self.window_seconds:
+            self._window.popleft()
+
+    def _maybe_half_open(self, now: float):
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+
+    def _transition(self, state: str):
+        name = f"{self._state}->{state}"
+        self.transitions[name] = self.transitions.get(name, 0) + 1
+        self._state = state
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._window.clear()
@@ -0,0 +1,170 @@
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from client_integrations.providers import Provider, ProviderError, CircuitOpenError, NO_RESPONSE
+
+
+class ProviderPool(Provider):
+    """
+    Several endpoints for one channel behind the Provider interface.
+
+    Each send goes to an endpoint picked at random, weighted by
+    weight / EWMA latency, skipping endpoints whose circuit is open. On a 5xx,
+    timeout, 429 or open circuit it fails over to the next best endpoint.
+    With hedge=True, a send still running after the primary's latency quantile
+    is also fired at a second endpoint and the first success wins. Only enable
+    hedging for providers that de-duplicate, since both sends may be delivered.
+
+    Retry scheduling and rate limiting apply at the pool level; circuit
+    breakers and latency stats belong to the member endpoints.
+    """
+
+    # latency assumed for endpoints we haven't heard from yet, seconds
+    DEFAULT_LATENCY = 0.1
+
+    def __init__(self, providers: list, weights: list = None, hedge: bool = False,
+                 hedge_quantile: float = 0.95, hedge_min_delay: float = 0.05, **options):
+        super().__init__(endpoint=','.join(provider.endpoint for provider in providers), **options)
+        self.providers = providers
+        self.weights = weights or [1.0] * len(providers)
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(providers)), thread_name_prefix='provider-hedge')
+        self._lock = threading.Lock()
+        self.routed = [0] * len(providers)
+        self.failovers = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def simulate(self, id_prefix: str):
+        for provider in self.providers:
+            provider.simulate(id_prefix)
+
+    def circuit_open(self) -> bool:
+        return all(provider.circuit_open() for provider in self.providers)
+
+    def health(self) -> dict:
+        endpoints = {provider.endpoint: provider.health() for provider in self.providers}
+        states = {endpoint["state"] for endpoint in endpoints.values()}
+        if states == {'closed'}:
+            state = 'closed'
+        elif self.circuit_open():
+            state = 'open'
+        else:
+            state = 'degraded'
+        return {"state": state, "endpoints": endpoints}
+
+    def route(self) -> list:
+        """
+        Member indexes in the order they should be tried.
+        """
+        scores = {}
+        for i, provider in enumerate(self.providers):
+            if provider.circuit_open():
+                continue
+            latency = provider.stats.ewma_latency or self.DEFAULT_LATENCY
+            scores[i] = self.weights[i] / max(latency, 0.001)
+        if not scores:
+            # everything is open; let the breakers reject (and report retry_after)
+            return list(range(len(self.providers)))
+
+        # weighted random pick for the primary, then best score first for failover
+        indexes = list(scores)
+        primary = random.choices(indexes, weights=[scores[i] for i in indexes])[0]
+        rest = sorted((i for i in indexes if i != primary), key=lambda i: scores[i], reverse=True)
+        return [primary] + rest
+
+    def call(self, message_data: dict) -> str | None:
+        order = self.route()
+        if self.hedge and len(order) > 1:
+            return self._hedged_call(order, message_data)
+
+        last_error = None
+        for attempt, index in enumerate(order):
+            if attempt:
+                with self._lock:
+                    self.failovers += 1
+                logging.info(f"Failing over to {self.providers[index].endpoint}: {last_error}")
+            try:
+                return self._call_member(index, message_data)
+            except ProviderError as e:
+                if not self._should_fail_over(e):
+                    raise
+                last_error = e
+        raise last_error
+
+    def _call_member(self, index: int, message_data: dict) -> str | None:
+        with self._lock:
+            self.routed[index] += 1
+        return self.providers[index].call(message_data)
+
+    @staticmethod
+    def _should_fail_over(e: ProviderError) -> bool:
+        return (isinstance(e, CircuitOpenError) or e.status_code in (NO_RESPONSE, 429)
+                or 500 <= e.status_code < 600)
+
+    def _hedge_delay(self, index: int) -> float:
+        latency = self.providers[index].stats.quantile(self.hedge_quantile)
+        return max(latency or self.DEFAULT_LATENCY, self.hedge_min_delay)
+
+    def _hedged_call(self, order: list, message_data: dict) -> str | None:
+        primary, backups = order[0], order[1:]
+        futures = {self._executor.submit(self._call_member, primary, message_data): primary}
+        done, _ = wait(futures, timeout=self._hedge_delay(primary))
+
+        last_error = None
+        while True:
+            for future in done:
+                index = futures.pop(future)
+                try:
+                    provider_id = future.result()
+                except ProviderError as e:
+                    if not self._should_fail_over(e):
+                        raise
+                    last_error = e
+                    continue
+                if index != primary:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return provider_id
+
+            # primary is slow or failed: bring in the next endpoint
+            if backups:
+                index = backups.pop(0)
+                with self._lock:
+                    if done:
+                        self.failovers += 1
+                    else:
+                        self.hedged += 1
+                futures[self._executor.submit(self._call_member, index, message_data)] = index
+            if not futures:
+                raise last_error
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+
+    def _send(self, message_data: dict) -> str:
+        return self.call(message_data)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            routing = {
+                "routed": list(self.routed),
+                "failovers": self.failovers,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins
+            }
+        endpoints = []
+        for i, provider in enumerate(self.providers):
+            endpoints.append({**provider.get_stats(), "weight": self.weights[i], "routed": routing["routed"][i]})
+        stats = {
+            "endpoint": self.endpoint,
+            "failovers": routing["failovers"],
+            "hedged": routing["hedged"],
+            "hedge_wins": routing["hedge_wins"],
+            "endpoints": endpoints
+        }
+        if self.rate_limiter:
+            stats["rate_limit"] = self.rate_limiter.get_stats()
+        return stats
@@ -1,7 +1,14 @@
 import time
+import threading
+import uuid
 from abc import ABC, abstractmethod
 import requests
-from requests.exceptions import HTTPError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError, RequestException
+
+from client_integrations.circuit_breaker import CircuitBreaker
+from client_integrations.rate_limit import RateLimiter
+from client_integrations.retry import RetryPolicy, RetryScheduler, default_scheduler, parse_retry_after
 
 import logging
 import sys
@@ -13,39 +20,386 @@ logging.basicConfig(
 )
 
 class ProviderError(Exception):
-    def __init__(self, status_code: int, message: str = "Provider error"):
+    def __init__(self, status_code: int, message: str = "Provider error", retry_after: float = None):
         self.status_code = status_code
         self.message = message
+        # seconds the provider asked us to wait (Retry-After), if any
+        self.retry_after = retry_after
         super().__init__(f"[{status_code}] {message}")
 
+    @classmethod
+    def from_http_error(cls, e: HTTPError, message: str) -> 'ProviderError':
+        return cls(e.response.status_code, message, parse_retry_after(e.response.headers.get('Retry-After')))
+
+
+class CircuitOpenError(ProviderError):
+    """
+    Raised without calling the provider while its circuit breaker is open.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(503, "Circuit open, provider unavailable", retry_after)
+
+
+# status_code for failures where the provider never answered (connect errors, timeouts)
+NO_RESPONSE = 0
+
+
+def send_outcome(e: ProviderError) -> str:
+    """
+    The ProviderStats outcome a failed send is counted under.
+    """
+    if isinstance(e, CircuitOpenError):
+        return 'circuit_open'
+    if e.status_code == 429:
+        return 'rate_limited'
+    if e.status_code == NO_RESPONSE:
+        return 'no_response'
+    if 500 <= e.status_code < 600:
+        return 'server_error'
+    return 'client_error'
+
+
+def admit_send(breaker: CircuitBreaker, stats: 'ProviderStats'):
+    """
+    Raises CircuitOpenError (counted) while the breaker is refusing sends.
+    """
+    if not breaker.allow_request():
+        stats.record_outcome('circuit_open')
+        raise CircuitOpenError(breaker.retry_after())
+
+
+def record_send_error(breaker: CircuitBreaker, stats: 'ProviderStats', e: Exception):
+    """
+    Counts a failed send and tells the breaker what it says about the provider.
+    """
+    if not isinstance(e, ProviderError):
+        stats.record_outcome('error')
+        breaker.record_ignored()
+        return
+    stats.record_outcome(send_outcome(e))
+    if e.status_code == 429:
+        breaker.record_ignored()
+    elif e.status_code == NO_RESPONSE or 500 <= e.status_code < 600:
+        breaker.record_failure()
+    else:
+        # a 4xx is our problem, not a sign the provider is down
+        breaker.record_success()
+
+
+def record_send_result(breaker: CircuitBreaker, stats: 'ProviderStats', provider_id: str | None):
+    # _send answers None for errors it has already logged
+    stats.record_outcome('ok' if provider_id else 'error')
+    breaker.record_success()
+
+
+def is_final(e: ProviderError) -> bool:
+    """
+    False for rate limiting (429) and an open circuit, which are worth retrying;
+    anything else ends the send, and is logged here.
+    """
+    if isinstance(e, CircuitOpenError) or e.status_code == 429:
+        return False
+    if e.status_code == 400:
+        logging.info(f"Bad Request, adjust implementation: {e}. Not retrying.")
+    elif e.status_code == 401:
+        logging.info(f"Unauthorized, check creds: {e}. Not retrying.")
+    elif 500 <= e.status_code < 600:
+        logging.info(f"Server error: {e}. Not retrying.")
+    else:
+        logging.info(f"Provider error: {e}. Not retrying.")
+    return True
+
+
+def next_retry(policy: RetryPolicy, stats: 'ProviderStats', retries: int, started: float,
+               e: ProviderError) -> float | None:
+    """
+    Seconds to wait before retry number `retries`, or None once the policy is spent.
+    """
+    delay = policy.next_delay(retries, e.retry_after)
+    if not policy.allows(retries, time.monotonic() - started + delay):
+        logging.info("Max retries reached. Giving up.")
+        return None
+    logging.info(f"Retry {retries}/{policy.max_retries} due to rate limiting. Retrying in {delay:.2f} seconds...")
+    stats.record_retry()
+    return delay
+
+
+def retry_budget_left(policy: RetryPolicy, started: float) -> float:
+    """
+    Seconds of the policy's max_elapsed left for a send first tried at started.
+    """
+    return policy.max_elapsed - (time.monotonic() - started)
+
+
+def past_retry_budget(wait: float, budget: float) -> bool:
+    """
+    True, logged, if a rate limit slot wait seconds away is more than budget allows.
+    """
+    if wait <= budget:
+        return False
+    logging.info(f"Rate limited for {wait:.2f} seconds, past the retry budget. Giving up.")
+    return True
+
+
+class ProviderStats:
+    """
+    Thread-safe request counters, latency and a latency histogram for one provider,
+    plus send outcomes and retries.
+    """
+
+    EWMA_ALPHA = 0.2
+    # histogram bucket upper bounds, seconds
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.ewma_latency = None
+        self.bucket_counts = [0] * len(self.BUCKETS)
+        self.outcomes = {}  # 'ok', 'rate_limited', 'client_error', 'server_error', ... -> count
+        self.retries = 0
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self.requests += 1
+            if not ok:
+                self.failures += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if self.ewma_latency is None:
+                self.ewma_latency = latency
+            else:
+                self.ewma_latency += self.EWMA_ALPHA * (latency - self.ewma_latency)
+            for i, bound in enumerate(self.BUCKETS):
+                if latency <= bound:
+                    self.bucket_counts[i] += 1
+                    break
+
+    def record_outcome(self, outcome: str):
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def histogram(self) -> tuple:
+        """
+        (per-bucket counts in BUCKETS order, total latency, requests), read together.
+        """
+        with self._lock:
+            return list(self.bucket_counts), self.total_latency, self.requests
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Upper bound of the histogram bucket holding the q-quantile (capped at the max seen).
+        """
+        with self._lock:
+            if not self.requests:
+                return None
+            target = q * self.requests
+            seen = 0
+            for bound, count in zip(self.BUCKETS, self.bucket_counts):
+                seen += count
+                if seen >= target:
+                    return min(bound, self.max_latency)
+            return self.max_latency
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "avg_latency_ms": round(1000 * self.total_latency / self.requests, 2) if self.requests else None,
+                "max_latency_ms": round(1000 * self.max_latency, 2),
+                "ewma_latency_ms": round(1000 * self.ewma_latency, 2) if self.ewma_latency is not None else None,
+                "outcomes": dict(self.outcomes),
+                "retries": self.retries,
+                "latency_histogram_ms": {
+                    ("+Inf" if bound == float('inf') else str(int(bound * 1000))): count
+                    for bound, count in zip(self.BUCKETS, self.bucket_counts)
+                }
+            }
+
 
 class Provider(ABC):
-    def __init__(self, endpoint: str):
+    def __init__(self, endpoint: str, connect_timeout: float = 3.05, read_timeout: float = 10.0,
+                 pool_maxsize: int = 10, pool_block: bool = False,
+                 retry_policy: RetryPolicy = None, scheduler: RetryScheduler = None,
+                 rate_limiter: RateLimiter = None, circuit_breaker: CircuitBreaker = None):
         self.endpoint = endpoint
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.scheduler = scheduler or default_scheduler()
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.timeout = (connect_timeout, read_timeout)
+        self.stats = ProviderStats()
+        # one keep-alive connection pool shared by every thread's session;
+        # urllib3 pools are thread-safe, requests.Session objects are not
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize,
+                                    pool_block=pool_block, max_retries=0)
+        self._mounts = [('https://', self._adapter), ('http://', self._adapter)]
+        self._mounts_version = 0
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None or self._local.version != self._mounts_version:
+            session = requests.Session()
+            for prefix, adapter in self._mounts:
+                session.mount(prefix, adapter)
+            self._local.session = session
+            self._local.version = self._mounts_version
+        return session
+
+    def mount(self, prefix: str, adapter):
+        """
+        Routes requests under prefix through another transport adapter.
+        """
+        self._mounts.append((prefix, adapter))
+        self._mounts_version += 1
+
+    def simulate(self, id_prefix: str):
+        """
+        Test/simulation mode: answer every send locally with a fake provider id
+        instead of calling the real endpoint.
+        """
+        import requests_mock
+
+        adapter = requests_mock.Adapter()
+        adapter.register_uri(
+            'POST', self.endpoint,
+            json=lambda request, context: {'id': f"{id_prefix}-{uuid.uuid4()}"}
+        )
+        self.mount(self.endpoint, adapter)
+
+    def connection_stats(self) -> dict:
+        new_connections = 0
+        pooled_requests = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                new_connections += pool.num_connections
+                pooled_requests += pool.num_requests
+        return {
+            "new_connections": new_connections,
+            "reused_connections": max(pooled_requests - new_connections, 0)
+        }
+
+    def get_stats(self) -> dict:
+        stats = {"endpoint": self.endpoint, **self.stats.snapshot(), **self.connection_stats()}
+        if self.rate_limiter:
+            stats["rate_limit"] = self.rate_limiter.get_stats()
+        stats["circuit_breaker"] = self.circuit_breaker.snapshot()
+        return stats
+
+    def circuit_open(self) -> bool:
+        return self.circuit_breaker.is_open()
+
+    def health(self) -> dict:
+        return self.circuit_breaker.snapshot()
+
+    def acquire_send_slot(self, message_data: dict) -> float:
+        """
+        0 if the rate policy allows a send now, else seconds until it might.
+        Nothing is taken when the answer is no.
+        """
+        if not self.rate_limiter:
+            return 0.0
+        return self.rate_limiter.acquire(message_data)
 
-    def send_with_retry(self, message_data: dict, max_retries: int = 3, retry_delay: float = 2.0) -> str | None:
-        retries = 0
-
-        while retries <= max_retries:
-            try:
-                return self._send(message_data)
-            except ProviderError as e:
-                if e.status_code == 429:
-                    retries += 1
-                    if retries > max_retries:
-                        logging.info("Max retries reached. Giving up.")
-                        return None
-                    logging.info(f"Retry {retries}/{max_retries} due to rate limiting. Waiting {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                elif 400:
-                    logging.info(f"Bad Request, adjust implementation: {e}. Not retrying.")
-                    return None
-                elif 401:
-                    logging.info(f"Unauthorized, check creds: {e}. Not retrying.")
-                    return None
-                elif 500 <= e.status_code < 600:
-                    logging.info(f"Server error: {e}. Not retrying.")
-                    return None
+    def reserve_send_slot(self, message_data: dict, max_wait: float = None) -> float:
+        """
+        Books a slot under the rate policy; returns seconds until it starts.
+        A slot more than max_wait away isn't booked.
+        """
+        if not self.rate_limiter:
+            return 0.0
+        return self.rate_limiter.reserve(message_data, max_wait)
+
+    def _post(self, message_data: dict) -> requests.Response:
+        start = time.monotonic()
+        ok = False
+        try:
+            resp = self.session.post(self.endpoint, json=message_data, timeout=self.timeout)
+            ok = resp.ok
+            return resp
+        finally:
+            self.stats.record(time.monotonic() - start, ok)
+
+    def send_with_retry(self, message_data: dict, max_retries: int = None, retry_delay: float = None,
+                        on_complete=None) -> str | None:
+        """
+        Sends right away. When rate limited (by our own rate policy or a 429), the
+        attempt is parked on the scheduler (backoff with jitter, honouring
+        Retry-After) and None is returned without blocking. on_complete(provider_id_or_None)
+        is then called from a scheduler thread once the send finishes; it is not
+        called when the first attempt settles the outcome, since the return value
+        already carries it.
+        """
+        policy = self.retry_policy.replace(max_retries=max_retries, base_delay=retry_delay)
+        return self._attempt(message_data, policy, 0, time.monotonic(), on_complete)
+
+    def _attempt(self, message_data: dict, policy: RetryPolicy, retries: int,
+                 started: float, on_complete, deferred: bool = False, reserved: bool = False) -> str | None:
+        # stay under the provider's quota instead of finding it with a 429, but
+        # only book a slot the retry budget can wait for
+        budget = retry_budget_left(policy, started)
+        wait = 0 if reserved else self.reserve_send_slot(message_data, max_wait=budget)
+        if wait and not past_retry_budget(wait, budget):
+            self.scheduler.schedule(
+                wait, lambda: self._attempt(message_data, policy, retries, started, on_complete, True, True)
+            )
+            return None
+
+        try:
+            provider_id = None if wait else self.send_once(message_data)
+        except ProviderError as e:
+            retries += 1
+            delay = next_retry(policy, self.stats, retries, started, e)
+            if delay is None:
+                provider_id = None
+            else:
+                self.scheduler.schedule(
+                    delay, lambda: self._attempt(message_data, policy, retries, started, on_complete, True)
+                )
+                return None
+
+        if deferred and on_complete:
+            on_complete(provider_id)
+        return provider_id
+
+    def send_once(self, message_data: dict) -> str | None:
+        """
+        A single attempt. Rate limiting (429) and an open circuit are raised as
+        ProviderError so the caller can decide when to retry; anything else is
+        final and returns None.
+        """
+        try:
+            return self.call(message_data)
+        except ProviderError as e:
+            if not is_final(e):
+                raise
+            return None
+
+    def call(self, message_data: dict) -> str | None:
+        """
+        _send behind the circuit breaker. Every provider error is raised.
+        """
+        admit_send(self.circuit_breaker, self.stats)
+        try:
+            provider_id = self._send(message_data)
+        except Exception as e:
+            record_send_error(self.circuit_breaker, self.stats, e)
+            raise
+        record_send_result(self.circuit_breaker, self.stats, provider_id)
+        return provider_id
 
     @abstractmethod
     def _send(self, message_data: dict) -> str:
@@ -57,10 +411,12 @@ class SmsProvider(Provider):
 
         logging.info(f"[SMS] Sending message to endpoint: {self.endpoint}")
         try:
-            resp = requests.post(self.endpoint, json=message_data)
+            resp = self._post(message_data)
             resp.raise_for_status()
         except HTTPError as e:
-            raise ProviderError(e.response.status_code, "SMS HTTP Error")
+            raise ProviderError.from_http_error(e, "SMS HTTP Error")
+        except RequestException as e:
+            raise ProviderError(NO_RESPONSE, f"SMS connection error: {e}")
         except Exception as e:
             logging.info(f"Unexpected SMS Client error: {e}. Not retrying.")
             return None
@@ -73,10 +429,12 @@ class EmailProvider(Provider):
         
         logging.info(f"[Email] Sending message to endpoint: {self.endpoint}")
         try:
-            resp = requests.post(self.endpoint, json=message_data)
+            resp = self._post(message_data)
             resp.raise_for_status()
         except HTTPError as e:
-            raise ProviderError(e.response.status_code, "Email HTTP Error")
+            raise ProviderError.from_http_error(e, "Email HTTP Error")
+        except RequestException as e:
+            raise ProviderError(NO_RESPONSE, f"Email connection error: {e}")
         except Exception as e:
             logging.info(f"Unexpected Email Client error: {e}. Not retrying.")
             return None
@@ -0,0 +1,170 @@
+import threading
+import time
+
+from sqlalchemy import text
+
+
+class RatePolicy:
+    """
+    Messages/sec and burst for a provider, optionally with a tighter limit
+    per sender number/address.
+    """
+
+    def __init__(self, rate: float, burst: float = None,
+                 per_sender_rate: float = None, per_sender_burst: float = None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self.per_sender_rate = per_sender_rate
+        self.per_sender_burst = per_sender_burst or (max(per_sender_rate, 1.0) if per_sender_rate else None)
+
+
+class TokenBuckets:
+    """
+    In-process token buckets, one per key. Only limits the current process.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> (tokens, updated_at)
+
+    def _take(self, key: str, reserve: bool, max_wait: float = None) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1 or (reserve and (max_wait is None or (1 - tokens) / self.rate <= max_wait)):
+                tokens -= 1
+                self._buckets[key] = (tokens, now)
+                return max(-tokens, 0.0) / self.rate
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+    def acquire(self, key: str) -> float:
+        """
+        Takes a token if one is available and returns 0, otherwise takes
+        nothing and returns the seconds until the next token.
+        """
+        return self._take(key, reserve=False)
+
+    def reserve(self, key: str, max_wait: float = None) -> float:
+        """
+        Takes a token, going into debt if needed, and returns the seconds
+        until that token is due. Callers that wait that long never collide.
+        With max_wait, a token due later than that isn't taken; the returned
+        wait, above max_wait, says so.
+        """
+        return self._take(key, reserve=True, max_wait=max_wait)
+
+
+class PostgresTokenBuckets:
+    """
+    Token buckets kept in the provider_rate_limits table, so every worker
+    process and host shares one budget. Each call is a single upsert; the
+    row lock on the bucket serializes concurrent callers.
+    """
+
+    # refilled = LEAST(burst, tokens + seconds since last update * rate);
+    # a token is taken when refilled >= 1, or when reserving one due within max_wait
+    TAKE_SQL = text("""
+        INSERT INTO provider_rate_limits AS b (key, tokens, acquired, updated_at)
+        VALUES (:key, CAST(:burst AS double precision) - 1, true, clock_timestamp())
+        ON CONFLICT (key) DO UPDATE SET
+            tokens = CASE
+                WHEN (:reserve AND (1 - LEAST(:burst, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * :rate)) / :rate <= :max_wait)
+                    OR LEAST(:burst, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * :rate) >= 1
+                THEN LEAST(:burst, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * :rate) - 1
+                ELSE LEAST(:burst, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * :rate)
+            END,
+            acquired = (:reserve AND (1 - LEAST(:burst, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * :rate)) / :rate <= :max_wait)
+                OR LEAST(:burst, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * :rate) >= 1,
+            updated_at = clock_timestamp()
+        RETURNING b.tokens, b.acquired
+    """)
+
+    def __init__(self, engine, rate: float, burst: float):
+        self.engine = engine
+        self.rate = rate
+        self.burst = burst
+
+    def _take(self, key: str, reserve: bool, max_wait: float = None) -> float:
+        with self.engine.begin() as conn:
+            tokens, acquired = conn.execute(self.TAKE_SQL, {
+                "key": key, "rate": self.rate, "burst": self.burst, "reserve": reserve,
+                "max_wait": float('inf') if max_wait is None else max_wait
+            }).one()
+        if acquired:
+            return max(-tokens, 0.0) / self.rate
+        return (1 - tokens) / self.rate
+
+    def acquire(self, key: str) -> float:
+        return self._take(key, reserve=False)
+
+    def reserve(self, key: str, max_wait: float = None) -> float:
+        return self._take(key, reserve=True, max_wait=max_wait)
+
+
+class RateLimiter:
+    """
+    Applies a RatePolicy for one provider on top of a bucket backend.
+    """
+
+    def __init__(self, name: str, policy: RatePolicy, engine=None):
+        self.name = name
+        self.policy = policy
+        # set when buckets live in Postgres, so every check is a query
+        self.engine = engine
+        self._global = self._buckets(policy.rate, policy.burst, engine)
+        self._per_sender = None
+        if policy.per_sender_rate:
+            self._per_sender = self._buckets(policy.per_sender_rate, policy.per_sender_burst, engine)
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled = 0
+
+    @staticmethod
+    def _buckets(rate, burst, engine):
+        if engine is not None:
+            return PostgresTokenBuckets(engine, rate, burst)
+        return TokenBuckets(rate, burst)
+
+    def acquire(self, message_data: dict) -> float:
+        """
+        0 if the message may be sent now, else seconds to wait before asking again.
+        """
+        return self._take(message_data, reserve=False)
+
+    def reserve(self, message_data: dict, max_wait: float = None) -> float:
+        """
+        Books a send slot and returns the seconds until it starts. The caller
+        must send then without asking again. With max_wait, a slot starting
+        later than that isn't booked; the returned wait, above max_wait, says so.
+        """
+        return self._take(message_data, reserve=True, max_wait=max_wait)
+
+    def _take(self, message_data: dict, reserve: bool, max_wait: float = None) -> float:
+        wait = 0.0
+        sender = message_data.get('from')
+        if self._per_sender and sender:
+            wait = self._per_sender._take(f"{self.name}:sender:{sender}", reserve, max_wait)
+        if not wait or (reserve and (max_wait is None or wait <= max_wait)):
+            # a sender token taken here is lost if the global bucket refuses;
+            # that only makes the per-sender limit slightly stricter
+            wait = max(wait, self._global._take(self.name, reserve, max_wait))
+        with self._lock:
+            if wait:
+                self.throttled += 1
+            else:
+                self.allowed += 1
+        return wait
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "rate": self.policy.rate,
+                "burst": self.policy.burst,
+                "per_sender_rate": self.policy.per_sender_rate,
+                "allowed": self.allowed,
+                "throttled": self.throttled
+            }
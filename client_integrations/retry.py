@@ -0,0 +1,134 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, capped by a retry count and by the
+    total time spent on a message.
+    """
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 2.0,
+                 max_delay: float = 30.0, max_elapsed: float = 60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+
+    def replace(self, max_retries: int = None, base_delay: float = None) -> 'RetryPolicy':
+        return RetryPolicy(
+            max_retries=self.max_retries if max_retries is None else max_retries,
+            base_delay=self.base_delay if base_delay is None else base_delay,
+            max_delay=self.max_delay,
+            max_elapsed=self.max_elapsed
+        )
+
+    def next_delay(self, retry_number: int, retry_after: float = None) -> float:
+        """
+        Delay before retry number retry_number (1-based). A provider's
+        Retry-After is a floor, jitter still spreads callers out above it.
+        """
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (retry_number - 1))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def allows(self, retry_number: int, elapsed: float) -> bool:
+        """
+        elapsed is the time from the first attempt to when this retry would run.
+        """
+        return retry_number <= self.max_retries and elapsed <= self.max_elapsed
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Retry-After is either delta-seconds or an HTTP-date.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RetryScheduler:
+    """
+    Runs callables at a later time without tying up the caller's thread.
+    Pending work sits in a heap ordered by due time; one timer thread hands
+    due items to a small worker pool.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='retry-worker')
+        self._thread = None
+        self._stopped = False
+
+    def schedule(self, delay: float, fn):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='retry-scheduler', daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), fn))
+            self._cond.notify()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def shutdown(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._executor.shutdown(wait=False)
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due_at = self._heap[0][0]
+                wait = due_at - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                _, _, fn = heapq.heappop(self._heap)
+                self._executor.submit(self._call, fn)
+
+    @staticmethod
+    def _call(fn):
+        try:
+            fn()
+        except Exception as e:
+            logging.info(f"Scheduled retry failed: {e}")
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def default_scheduler() -> RetryScheduler:
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RetryScheduler()
+        return _default_scheduler
@@ -0,0 +1,25 @@
+from app.addresses import normalize_address, canonical_address, get_stats
+
+
+def test_normalize_phone():
+    print('test_normalize_phone')
+    assert normalize_address("+1 201-666-1234", is_email=False) == "+12016661234"
+    assert normalize_address("+12016661234", is_email=False) == "+12016661234"
+    assert normalize_address("6543", is_email=False) is None
+    assert normalize_address(None, is_email=False) is None
+    stats = get_stats()
+    print(f"Phone cache stats: {stats}")
+    assert stats['hits'] + stats['misses'] >= 3
+
+def test_normalize_email():
+    print('test_normalize_email')
+    assert normalize_address("User@UseHatchApp.com", is_email=True) == "user@usehatchapp.com"
+    assert normalize_address("Contact <Contact@Gmail.com>", is_email=True) == "contact@gmail.com"
+    assert normalize_address("contact.gmail.com", is_email=True) is None
+    assert canonical_address(" +1 (201) 666-1234 ", "sms") == "+12016661234"
+
+print("=== Testing Address Normalization ===")
+print()
+test_normalize_phone()
+print()
+test_normalize_email()
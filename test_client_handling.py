@@ -1,4 +1,14 @@
-from client_integrations.providers import SmsProvider
+from client_integrations.providers import SmsProvider, CircuitOpenError
+from client_integrations.async_providers import AsyncSmsProvider
+from client_integrations.retry import RetryPolicy
+from client_integrations.rate_limit import RateLimiter, RatePolicy
+from client_integrations.circuit_breaker import CircuitBreaker
+from client_integrations.pool import ProviderPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import threading
+import time
+import httpx
 import requests_mock
 
 sms_client = SmsProvider(endpoint="https://api.verizon.com/sms/send")
@@ -15,13 +25,182 @@ def test_provider_client_retry():
     print('test_provider_client_retry')
     with requests_mock.Mocker() as m:
         matcher = m.post("https://api.verizon.com/sms/send", status_code=429)
-        provider_id = sms_client.send_with_retry({'body': 'this is a text'}, max_retries=2)
+        done = threading.Event()
+        results = []
+        provider_id = sms_client.send_with_retry(
+            {'body': 'this is a text'}, max_retries=2, retry_delay=0.01,
+            on_complete=lambda result: (results.append(result), done.set())
+        )
+        # retries are scheduled, not slept through
+        assert provider_id == None
+        assert done.wait(5)
+        assert results == [None]
         initial_call = 1
         retry_calls = matcher.call_count - initial_call
         print(f"Call count for 2 retries: {retry_calls}")
         assert provider_id == None
         assert retry_calls == 2
 
+def test_provider_client_retry_after():
+    print('test_provider_client_retry_after')
+    with requests_mock.Mocker() as m:
+        matcher = m.post("https://api.verizon.com/sms/send", [
+            {'status_code': 429, 'headers': {'Retry-After': '0.3'}},
+            {'status_code': 201, 'json': {'id': 'sms-456'}},
+        ])
+        done = threading.Event()
+        results = []
+        started = time.monotonic()
+        provider_id = sms_client.send_with_retry(
+            {'body': 'this is a text'}, retry_delay=0.01,
+            on_complete=lambda result: (results.append(time.monotonic() - started), results.append(result), done.set())
+        )
+        assert provider_id == None
+        assert done.wait(5)
+        print(f"Retried after {results[0]:.2f}s, got {results[1]}")
+        assert results[0] >= 0.3
+        assert results[1] == "sms-456"
+        assert matcher.call_count == 2
+
+def test_retry_policy_budget():
+    print('test_retry_policy_budget')
+    policy = RetryPolicy(max_retries=5, base_delay=1.0, max_delay=4.0, max_elapsed=10.0)
+    assert all(0 <= policy.next_delay(n) <= min(4.0, 2 ** (n - 1)) for n in range(1, 10))
+    assert policy.next_delay(1, retry_after=7.0) >= 7.0
+    assert policy.allows(5, 9.0)
+    assert not policy.allows(6, 1.0)
+    assert not policy.allows(1, 11.0)
+
+def test_rate_limiter():
+    print('test_rate_limiter')
+    limiter = RateLimiter('sms', RatePolicy(rate=10, burst=2, per_sender_rate=1, per_sender_burst=1))
+    assert limiter.acquire({'from': '+12016661234'}) == 0
+    # per-sender bucket is empty, nothing is taken from the global one
+    assert limiter.acquire({'from': '+12016661234'}) > 0
+    assert limiter.acquire({'from': '+18045551234'}) == 0
+    # global burst of 2 used up: acquiring refuses, reserving books the next slot
+    assert limiter.acquire({'from': '+13125550000'}) > 0
+    first = limiter.reserve({'from': '+13125550001'})
+    second = limiter.reserve({'from': '+13125550002'})
+    print(f"Reserved slots in {first:.3f}s and {second:.3f}s")
+    assert 0 < first < second
+    assert abs((second - first) - 0.1) < 0.01
+
+def test_rate_limit_wait_budget():
+    print('test_rate_limit_wait_budget')
+    limiter = RateLimiter('sms', RatePolicy(rate=1, burst=1))
+    client = SmsProvider(endpoint="https://api.verizon.com/sms/send", rate_limiter=limiter,
+                         retry_policy=RetryPolicy(max_elapsed=1.5))
+    client.simulate('sms')
+    done = threading.Event()
+    results = []
+    on_complete = lambda result: (results.append(result), done.set())
+    assert client.send_with_retry({'body': 'first'}, on_complete=on_complete).startswith('sms-')
+    # the next slot is a second away, within the budget: booked and sent then
+    assert client.send_with_retry({'body': 'second'}, on_complete=on_complete) == None
+    # the one after is two seconds away, past it: given up without booking
+    assert client.send_with_retry({'body': 'third'}, on_complete=on_complete) == None
+    wait = limiter.reserve({'body': 'probe'})
+    print(f"Next slot in {wait:.2f}s")
+    assert 1.5 < wait < 2.1
+    assert limiter.reserve({'body': 'probe'}, max_wait=1.0) > 1.0
+    assert done.wait(5)
+    time.sleep(0.1)
+    assert len(results) == 1 and results[0].startswith('sms-')
+
+    async def run():
+        async_client = AsyncSmsProvider(endpoint="https://api.verizon.com/sms/send",
+                                        rate_limiter=RateLimiter('sms', RatePolicy(rate=1, burst=1)),
+                                        retry_policy=RetryPolicy(max_elapsed=0.5))
+        async_client.simulate('sms')
+        first = await async_client.send_with_retry({'body': 'first'})
+        second = await async_client.send_with_retry({'body': 'second'})
+        await async_client.aclose()
+        return first, second, async_client.rate_limiter.get_stats()
+
+    first, second, stats = asyncio.run(run())
+    assert first.startswith('sms-') and second == None
+    assert (stats['allowed'], stats['throttled']) == (1, 1)
+
+def test_provider_client_circuit_breaker():
+    print('test_provider_client_circuit_breaker')
+    breaker = CircuitBreaker(failure_rate_threshold=0.5, minimum_calls=4, open_seconds=0.2, half_open_probes=1)
+    client = SmsProvider(endpoint="https://api.verizon.com/sms/send", circuit_breaker=breaker)
+    with requests_mock.Mocker() as m:
+        matcher = m.post("https://api.verizon.com/sms/send", status_code=503)
+        for _ in range(4):
+            assert client.send_with_retry({'body': 'this is a text'}) == None
+        assert breaker.state == 'open'
+        # open circuit fails fast without calling the provider
+        try:
+            client.send_once({'body': 'this is a text'})
+            assert False, "expected CircuitOpenError"
+        except CircuitOpenError as e:
+            assert e.retry_after > 0
+        assert matcher.call_count == 4
+
+        time.sleep(0.25)
+        m.post("https://api.verizon.com/sms/send", json={"id": "sms-789"}, status_code=201)
+        assert client.send_once({'body': 'this is a text'}) == "sms-789"
+        print(f"Breaker after probe: {breaker.snapshot()}")
+        assert breaker.state == 'closed'
+        assert breaker.transitions == {'closed->open': 1, 'open->half_open': 1, 'half_open->closed': 1}
+
+def test_provider_pool_failover():
+    print('test_provider_pool_failover')
+    pool = ProviderPool([
+        SmsProvider(endpoint="https://east.verizon.com/sms/send"),
+        SmsProvider(endpoint="https://west.verizon.com/sms/send"),
+    ], weights=[1, 1e-9])
+    with requests_mock.Mocker() as m:
+        m.post("https://east.verizon.com/sms/send", status_code=502)
+        m.post("https://west.verizon.com/sms/send", json={"id": "sms-west"}, status_code=201)
+        provider_id = pool.send_with_retry({'body': 'this is a text'})
+        stats = pool.get_stats()
+        print(f"Pool result {provider_id}, routed {[e['routed'] for e in stats['endpoints']]}")
+        assert provider_id == "sms-west"
+        assert stats['failovers'] == 1
+
+def test_provider_pool_hedging():
+    print('test_provider_pool_hedging')
+
+    # requests_mock serializes requests, so hedging needs a real (threaded) server
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            if self.path.startswith('/east'):
+                time.sleep(0.5)
+            body = ('{"id": "sms-%s"}' % self.path.split('/')[1]).encode()
+            self.send_response(201)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        base = f"http://127.0.0.1:{server.server_port}"
+        pool = ProviderPool([
+            SmsProvider(endpoint=f"{base}/east/sms/send"),
+            SmsProvider(endpoint=f"{base}/west/sms/send"),
+        ], weights=[1, 1e-9], hedge=True, hedge_min_delay=0.05)
+        started = time.monotonic()
+        provider_id = pool.send_with_retry({'body': 'this is a text'})
+        elapsed = time.monotonic() - started
+        stats = pool.get_stats()
+        print(f"Hedged result {provider_id} in {elapsed:.2f}s, hedged {stats['hedged']}")
+        assert provider_id == "sms-west"
+        assert elapsed < 0.4
+        assert stats['hedged'] == 1 and stats['hedge_wins'] == 1
+    finally:
+        server.shutdown()
+
 def test_provider_client_bad_request():
     print('test_provider_client_bad_request')
     with requests_mock.Mocker() as m:
@@ -38,14 +217,160 @@ def test_provider_client_server_error():
         print(f"No ID after Server Error:  {provider_id} -end")
         assert provider_id == None
 
+def test_provider_client_simulation():
+    print('test_provider_client_simulation')
+    client = SmsProvider(endpoint="https://api.verizon.com/sms/send")
+    client.simulate('sms')
+    first = client.send_with_retry({'body': 'this is a text'})
+    second = client.send_with_retry({'body': 'this is a text'})
+    print(f"Simulated IDs: {first}, {second}")
+    assert first.startswith('sms-') and second.startswith('sms-')
+    assert first != second
+    assert client.get_stats()['requests'] == 2
+
+def test_provider_client_connection_reuse():
+    print('test_provider_client_connection_reuse')
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            body = b'{"id": "sms-local"}'
+            self.send_response(201)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = SmsProvider(endpoint=f"http://127.0.0.1:{server.server_port}/sms/send")
+        for _ in range(5):
+            assert client.send_with_retry({'body': 'this is a text'}) == "sms-local"
+        stats = client.get_stats()
+        print(f"Connection stats: {stats}")
+        assert stats['new_connections'] == 1
+        assert stats['reused_connections'] == 4
+    finally:
+        server.shutdown()
+
+def test_async_provider_retry_after():
+    print('test_async_provider_retry_after')
+    responses = [
+        httpx.Response(429, headers={'Retry-After': '0.2'}),
+        httpx.Response(201, json={'id': 'sms-async'}),
+    ]
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return responses[len(calls) - 1]
+
+    async def run():
+        client = AsyncSmsProvider(endpoint="https://api.verizon.com/sms/send",
+                                  transport=httpx.MockTransport(handler))
+        done = asyncio.Event()
+        results = []
+
+        async def on_complete(result):
+            results.append(result)
+            done.set()
+
+        started = time.monotonic()
+        provider_id = await client.send_with_retry({'body': 'this is a text'}, retry_delay=0.01,
+                                                   on_complete=on_complete)
+        # the retry is a task on the loop, not a sleep in the request
+        assert provider_id == None
+        await asyncio.wait_for(done.wait(), 5)
+        elapsed = time.monotonic() - started
+        await client.aclose()
+        return results, elapsed, client.get_stats()
+
+    results, elapsed, stats = asyncio.run(run())
+    print(f"Retried after {elapsed:.2f}s, got {results}")
+    assert results == ['sms-async']
+    assert elapsed >= 0.2
+    assert len(calls) == 2
+    assert stats['outcomes'] == {'rate_limited': 1, 'ok': 1}
+    assert stats['retries'] == 1
+
+def test_async_provider_shares_sync_state():
+    print('test_async_provider_shares_sync_state')
+    sync_client = SmsProvider(endpoint="https://api.verizon.com/sms/send",
+                              circuit_breaker=CircuitBreaker(minimum_calls=2, failure_rate_threshold=0.5))
+    client = AsyncSmsProvider.from_provider(sync_client)
+    client.simulate('sms')
+    client.circuit_breaker.record_failure()
+    client.circuit_breaker.record_failure()
+    assert sync_client.circuit_open()
+
+    async def run():
+        try:
+            return await client.send_once({'body': 'this is a text'})
+        except CircuitOpenError as e:
+            return e
+
+    assert isinstance(asyncio.run(run()), CircuitOpenError)
+    assert sync_client.get_stats()['outcomes'] == {'circuit_open': 1}
+
+def test_async_provider_errors():
+    print('test_async_provider_errors')
+
+    def handler(request):
+        if request.url.path == '/bad':
+            return httpx.Response(400)
+        raise httpx.ConnectError("connection refused", request=request)
+
+    async def run():
+        bad = AsyncSmsProvider(endpoint="https://api.verizon.com/bad", transport=httpx.MockTransport(handler))
+        down = AsyncSmsProvider(endpoint="https://api.verizon.com/down", transport=httpx.MockTransport(handler))
+        return (await bad.send_with_retry({'body': 'x'}), bad.get_stats(),
+                await down.send_with_retry({'body': 'x'}), down.get_stats())
+
+    bad_id, bad_stats, down_id, down_stats = asyncio.run(run())
+    assert bad_id == None and down_id == None
+    assert bad_stats['outcomes'] == {'client_error': 1}
+    assert bad_stats['circuit_breaker']['window_calls'] == 1
+    assert down_stats['outcomes'] == {'no_response': 1}
+
+
 print("=== Testing Provider Client Handling ===")
 print()
 test_provider_client_success()
 print()
 test_provider_client_retry()
 print()
+test_provider_client_retry_after()
+print()
+test_retry_policy_budget()
+print()
+test_rate_limiter()
+print()
+test_rate_limit_wait_budget()
+print()
+test_provider_client_circuit_breaker()
+print()
+test_provider_pool_failover()
+print()
+test_provider_pool_hedging()
+print()
 test_provider_client_bad_request()
 print()
 test_provider_client_server_error()
 print()
+test_provider_client_simulation()
+print()
+test_provider_client_connection_reuse()
+print()
+test_async_provider_retry_after()
+print()
+test_async_provider_shares_sync_state()
+print()
+test_async_provider_errors()
+print()
 print("=== Test script completed ===")
\ No newline at end of file
@@ -0,0 +1,39 @@
+from app.cache import ConversationCache
+import time
+import uuid
+
+
+def test_conversation_cache_lru():
+    print('test_conversation_cache_lru')
+    cache = ConversationCache(max_size=2, ttl_seconds=60)
+    ids = [uuid.uuid4() for _ in range(3)]
+    cache.put('a|b', ids[0])
+    cache.put('a|c', ids[1])
+    assert cache.get('a|b') == ids[0]  # a|b is now most recently used
+    cache.put('a|d', ids[2])
+    stats = cache.get_stats()
+    print(f"Cache stats: {stats}")
+    assert cache.get('a|c') is None
+    assert cache.get('a|b') == ids[0]
+    assert stats['evictions'] == 1 and stats['hits'] == 1
+
+def test_conversation_cache_ttl_and_invalidation():
+    print('test_conversation_cache_ttl_and_invalidation')
+    cache = ConversationCache(max_size=10, ttl_seconds=0.05)
+    conversation_id = uuid.uuid4()
+    cache.put('a|b', conversation_id)
+    assert cache.get('a|b') == conversation_id
+    time.sleep(0.06)
+    assert cache.get('a|b') is None
+    assert cache.get_stats()['expirations'] == 1
+
+    cache.put('a|b', conversation_id)
+    cache.invalidate_id(conversation_id)
+    assert cache.get('a|b') is None
+    assert cache.get_stats()['invalidations'] == 1
+
+print("=== Testing Conversation Cache ===")
+print()
+test_conversation_cache_lru()
+print()
+test_conversation_cache_ttl_and_invalidation()
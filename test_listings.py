@@ -0,0 +1,76 @@
+from testing import create_test_app, webhook
+
+
+def walk(client, url: str, limit: int) -> list:
+    """
+    Follows next_cursor from the first page to the last; returns the pages.
+    """
+    pages = []
+    resp = client.get(f'{url}?limit={limit}').get_json()
+    pages.append(resp)
+    while resp['next_cursor']:
+        resp = client.get(f"{url}?limit={limit}&after={resp['next_cursor']}").get_json()
+        pages.append(resp)
+    return pages
+
+
+def test_message_keyset_pagination():
+    print('test_message_keyset_pagination')
+    client = create_test_app().test_client()
+    # ties on timestamp are ordered by id
+    timestamps = ["2024-11-01T14:00:00Z", "2024-11-01T14:01:00Z", "2024-11-01T14:02:00Z",
+                  "2024-11-01T14:02:00Z", "2024-11-01T14:02:00Z", "2024-12-01T09:00:00Z",
+                  "2024-12-01T09:00:00Z"]
+    for i, timestamp in enumerate(timestamps):
+        assert client.post('/api/webhooks/sms', json=webhook(f'page-{i}', timestamp=timestamp)).status_code == 201
+
+    conversation_id = client.get('/api/conversations').get_json()['conversations'][0]['id']
+    url = f'/api/conversations/{conversation_id}/messages'
+    everything = client.get(f'{url}?limit=100').get_json()['messages']
+    assert len(everything) == len(timestamps)
+    assert [(m['timestamp'], m['id']) for m in everything] == sorted((m['timestamp'], m['id']) for m in everything)
+
+    pages = walk(client, url, 3)
+    print([[m['provider_message_id'] for m in page['messages']] for page in pages])
+    assert [len(page['messages']) for page in pages] == [3, 3, 1]
+    assert [m['id'] for page in pages for m in page['messages']] == [m['id'] for m in everything]
+    assert pages[0]['prev_cursor'] is None
+    assert pages[-1]['next_cursor'] is None
+
+    # and back again from the last page
+    back = client.get(f"{url}?limit=3&before={pages[-1]['prev_cursor']}").get_json()
+    assert back['messages'] == pages[1]['messages']
+    back = client.get(f"{url}?limit=3&before={back['prev_cursor']}").get_json()
+    assert back['messages'] == pages[0]['messages']
+    assert back['prev_cursor'] is None
+
+    assert client.get(f'{url}?after=nonsense').status_code == 400
+    assert client.get(f"{url}?after={pages[0]['next_cursor']}&before={pages[0]['next_cursor']}").status_code == 400
+
+def test_conversation_keyset_pagination():
+    print('test_conversation_keyset_pagination')
+    client = create_test_app().test_client()
+    # one conversation per sender, all last active at the same minute but two
+    for i in range(5):
+        timestamp = "2024-11-01T14:00:00Z" if i < 3 else f"2024-11-0{i}T14:00:00Z"
+        payload = webhook(f'conv-{i}', timestamp=timestamp, **{"from": f"+1804555000{i}"})
+        assert client.post('/api/webhooks/sms', json=payload).status_code == 201
+
+    everything = client.get('/api/conversations?limit=100').get_json()['conversations']
+    assert len(everything) == 5
+    # most recently active first
+    activity = [c['last_message_at'] for c in everything]
+    assert activity == sorted(activity, reverse=True)
+
+    pages = walk(client, '/api/conversations', 2)
+    assert [len(page['conversations']) for page in pages] == [2, 2, 1]
+    assert [c['id'] for page in pages for c in page['conversations']] == [c['id'] for c in everything]
+
+    back = client.get(f"/api/conversations?limit=2&before={pages[-1]['prev_cursor']}").get_json()
+    assert back['conversations'] == pages[1]['conversations']
+
+print("=== Testing Listings ===")
+print()
+test_message_keyset_pagination()
+print()
+test_conversation_keyset_pagination()
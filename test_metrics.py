@@ -0,0 +1,74 @@
+from flask import Flask
+from sqlalchemy import create_engine, text
+from app.metrics import Metrics, Histogram, Counter, Family, phase
+
+
+def test_histogram_render():
+    print('test_histogram_render')
+    histogram = Histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, '/a')
+    rendered = histogram.collect().render()
+    print(rendered)
+    assert '# TYPE latency_seconds histogram' in rendered
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 2' in rendered
+    assert 'latency_seconds_bucket{route="/a",le="1"} 3' in rendered
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in rendered
+    assert 'latency_seconds_sum{route="/a"} 3.65' in rendered
+    assert 'latency_seconds_count{route="/a"} 4' in rendered
+
+def test_counter_and_label_escaping():
+    print('test_counter_and_label_escaping')
+    counter = Counter('sends', 'Sends.', ('outcome',))
+    counter.inc('ok')
+    counter.inc('ok', amount=2)
+    assert 'sends_total{outcome="ok"} 3' in counter.collect().render()
+    family = Family('thing', 'gauge', 'A thing.').add(1, name='say "hi"\\\n')
+    assert 'thing{name="say \\"hi\\"\\\\\\n"} 1' in family.render()
+
+def test_request_instrumentation():
+    print('test_request_instrumentation')
+    app = Flask(__name__)
+    engine = create_engine('sqlite://')
+    metrics = Metrics(slow_request_ms=0.001)
+    metrics.install(app, {'primary': engine})
+
+    @app.route('/items/<int:item_id>')
+    def item(item_id):
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 1')).all()
+            conn.execute(text('SELECT 2')).all()
+        with phase('provider'):
+            pass
+        return {"id": item_id}
+
+    client = app.test_client()
+    assert client.get('/items/1').status_code == 200
+    assert client.get('/items/2').status_code == 200
+    assert client.get('/missing').status_code == 404
+    rendered = metrics.render()
+    print(rendered)
+    # labelled by route template, not by path
+    assert 'http_request_duration_seconds_count{method="GET",route="/items/<int:item_id>",status="200"} 2' in rendered
+    assert 'http_request_duration_seconds_count{method="GET",route="<unmatched>",status="404"} 1' in rendered
+    assert 'http_request_db_queries_sum{route="/items/<int:item_id>"} 4' in rendered
+    assert 'db_query_duration_seconds_count{engine="primary",operation="select"} 4' in rendered
+    assert 'http_slow_requests_total{route="/items/<int:item_id>"} 2' in rendered
+
+def test_failed_query_instrumentation():
+    print('test_failed_query_instrumentation')
+    engine = create_engine('sqlite://')
+    metrics = Metrics()
+    metrics.install(Flask(__name__), {'primary': engine})
+    with engine.connect() as conn:
+        for _ in range(3):
+            try:
+                conn.execute(text('SELECT * FROM missing'))
+            except Exception:
+                pass
+        conn.execute(text('SELECT 1')).all()
+        assert not conn.info
+    rendered = metrics.render()
+    print(rendered)
+    # the failed statements are timed too, and nothing is left on the connection
+    assert 'db_query_duration_seconds_count{engine="primary",operation="select"} 4' in rendered
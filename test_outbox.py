@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta, timezone
+
+import requests_mock
+
+from app import db
+from app.service import claim_outbox_batch, dispatch_outbox_entry, update_leased_entry
+from testing import create_test_app
+
+
+def queue_messages(app, count: int) -> list:
+    """
+    Sends count SMS through the API in outbox mode; returns their message ids.
+    """
+    client = app.test_client()
+    message_ids = []
+    for i in range(count):
+        resp = client.post('/api/messages/sms', json={
+            "from": "+12016661234",
+            "to": "+18045551234",
+            "type": "sms",
+            "body": f"queued {i}",
+            "attachments": None,
+            "timestamp": "2024-11-01T14:00:00Z"
+        })
+        assert resp.status_code == 202
+        assert resp.get_json()['status'] == 'queued'
+        message_ids.append(resp.get_json()['message_id'])
+    return message_ids
+
+
+def provider_answers(app, status_code: int, headers: dict = None):
+    """
+    Makes the SMS provider answer every send with status_code.
+    """
+    provider = app.config['sms_provider']
+    adapter = requests_mock.Adapter()
+    adapter.register_uri('POST', provider.endpoint, status_code=status_code, headers=headers or {},
+                         json={"error": "nope"})
+    provider.mount(provider.endpoint, adapter)
+
+
+def outbox_row(entry_id):
+    return db.session.execute(
+        db.text("SELECT status, attempts, next_attempt_at, last_error FROM outbox WHERE id = :id"),
+        {"id": entry_id}
+    ).one()
+
+
+def test_outbox_claim_skips_locked_rows():
+    print('test_outbox_claim_skips_locked_rows')
+    app = create_test_app(OUTBOX_ENABLED=True)
+    queue_messages(app, 3)
+    with app.app_context():
+        locked_id = db.session.execute(db.text("SELECT id FROM outbox ORDER BY id LIMIT 1")).scalar()
+        db.session.rollback()
+
+        # another worker holding one row, on its own connection
+        with db.engine.connect() as other:
+            other.execute(db.text("SELECT id FROM outbox WHERE id = :id FOR UPDATE"), {"id": locked_id})
+            entries, lease = claim_outbox_batch(10, 60)
+            print([str(entry.id) for entry in entries], locked_id)
+            assert len(entries) == 2
+            assert locked_id not in [entry.id for entry in entries]
+            # columns are stored as naive UTC
+            for entry in entries:
+                assert (entry.status, entry.attempts) == ('in_flight', 1)
+                assert entry.next_attempt_at == lease.replace(tzinfo=None)
+            other.rollback()
+
+        # the claimed two are leased; only the one that was locked is left
+        entries, _ = claim_outbox_batch(10, 60)
+        assert [entry.id for entry in entries] == [locked_id]
+        assert claim_outbox_batch(10, 60)[0] == []
+
+def test_outbox_expired_lease_is_reclaimed():
+    print('test_outbox_expired_lease_is_reclaimed')
+    app = create_test_app(OUTBOX_ENABLED=True)
+    message_id, = queue_messages(app, 1)
+    with app.app_context():
+        # a worker whose lease has already run out
+        (entry,), stale_lease = claim_outbox_batch(10, -1)
+        (reclaimed,), lease = claim_outbox_batch(10, 60)
+        assert reclaimed.id == entry.id
+        assert reclaimed.attempts == 2
+
+        # the first worker can no longer write to it, or send it
+        assert not update_leased_entry(entry, stale_lease, status='failed')
+        assert not dispatch_outbox_entry(entry, stale_lease)
+        status, attempts, next_attempt_at, _ = outbox_row(entry.id)
+        assert (status, attempts) == ('in_flight', 2)
+        assert next_attempt_at == lease.replace(tzinfo=None)
+
+        # the holder renews the lease as it sends, and records the provider id
+        assert dispatch_outbox_entry(reclaimed, lease, lease_seconds=60)
+        status, attempts, next_attempt_at, last_error = outbox_row(entry.id)
+        print(status, attempts, next_attempt_at, last_error)
+        assert (status, attempts, last_error) == ('sent', 2, None)
+        assert next_attempt_at > lease.replace(tzinfo=None)
+        provider_message_id = db.session.execute(
+            db.text("SELECT provider_message_id FROM messages WHERE id = :id"), {"id": message_id}
+        ).scalar()
+        assert provider_message_id.startswith('sms-')
+
+def test_outbox_requeues_when_rate_limited():
+    print('test_outbox_requeues_when_rate_limited')
+    app = create_test_app(OUTBOX_ENABLED=True, PROVIDER_RETRY_MAX_DELAY=60, PROVIDER_RETRY_BUDGET=120)
+    queue_messages(app, 1)
+    provider_answers(app, 429, {"Retry-After": "30"})
+    with app.app_context():
+        before = datetime.now(timezone.utc).replace(tzinfo=None)
+        (entry,), lease = claim_outbox_batch(10, 60)
+        assert not dispatch_outbox_entry(entry, lease)
+        status, attempts, next_attempt_at, last_error = outbox_row(entry.id)
+        print(status, attempts, next_attempt_at, last_error)
+        assert (status, attempts) == ('pending', 1)
+        assert next_attempt_at >= before + timedelta(seconds=30)
+        assert last_error.startswith('[429]')
+        assert app.config['sms_provider'].stats.snapshot()['retries'] == 1
+        # parked until then
+        assert claim_outbox_batch(10, 60)[0] == []
+
+def test_outbox_requeues_when_circuit_open():
+    print('test_outbox_requeues_when_circuit_open')
+    app = create_test_app(OUTBOX_ENABLED=True, CIRCUIT_MIN_CALLS=2, CIRCUIT_OPEN_SECONDS=30)
+    queue_messages(app, 1)
+    breaker = app.config['sms_provider'].circuit_breaker
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.is_open()
+    with app.app_context():
+        before = datetime.now(timezone.utc).replace(tzinfo=None)
+        (entry,), lease = claim_outbox_batch(10, 60)
+        assert not dispatch_outbox_entry(entry, lease)
+        status, attempts, next_attempt_at, last_error = outbox_row(entry.id)
+        print(status, attempts, next_attempt_at, last_error)
+        # the attempt it was claimed with is given back
+        assert (status, attempts) == ('pending', 0)
+        assert next_attempt_at > before + timedelta(seconds=25)
+        assert 'Circuit open' in last_error
+
+def test_outbox_marks_failed():
+    print('test_outbox_marks_failed')
+    # rejected by the provider: final on the first attempt
+    app = create_test_app(OUTBOX_ENABLED=True)
+    queue_messages(app, 1)
+    provider_answers(app, 400)
+    with app.app_context():
+        (entry,), lease = claim_outbox_batch(10, 60)
+        assert not dispatch_outbox_entry(entry, lease)
+        status, attempts, _, last_error = outbox_row(entry.id)
+        print(status, attempts, last_error)
+        assert (status, attempts, last_error) == ('failed', 1, "Provider did not return a message id")
+
+    # rate limited with no retries left
+    app = create_test_app(OUTBOX_ENABLED=True, PROVIDER_MAX_RETRIES=0)
+    queue_messages(app, 1)
+    provider_answers(app, 429)
+    with app.app_context():
+        (entry,), lease = claim_outbox_batch(10, 60)
+        assert not dispatch_outbox_entry(entry, lease)
+        status, attempts, _, last_error = outbox_row(entry.id)
+        print(status, attempts, last_error)
+        assert (status, attempts) == ('failed', 1)
+        assert last_error.startswith('[429]')
+        assert claim_outbox_batch(10, 60)[0] == []
+
+print("=== Testing Outbox ===")
+print()
+test_outbox_claim_skips_locked_rows()
+print()
+test_outbox_expired_lease_is_reclaimed()
+print()
+test_outbox_requeues_when_rate_limited()
+print()
+test_outbox_requeues_when_circuit_open()
+print()
+test_outbox_marks_failed()
@@ -0,0 +1,76 @@
+from app import db
+from app.partitions import (
+    month_start, add_months, partition_name, partition_month, retention_cutoff, partition_window,
+    attached_partitions, create_partition, archive_partition
+)
+from datetime import datetime
+from testing import create_test_app, webhook
+import tempfile
+
+
+def test_partition_months():
+    print('test_partition_months')
+    month = month_start(datetime(2026, 12, 31, 23, 59))
+    assert month == datetime(2026, 12, 1)
+    assert add_months(month, 1) == datetime(2027, 1, 1)
+    assert add_months(month, -12) == datetime(2025, 12, 1)
+    assert add_months(datetime(2026, 1, 1), -1) == datetime(2025, 12, 1)
+    assert partition_name(month) == 'messages_p202612'
+    assert partition_month('messages_p202612') == month
+    assert partition_month('messages_default') is None
+
+def test_retention_cutoff():
+    print('test_retention_cutoff')
+    now = datetime(2026, 3, 15, 12, 0)
+    # the current month and the 3 before it are kept
+    assert retention_cutoff(now, 3) == datetime(2025, 12, 1)
+    assert partition_month('messages_p202511') < retention_cutoff(now, 3)
+    assert not partition_month('messages_p202512') < retention_cutoff(now, 3)
+
+def test_partition_window():
+    print('test_partition_window')
+    first, end = partition_window(datetime(2026, 3, 15), months_ahead=3, months_back=24)
+    assert first == datetime(2024, 3, 1)
+    assert end == datetime(2026, 7, 1)  # June is the last month inside
+
+def test_archive_refreshes_conversation_summaries():
+    print('test_archive_refreshes_conversation_summaries')
+    # no recent id filter, so redeliveries below are checked against the database
+    app = create_test_app(RECENT_MESSAGE_ID_FILTER_SIZE=0)
+    client = app.test_client()
+    month = datetime(2020, 3, 1)
+    for payload in (
+        webhook('a-1', timestamp="2020-03-10T10:00:00Z", body="archived"),
+        webhook('a-2', timestamp="2024-11-01T10:00:00Z", body="kept"),
+        webhook('a-3', timestamp="2020-03-11T10:00:00Z", body="archived too", to="+12016665678"),
+    ):
+        assert client.post('/api/webhooks/sms', json=payload).status_code == 201
+    with app.app_context():
+        with db.engine.begin() as conn:
+            if partition_name(month) not in attached_partitions(conn):
+                create_partition(conn, month)
+        archive_partition(partition_name(month), tempfile.mkdtemp())
+
+    conversations = {c['participant_2']: c for c in client.get('/api/conversations').get_json()['conversations']}
+    print(conversations)
+    kept = conversations['+12016661234']
+    assert (kept['message_count'], kept['last_message_preview']) == (1, "kept")
+    messages = client.get(f"/api/conversations/{kept['id']}/messages").get_json()['messages']
+    assert [message['body'] for message in messages] == ["kept"]
+    emptied = conversations['+12016665678']
+    assert (emptied['message_count'], emptied['last_message_preview'], emptied['last_message_type']) == (0, None, None)
+    assert emptied['last_message_at'] == emptied['created_at']
+
+    # the archived messages' dedupe claims went with them
+    assert client.post('/api/webhooks/sms', json=webhook('a-1', timestamp="2020-03-10T10:00:00Z")).status_code == 201
+    assert client.post('/api/webhooks/sms', json=webhook('a-2', timestamp="2024-11-01T10:00:00Z")).status_code == 200
+
+print("=== Testing Partition Months ===")
+print()
+test_partition_months()
+print()
+test_retention_cutoff()
+print()
+test_partition_window()
+print()
+test_archive_refreshes_conversation_summaries()
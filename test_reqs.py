@@ -29,7 +29,7 @@ def main():
         "timestamp": "2024-11-01T14:00:00Z"
     })
     print_response(resp)
-    assert resp.status_code == 201
+    assert resp.status_code in (201, 202)  # 202 when queued in outbox mode
 
     # Test 2: Send MMS
     print("2. Testing MMS send...")
@@ -42,7 +42,7 @@ def main():
         "timestamp": "2024-11-01T14:00:00Z"
     })
     print_response(resp)
-    assert resp.status_code == 201
+    assert resp.status_code in (201, 202)  # 202 when queued in outbox mode
 
     # Test 3: Send Email
     print("3. Testing Email send...")
@@ -54,7 +54,25 @@ def main():
         "timestamp": "2024-11-01T14:00:00Z"
     })
     print_response(resp)
-    assert resp.status_code == 201
+    assert resp.status_code in (201, 202)  # 202 when queued in outbox mode
+
+    # Test 3b: Broadcast one SMS to several recipients
+    print("3b. Testing SMS broadcast...")
+    resp = requests.post(f"{BASE_URL}/api/broadcasts/sms", headers=HEADERS, json={
+        "from": "+12016661234",
+        "type": "sms",
+        "to": ["+18045551234", "+1 804 555 1235", "+18045551234", "not-a-number"],
+        "body": "Hello everyone! This is a test broadcast.",
+        "attachments": None,
+        "timestamp": "2024-11-01T14:00:00Z"
+    })
+    print_response(resp)
+    assert resp.status_code == 202
+    assert resp.json()["recipients"] == 2 and resp.json()["duplicates"] == 1 and len(resp.json()["rejected"]) == 1
+    resp = requests.get(f"{BASE_URL}/api/broadcasts/{resp.json()['broadcast_id']}", headers=HEADERS)
+    print_response(resp)
+    assert resp.status_code == 200
+    assert resp.json()["sent"] + resp.json()["failed"] + resp.json()["pending"] == 2
 
     # Test 4: Incoming SMS webhook
     print("4. Testing incoming SMS webhook...")
@@ -68,7 +86,7 @@ def main():
         "timestamp": "2024-11-01T14:00:00Z"
     })
     print_response(resp)
-    assert resp.status_code == 201
+    assert resp.status_code in (200, 201)  # 200 when already stored by an earlier run
 
     # Test 5: Incoming MMS webhook
     print("5. Testing incoming MMS webhook...")
@@ -82,7 +100,7 @@ def main():
         "timestamp": "2024-11-01T14:00:00Z"
     })
     print_response(resp)
-    assert resp.status_code == 201
+    assert resp.status_code in (200, 201)  # 200 when already stored by an earlier run
 
     # Test 6: Incoming Email webhook
     print("6. Testing incoming Email webhook...")
@@ -95,14 +113,28 @@ def main():
         "timestamp": "2024-11-01T14:00:00Z"
     })
     print_response(resp)
-    assert resp.status_code == 201
+    assert resp.status_code in (200, 201)  # 200 when already stored by an earlier run
+
+    # Test 6b: Redelivered webhook is stored once
+    print("6b. Testing redelivered SMS webhook...")
+    resp = requests.post(f"{BASE_URL}/api/webhooks/sms", headers=HEADERS, json={
+        "from": "+18045551234",
+        "to": "+12016661234",
+        "type": "sms",
+        "messaging_provider_id": "message-1",
+        "body": "This is an incoming SMS message",
+        "attachments": None,
+        "timestamp": "2024-11-01T14:00:00Z"
+    })
+    print_response(resp)
+    assert resp.status_code == 200 and resp.json()["duplicate"]
 
     # Test 7: Get conversations
     print("7. Testing get conversations...")
     resp = requests.get(f"{BASE_URL}/api/conversations", headers=HEADERS)
     print_response(resp)
     try:
-        convos = resp.json()
+        convos = resp.json()["conversations"]
         convo_id = convos[0]["id"] if convos else None
         assert resp.status_code == 200
     except Exception:
@@ -117,6 +149,19 @@ def main():
     else:
         print("8. Skipped: No conversation found.\n")
 
+    # Test 8b: Search message bodies (tags are stripped from emails before indexing)
+    print("8b. Testing message search...")
+    resp = requests.get(f"{BASE_URL}/api/messages/search", headers=HEADERS, params={
+        "q": "incoming email", "participant": "contact@gmail.com", "type": "email", "direction": "inbound"
+    })
+    print_response(resp)
+    assert resp.status_code == 200
+    assert len(resp.json()["messages"]) >= 1
+    resp = requests.get(f"{BASE_URL}/api/messages/search", headers=HEADERS, params={"q": "body", "type": "email"})
+    assert resp.status_code == 200
+    # message-3 only says "body" inside its tags
+    assert all(m["provider_message_id"] != "message-3" for m in resp.json()["messages"])
+
     # Test 9: Failed Validation Phone
     print("9. Testing Failed Validation - Bad phone number...")
     resp = requests.post(f"{BASE_URL}/api/messages/sms", headers=HEADERS, json={
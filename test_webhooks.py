@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app.routes import payload_error
+from testing import create_test_app, webhook
+
+
+def test_webhook_type_validation():
+    print('test_webhook_type_validation')
+    assert payload_error(webhook('p-1')) is None
+    assert payload_error(webhook('p-1', type='mms')) is None
+    missing = webhook('p-1')
+    del missing['type']
+    assert payload_error(missing) == "'type' must be 'sms' or 'mms'"
+    assert payload_error(webhook('p-1', type='email')) == "'type' must be 'sms' or 'mms'"
+    assert payload_error(webhook('p-1', type='x' * 40)) == "'type' must be 'sms' or 'mms'"
+
+    client = create_test_app().test_client()
+    for payload in (missing, webhook('p-1', type='fax')):
+        resp = client.post('/api/webhooks/sms', json=payload)
+        print(resp.status_code, resp.get_json())
+        assert resp.status_code == 400
+        assert resp.get_json() == {"error": "'type' must be 'sms' or 'mms'"}
+    resp = client.post('/api/webhooks/sms', json=webhook('p-1'))
+    assert resp.status_code == 201
+
+def test_webhook_batch_mixed_items():
+    print('test_webhook_batch_mixed_items')
+    client = create_test_app().test_client()
+    missing_type = webhook('b-2')
+    del missing_type['type']
+    batch = [webhook('b-1'), missing_type, webhook('b-3', type='x' * 40), webhook('b-4', type='mms'), 'nope']
+    resp = client.post('/api/webhooks/sms/batch', json=batch)
+    body = resp.get_json()
+    print(resp.status_code, body)
+    assert resp.status_code == 200
+    assert (body['accepted'], body['rejected']) == (2, 3)
+    results = body['results']
+    assert [result['status'] for result in results] == [201, 400, 400, 201, 400]
+    assert [result['index'] for result in results] == [0, 1, 2, 3, 4]
+    assert results[1]['error'] == results[2]['error'] == "'type' must be 'sms' or 'mms'"
+
+    # the valid items were stored: sending them again finds them
+    resp = client.post('/api/webhooks/sms/batch', json={"messages": [webhook('b-1'), webhook('b-4', type='mms')]})
+    results = resp.get_json()['results']
+    assert [(result['status'], result.get('duplicate')) for result in results] == [(200, True), (200, True)]
+
+def test_webhook_redelivery_with_changed_timestamp():
+    print('test_webhook_redelivery_with_changed_timestamp')
+    # no recent id filter, so every redelivery is answered by the database
+    client = create_test_app(RECENT_MESSAGE_ID_FILTER_SIZE=0).test_client()
+    first = client.post('/api/webhooks/sms', json=webhook('r-1', timestamp="2024-11-01T14:00:00Z"))
+    assert first.status_code == 201
+    message_id = first.get_json()['message_id']
+
+    # a later month, so another partition than the stored copy
+    again = client.post('/api/webhooks/sms', json=webhook('r-1', timestamp="2024-12-05T09:30:00Z"))
+    print(again.status_code, again.get_json())
+    assert again.status_code == 200
+    assert again.get_json() == {"message_id": message_id, "duplicate": True}
+
+    resp = client.post('/api/webhooks/sms/batch', json=[
+        webhook('r-1', timestamp="2025-01-01T00:00:00Z"),
+        webhook('r-2', timestamp="2024-11-02T00:00:00Z"),
+        webhook('r-2', timestamp="2024-11-03T00:00:00Z"),
+    ])
+    results = resp.get_json()['results']
+    print(results)
+    assert [result['status'] for result in results] == [200, 201, 200]
+    assert results[0]['message_id'] == message_id
+    assert results[2]['message_id'] == results[1]['message_id']
+
+    conversation_id = client.get('/api/conversations').get_json()['conversations'][0]['id']
+    messages = client.get(f'/api/conversations/{conversation_id}/messages').get_json()['messages']
+    assert sorted(message['provider_message_id'] for message in messages) == ['r-1', 'r-2']
+
+def test_webhook_batch_bulk_insert():
+    print('test_webhook_batch_bulk_insert')
+    client = create_test_app().test_client()
+    # 40 messages from 4 senders, in one bulk insert
+    batch = [
+        webhook(f'bulk-{i}', timestamp=f"2024-11-01T14:{i:02d}:00Z", body=f"message {i}",
+                **{"from": f"+1804555000{i % 4}"})
+        for i in range(40)
+    ]
+    resp = client.post('/api/webhooks/sms/batch', json=batch)
+    body = resp.get_json()
+    assert (resp.status_code, body['accepted'], body['rejected']) == (200, 40, 0)
+    assert [result['index'] for result in body['results']] == list(range(40))
+    assert len({result['message_id'] for result in body['results']}) == 40
+
+    conversations = client.get('/api/conversations').get_json()['conversations']
+    print([(c['message_count'], c['last_message_preview']) for c in conversations])
+    assert len(conversations) == 4
+    # summaries count every row of the batch, and preview the latest one
+    assert sorted(c['message_count'] for c in conversations) == [10, 10, 10, 10]
+    assert sorted(c['last_message_preview'] for c in conversations) == [f"message {i}" for i in range(36, 40)]
+    for conversation in conversations:
+        messages = client.get(f"/api/conversations/{conversation['id']}/messages?limit=100").get_json()['messages']
+        assert len(messages) == 10
+
+def test_webhook_group_commit():
+    print('test_webhook_group_commit')
+    app = create_test_app(GROUP_COMMIT_ENABLED=True, GROUP_COMMIT_MAX_DELAY_MS=50, RECENT_MESSAGE_ID_FILTER_SIZE=0)
+    buffer = app.extensions['group_commit']
+
+    def post(provider_id):
+        return app.test_client().post('/api/webhooks/sms', json=webhook(provider_id))
+
+    # each id twice, all at once
+    provider_ids = [f'gc-{i % 20}' for i in range(40)]
+    with ThreadPoolExecutor(max_workers=40) as pool:
+        responses = list(pool.map(post, provider_ids))
+    stats = buffer.get_stats()
+    print(stats)
+    assert sorted(resp.status_code for resp in responses) == [200] * 20 + [201] * 20
+    # the requests were committed together rather than one transaction each
+    assert stats['flushed'] == 40
+    assert stats['flushes'] < 40
+    assert stats['failed'] == stats['rejected'] == 0
+
+    message_ids = {}
+    for provider_id, resp in zip(provider_ids, responses):
+        message_ids.setdefault(provider_id, set()).add(resp.get_json()['message_id'])
+    assert all(len(ids) == 1 for ids in message_ids.values())
+    conversation = app.test_client().get('/api/conversations').get_json()['conversations'][0]
+    assert conversation['message_count'] == 20
+    buffer.stop()
+
+print("=== Testing Webhooks ===")
+print()
+test_webhook_type_validation()
+print()
+test_webhook_batch_mixed_items()
+print()
+test_webhook_redelivery_with_changed_timestamp()
+print()
+test_webhook_batch_bulk_insert()
+print()
+test_webhook_group_commit()
@@ -0,0 +1,81 @@
+import os
+import psycopg2
+from psycopg2 import sql
+
+# Apps for the tests that need Postgres. They run against their own database,
+# TEST_DB_NAME (created if missing), with the DB_* settings from the environment
+# or the docker-compose defaults, and answer provider sends locally.
+
+TEST_ENV = {
+    "DB_HOST": "localhost",
+    "DB_USER": "messaging_user",
+    "DB_PASS": "messaging_password",
+    "VERIZON_POST_ENDPOINT": "https://api.verizon.com/sms/send",
+    "GMAIL_POST_ENDPOINT": "https://api.gmail.com/mail/send",
+}
+
+# everything a test may have written, children first
+TABLES = ('outbox', 'messages', 'inbound_message_ids', 'broadcasts', 'conversations')
+
+
+def ensure_test_database() -> str:
+    for name, value in TEST_ENV.items():
+        os.environ.setdefault(name, value)
+    name = os.environ.get('TEST_DB_NAME', 'messaging_service_test')
+    conn = psycopg2.connect(host=os.environ['DB_HOST'], port=5432, user=os.environ['DB_USER'],
+                            password=os.environ['DB_PASS'], dbname='postgres')
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+            if cur.fetchone() is None:
+                cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name)))
+    finally:
+        conn.close()
+    return name
+
+
+def create_test_app(**settings):
+    """
+    create_app on the test database, with settings (env name -> value) on
+    top of the environment for this app only. Tables are emptied first.
+    """
+    from app import create_app, db
+
+    overrides = {
+        "DB_NAME": ensure_test_database(),
+        "PROVIDER_SIMULATION": "true",
+        "BROADCAST_INPROCESS_DISPATCH": "false",
+        **{name: str(value) for name, value in settings.items()}
+    }
+    saved = {name: os.environ.get(name) for name in overrides}
+    os.environ.update(overrides)
+    try:
+        app = create_app()
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    with app.app_context():
+        db.session.execute(db.text(f"TRUNCATE {', '.join(TABLES)}"))
+        db.session.commit()
+    return app
+
+
+def webhook(provider_id: str, timestamp: str = "2024-11-01T14:00:00Z", **fields) -> dict:
+    """
+    An SMS webhook payload.
+    """
+    return {
+        "from": "+18045551234",
+        "to": "+12016661234",
+        "type": "sms",
+        "messaging_provider_id": provider_id,
+        "body": "text message",
+        "attachments": None,
+        "timestamp": timestamp,
+        **fields
+    }